@@ -3,154 +3,447 @@
 #----------------------------------------------------------------------------#
 
 import json
+import os
 import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
+import babel.dates
+import functools
+from datetime import datetime, timedelta, timezone
+from flask import Flask, Blueprint, render_template, request, Response, flash, redirect, url_for, jsonify, abort, current_app, stream_with_context
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from itsdangerous import BadData, URLSafeSerializer
 import logging
 from logging import Formatter, FileHandler, exception
 from flask_wtf import Form
-from sqlalchemy.orm import backref
 from forms import *
 from flask_migrate import Migrate
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy import func, or_, and_, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
 from models import * 
+from cache import Cache
+from counters import counters_cli, record_new_show, record_deleted_shows
+from bookings import shows_cli, show_end_time, booking_conflict
+from importer import import_cli
+from seed import seed_command
+from indexes import indexes_cli
+from autocomplete import Autocomplete
+from matchmaking import Matchmaking, Profile
+from assets import Assets, assets_cli
+from replicas import Replicas
+from geo import Geocoding, geo_cli, box_around, distance_km, nearby_venues
+from search import SearchIndex, search_cli, search_documents, remove_documents, KINDS
+from instrumentation import SQLInstrumentation, query_budget
+import ics
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db = SQLAlchemy(app)
-
-# connecte to a local postgresql database
-migrate = Migrate(app, db)
-
-#----------------------------------------------------------------------------#
-# Models.
-# in file (classes.py) 
-#----------------------------------------------------------------------------#
+# extensions are created once and bound to the app by create_app()
+moment = Moment()
+migrate = Migrate()
+# rendered pages are cached until a committed write touches what they show
+cache = Cache()
+# per-request query counts and timings, slow query and N+1 logs
+sql_instrumentation = SQLInstrumentation()
+# full-text documents rewritten with every flushed venue, artist and show
+search_index = SearchIndex()
+# venue and artist names for autocomplete, held in each worker process
+autocomplete = Autocomplete()
+# seeking venues ranked for artists and the other way round, held in each worker process
+matchmaking = Matchmaking()
+# hashed, precompressed static files from `flask assets build`
+assets = Assets()
+# GET requests read from the replicas in config.py, writes go to the primary
+replicas = Replicas()
+# venue positions from their address, see geo.py
+geocoding = Geocoding()
+
+bp = Blueprint('main', __name__)
+
+def create_app(config_object='config'):
+  app = Flask(__name__)
+  app.config.from_object(config_object)
+  configure_secret_key(app)
+  configure_engine(app)
+
+  db.init_app(app)
+  replicas.init_app(app, db)
+  migrate.init_app(app, db)
+  moment.init_app(app)
+  cache.init_app(app, db)
+  sql_instrumentation.init_app(app)
+  search_index.init_app(app, db)
+  autocomplete.init_app(app, db)
+  matchmaking.init_app(app, db)
+  assets.init_app(app)
+  geocoding.init_app(app)
+
+  app.add_template_filter(format_datetime, 'datetime')
+  app.register_blueprint(bp)
+  app.cli.add_command(counters_cli)
+  app.cli.add_command(import_cli)
+  app.cli.add_command(seed_command)
+  app.cli.add_command(indexes_cli)
+  app.cli.add_command(search_cli)
+  app.cli.add_command(shows_cli)
+  app.cli.add_command(assets_cli)
+  app.cli.add_command(geo_cli)
+
+  if not app.debug:
+    file_handler = FileHandler('error.log')
+    file_handler.setFormatter(
+        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    )
+    app.logger.setLevel(logging.INFO)
+    file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+    app.logger.info('errors')
 
+  return app
+
+def configure_secret_key(app):
+  # every worker signs and checks session cookies and edit forms with the
+  # same SECRET_KEY. a key made up per process would have the other workers
+  # drop the visitor's session, flashed messages and read-your-writes deadline
+  if app.config.get('SECRET_KEY'):
+    return
+  if not app.debug:
+    raise RuntimeError('SECRET_KEY is not set, see config.py')
+  app.logger.warning('SECRET_KEY is not set, using a key of this process only')
+  app.config['SECRET_KEY'] = os.urandom(32)
+
+def configure_engine(app):
+  # connection pool settings from config.py. the engine (and its pool) is only
+  # created on first use, so each pre-fork worker opens its own single pool.
+  # SQLite uses its own pool classes, which take none of these options.
+  if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    return
+  options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+  options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+  options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+  options.setdefault('pool_recycle', app.config['DB_POOL_RECYCLE'])
+  options.setdefault('pool_pre_ping', app.config['DB_POOL_PRE_PING'])
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma",
+}
 
-app.jinja_env.filters['datetime'] = format_datetime
+@functools.lru_cache(maxsize=None)
+def datetime_pattern(format, locale):
+  # babel parses a pattern string on every format_datetime call,
+  # compile each (format, locale) pair once instead.
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
 
-#----------------------------------------------------------------------------#
-# Controllers.
-#----------------------------------------------------------------------------#
+@functools.lru_cache(maxsize=4096)
+def format_datetime_cached(value, format, locale):
+  pattern, locale = datetime_pattern(format, locale)
+  if value.tzinfo is None:
+    # same as babel.dates.format_datetime: naive datetimes are taken as UTC
+    value = value.replace(tzinfo=babel.dates.UTC)
+  return pattern.apply(value, locale)
 
-@app.route('/')
-def index():
-  return render_template('pages/home.html')
+def format_datetime(value, format='medium', locale='en'):
+  # views pass datetime objects, strings are still accepted and parsed.
+  if not isinstance(value, datetime):
+    value = dateutil.parser.parse(value)
+  return format_datetime_cached(value, format, locale)
 
 
-#  Venues
-#  ----------------------------------------------------------------
-
-@app.route('/venues')
-def venues():
-  # replace with real venues data.
-  # num_shows should be aggregated based on number of upcoming shows per venue.
+#----------------------------------------------------------------------------#
+# Queries.
+#----------------------------------------------------------------------------#
 
-  data=[]
-  city_query=Venue.query.with_entities(Venue.city, Venue.state).distinct().all()
+def search_with_upcoming_shows(session, model, search_term, limit, offset):
+  # case-insensitive partial name search shared by venues and artists.
+  # names, upcoming show counts and the total match count come back in one query.
+  results = session.query(
+      model.id, model.name, model.upcoming_shows_count.label('num_upcoming_shows'),
+      func.count().over().label('total')) \
+    .filter(model.name.ilike('%' + search_term + '%')) \
+    .order_by(model.name, model.id) \
+    .limit(limit).offset(offset).all()
+
+  return {
+    "count": results[0].total if results else 0,
+    "data": [{
+      "id": r.id,
+      "name": r.name,
+      "num_upcoming_show": r.num_upcoming_shows
+    } for r in results]
+  }
 
-  for c in city_query:
+def shows_split_by_time(session, show_fk, entity_id, joined_model, *columns, window=None):
+  # upcoming shows (soonest first) and the most recent past shows of one venue
+  # or artist, split and ordered in SQL. `columns` are the Show and
+  # `joined_model` (Artist or Venue) columns loaded in the same query.
+  # past shows are capped at PAST_SHOWS_LIMIT, their full count is returned too.
+  # `window` narrows all three to its from/to start times.
+  now = datetime.now()
+  query = session.query(*columns, Show.start_time).select_from(Show) \
+    .join(joined_model).filter(show_fk == entity_id)
+  query = filter_time_window(query, window or {})
+
+  upcoming_shows = query.filter(Show.start_time >= now) \
+    .order_by(Show.start_time, Show.id).all()
+  past_shows = query.filter(Show.start_time < now) \
+    .order_by(Show.start_time.desc(), Show.id.desc()) \
+    .limit(current_app.config['PAST_SHOWS_LIMIT']).all()
+  past_shows_count = filter_time_window(session.query(func.count(Show.id)), window or {}) \
+    .filter(show_fk == entity_id).filter(Show.start_time < now).scalar()
+
+  return upcoming_shows, past_shows, past_shows_count
+
+def parse_time_window(args):
+  # ?from=&to= start time window, any format dateutil parses. an invalid
+  # value is rejected with a 400.
+  window = {}
+  try:
+    for key in ('from', 'to'):
+      if args.get(key):
+        window[key] = dateutil.parser.parse(args[key])
+  except (ValueError, OverflowError):
+    abort(400)
+  return window
+
+def parse_show_filters(args):
+  # time window, venue, artist and city/state filters shared by /shows,
+  # /shows.json and the .ics feeds. invalid values are rejected with a 400.
+  filters = parse_time_window(args)
+  try:
+    for key in ('venue_id', 'artist_id'):
+      if args.get(key):
+        filters[key] = int(args[key])
+  except (ValueError, OverflowError):
+    abort(400)
+  for key in ('city', 'state'):
+    if args.get(key, '').strip():
+      filters[key] = args[key].strip()
+  return filters
+
+def filter_time_window(query, window):
+  # start_time >= from and < to, a range of the start_time indexes
+  if 'from' in window:
+    query = query.filter(Show.start_time >= window['from'])
+  if 'to' in window:
+    query = query.filter(Show.start_time < window['to'])
+  return query
+
+def shows_query(session, filters, *columns):
+  # `columns` of the shows matching `filters`, joined with their venue and
+  # artist. a city/state filter finds the venues through ix_Venue_state_city,
+  # then their shows in the window through ix_Show_venue_id_start_time.
+  query = filter_time_window(session.query(*columns).select_from(Show).join(Venue).join(Artist), filters)
+  if 'venue_id' in filters:
+    query = query.filter(Show.venue_id == filters['venue_id'])
+  if 'artist_id' in filters:
+    query = query.filter(Show.artist_id == filters['artist_id'])
+  if 'state' in filters:
+    query = query.filter(Venue.state == filters['state'])
+  if 'city' in filters:
+    query = query.filter(Venue.city == filters['city'])
+  return query
+
+def encode_show_cursor(show):
+  return '{}_{}'.format(show.start_time.isoformat(), show.id)
+
+def decode_show_cursor(cursor):
+  # (start_time, id) of a cursor. an invalid or tampered one is rejected with
+  # a 400: the ids are 32 bit integers and the start times naive like the column
+  try:
+    start_time, show_id = cursor.rsplit('_', 1)
+    start_time, show_id = datetime.fromisoformat(start_time), int(show_id)
+  except ValueError:
+    abort(400)
+  if start_time.tzinfo is not None or not 0 <= show_id < 2 ** 31:
+    abort(400)
+  return start_time, show_id
+
+def shows_page_limit(limit=None):
+  page_size = current_app.config['SHOWS_PAGE_SIZE']
+  return min(limit, page_size) if limit and limit > 0 else page_size
+
+def shows_page_query(session, filters, after, *columns):
+  # `columns` of the shows matching `filters` after the cursor, joined with
+  # their venue and artist, in page order
+  query = shows_query(session, filters, *columns)
+  if after:
+    after_time, after_id = decode_show_cursor(after)
+    query = query.filter(or_(Show.start_time > after_time,
+      and_(Show.start_time == after_time, Show.id > after_id)))
+  return query.order_by(Show.start_time, Show.id)
+
+def shows_page(session, filters, after=None, limit=None):
+  # one page of shows ordered by (start_time, id) with the artist and venue
+  # names and images joined in. pagination is keyset based: `after` is the
+  # cursor of the last show of the previous page, so every page costs one
+  # index range scan no matter how deep it is.
+  limit = shows_page_limit(limit)
+  shows = shows_page_query(session, filters, after,
+      Show.id, Show.start_time, Show.end_time,
+      Show.venue_id, Venue.name.label('venue_name'), Venue.image_link.label('venue_image_link'),
+      Show.artist_id, Artist.name.label('artist_name'), Artist.image_link.label('artist_image_link'),
+      Show.updated_at, Venue.updated_at.label('venue_updated_at'), Artist.updated_at.label('artist_updated_at')) \
+    .limit(limit + 1).all()
+  next_cursor = encode_show_cursor(shows[limit - 1]) if len(shows) > limit else None
+  return shows[:limit], next_cursor
+
+def shows_listing(session, args):
+  # template context of one /shows page
+  filters = parse_show_filters(args)
+  show_query, next_cursor = shows_page(session, filters, after=args.get('after'))
+
+  data = [{
+    "id": s.id,
+    # the tile's fragment cache key, see cache.py
+    "version": (s.updated_at, s.venue_updated_at, s.artist_updated_at),
+    "venue_id": s.venue_id,
+    "venue_name": s.venue_name,
+    "artist_id": s.artist_id,
+    "artist_name": s.artist_name,
+    "artist_image_link": s.artist_image_link,
+    "start_time": s.start_time
+  } for s in show_query]
+
+  page_args = {k: args[k] for k in ('from', 'to', 'venue_id', 'artist_id', 'city', 'state') if k in filters}
+  return {"shows": data, "next_cursor": next_cursor, "page_args": page_args}
+
+def shows_listing_json(session, args):
+  # one /shows.json page
+  filters = parse_show_filters(args)
+  show_query, next_cursor = shows_page(session, filters, after=args.get('after'),
+    limit=args.get('limit', type=int))
+
+  return {
+    "shows": [{
+      "id": s.id,
+      "venue_id": s.venue_id,
+      "venue_name": s.venue_name,
+      "venue_image_link": s.venue_image_link,
+      "artist_id": s.artist_id,
+      "artist_name": s.artist_name,
+      "artist_image_link": s.artist_image_link,
+      "start_time": s.start_time.isoformat(),
+      "end_time": s.end_time.isoformat()
+    } for s in show_query],
+    "next_cursor": next_cursor
+  }
 
-    venues = Venue.query.filter(Venue.city == c.city).filter(Venue.state == c.state)
-    venues_array=[]
+def parse_location(args):
+  # (box, center, radius) of ?lat=&lng=&radius= (km, GEO_DEFAULT_RADIUS_KM by
+  # default, at most GEO_MAX_RADIUS_KM) or ?bbox=south,west,north,east, radius
+  # None for a box. None without either. invalid values and boxes wider than
+  # twice GEO_MAX_RADIUS_KM are rejected with a 400.
+  max_radius = current_app.config['GEO_MAX_RADIUS_KM']
+  try:
+    if args.get('bbox'):
+      south, west, north, east = [float(v) for v in args['bbox'].split(',')]
+      if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        abort(400)
+      # a box with west > east crosses the antimeridian
+      center_lng = (west + east) / 2 if west <= east else (west + east + 360) / 2
+      center = ((south + north) / 2, center_lng - 360 if center_lng > 180 else center_lng)
+      if distance_km(south, west, north, east) > 2 * max_radius:
+        abort(400)
+      return (south, west, north, east), center, None
+    if args.get('lat') or args.get('lng'):
+      center = (float(args['lat']), float(args['lng']))
+      radius = min(float(args.get('radius') or current_app.config['GEO_DEFAULT_RADIUS_KM']), max_radius)
+      if not (-90 <= center[0] <= 90 and -180 <= center[1] <= 180 and 0 < radius):
+        abort(400)
+      return box_around(center[0], center[1], radius), center, radius
+  except (KeyError, ValueError):
+    abort(400)
+  return None
 
-    for v in venues:
-      new_shows_num=len(db.session.query(Show).join(Artist).filter(Show.venue_id==v.id).filter(Show.start_time>datetime.now()).all())
-      venues_array.append({
+def venues_near(session, args):
+  # venues closest first around ?lat=&lng= or in ?bbox=, each with its
+  # distance in km and number of upcoming shows. see geo.py for the index.
+  location = parse_location(args)
+  if location is None:
+    return {"data": [], "has_more": False}
+  box, center, radius = location
+  found, has_more = nearby_venues(session, box, center, radius, limit=current_app.config['GEO_RESULTS_LIMIT'])
+  return {
+    "center": {"lat": center[0], "lng": center[1]},
+    "radius": radius,
+    "bbox": list(box),
+    "has_more": has_more,
+    "data": [{
       "id": v.id,
       "name": v.name,
-      "num_upcoming_shows":new_shows_num
-      })
-
-
-    data.append({
-      "city": c.city,
-      "state": c.state,
-      "venues": venues_array,
-      })
-
-   
-  
-  return render_template('pages/venues.html', areas=data);
-
-@app.route('/venues/search', methods=['POST'])
-def search_venues(): # not working 
-  # implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  search_term = request.form.get("search_term")
-  venue_data = Venue.query.filter(Venue.name.ilike('%' + search_term+ '%')).all()
-  venues_results_array=[]
-  for v in venue_data:
-    show_num = len(db.session.query(Show).join(Artist).filter(Show.venue_id==v.id).filter(Show. start_time>datetime.now()).all())
-    venues_results_array.append({
-        "id": v.id,
-        "name": v.name,
-        "num_upcoming_show": show_num
-      })
-  
-  #test upcoming shows query
-  #for ven in venues_results_array:
-    #print(ven)    
-  
-  response = {
-    "count": len(venues_results_array),
-    "data": venues_results_array
+      "city": v.city,
+      "state": v.state,
+      "lat": v.latitude,
+      "lng": v.longitude,
+      "distance": round(distance, 3),
+      "num_upcoming_shows": v.num_upcoming_shows
+    } for distance, v in found]
   }
 
-
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
-
-@app.route('/venues/<int:venue_id>')
-def show_venue(venue_id):
-  # shows the venue page with the given venue_id
-  # replace with real venue data from the venues table, using venue_id
-
-  data =[]
-
-  v = Venue.query.filter(Venue.id == venue_id).first()
-
-  shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id==venue_id)
-
-  past_shows=[]
-  upcoming_shows=[]
-
-
-  for s in shows_query:
-    show_object={
+def venue_directory(session, genre=None):
+  # venues grouped by city/state, each with its number of upcoming shows.
+  # one query for the whole directory, areas are built in a single pass.
+  # `genre` narrows the directory through the genre -> venue index.
+  venue_query = session.query(
+      Venue.id, Venue.name, Venue.city, Venue.state,
+      Venue.upcoming_shows_count.label('num_upcoming_shows')) \
+    .order_by(Venue.state, Venue.city, Venue.id)
+
+  if genre:
+    venue_query = venue_query.join(venue_genres).join(Genre).filter(Genre.name == genre)
+
+  areas = {}
+  for v in venue_query:
+    area = areas.get((v.city, v.state))
+    if area is None:
+      area = areas[(v.city, v.state)] = {
+        "city": v.city,
+        "state": v.state,
+        "venues": [],
+      }
+    area["venues"].append({
+      "id": v.id,
+      "name": v.name,
+      "num_upcoming_shows": v.num_upcoming_shows
+    })
+  return list(areas.values())
+
+def venue_page(session, venue_id, window=None):
+  # the venue with its genres, upcoming and past shows, those starting in
+  # `window` (see parse_time_window) when one is given
+  v = session.query(Venue).filter(Venue.id == venue_id).first()
+  if v is None:
+    abort(404)
+
+  upcoming_query, past_query, past_shows_count = shows_split_by_time(
+    session, Show.venue_id, venue_id, Artist,
+    Show.id, Show.artist_id, Artist.name, Artist.image_link,
+    Show.updated_at, Artist.updated_at.label('artist_updated_at'), window=window)
+
+  def show_object(s):
+    return {
+      "id": s.id,
+      # the tile's fragment cache key, see cache.py
+      "version": (s.updated_at, s.artist_updated_at),
       "artist_id": s.artist_id,
-      "artist_name":s.Artist.name,
-      "artist_image_link": s.Artist.image_link,
-      "start_time":s.start_time.ctime() 
+      "artist_name": s.name,
+      "artist_image_link": s.image_link,
+      "start_time": s.start_time
     }
-    if s.start_time >= datetime.now() : 
-      upcoming_shows.append(show_object)
-    else:
-      past_shows.append(show_object)
 
-  genresList =v.genres.strip('}{').split(',');
-  
+  upcoming_shows = [show_object(s) for s in upcoming_query]
+  past_shows = [show_object(s) for s in past_query]
 
-  data={
+  genresList = [g.name for g in v.genres]
+
+  return {
     "id": venue_id,
     "name": v.name,
     "genres": genresList,
@@ -165,21 +458,290 @@ def show_venue(venue_id):
     "image_link": v.image_link,
     "past_shows": past_shows,
     "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
+    "past_shows_count": past_shows_count,
+    "upcoming_shows_count": len(upcoming_shows),
+  }
+
+def artist_list(session, genre=None):
+  # all artists, `genre` narrows the list through the genre -> artist index.
+  artist_query = session.query(Artist.id, Artist.name)
+  if genre:
+    artist_query = artist_query.join(artist_genres).join(Genre).filter(Genre.name == genre)
+  return [{"id": a.id, "name": a.name} for a in artist_query]
+
+def artist_page(session, artist_id, window=None):
+  # the artist with its genres, upcoming and past shows, those starting in
+  # `window` (see parse_time_window) when one is given
+  a = session.query(Artist).filter(Artist.id == artist_id).first()
+  if a is None:
+    abort(404)
+
+  upcoming_query, past_query, past_shows_count = shows_split_by_time(
+    session, Show.artist_id, artist_id, Venue,
+    Show.id, Show.venue_id, Venue.name, Venue.image_link,
+    Show.updated_at, Venue.updated_at.label('venue_updated_at'), window=window)
+
+  def show_object(s):
+    return {
+      "id": s.id,
+      # the tile's fragment cache key, see cache.py
+      "version": (s.updated_at, s.venue_updated_at),
+      "venue_id": s.venue_id,
+      "venue_name": s.name,
+      "venue_image_link": s.image_link,
+      "start_time": s.start_time,
+    }
+
+  upcoming_shows = [show_object(s) for s in upcoming_query]
+  past_shows = [show_object(s) for s in past_query]
+
+  genresList = [g.name for g in a.genres]
+
+  return {
+    "id": artist_id,
+    "name": a.name,
+    "genres": genresList,
+    "city": a.city,
+    "state": a.state,
+    "phone": a.phone,
+    "website": a.web_link,
+    "facebook_link": a.facebook_link,
+    "seeking_venue": a.looking_for_venues,
+    "seeking_description": a.seeking_description,
+    "image_link": a.image_link,
+    "past_shows": past_shows,
+    "upcoming_shows": upcoming_shows,
+    "past_shows_count": past_shows_count,
     "upcoming_shows_count": len(upcoming_shows),
   }
 
-  return render_template('pages/show_venue.html', venue=data)
+#  Page validators
+#  ----------------------------------------------------------------
+# the (version, last_modified) of the rows a page shows, in one query, see
+# Cache.cached_view. deleting a row changes a count or the set of ids on the
+# page, so the version changes even though no updated_at does.
+
+def directory_version(session, model):
+  # /venues and /artists list columns of every venue or artist
+  count, last_modified = session.query(func.count(), func.max(model.updated_at)).select_from(model).one()
+  return (count, last_modified), last_modified
+
+def entity_page_version(session, model, show_fk, entity_id, joined_model):
+  # a venue or artist page: its row, its shows and the artists or venues
+  # they are with, 404 when there is no such venue or artist. shows move
+  # from upcoming to past as they start, the last one started counts as a
+  # change made at its start time.
+  now = datetime.now()
+  updated_at = session.query(model.updated_at).filter(model.id == entity_id).scalar_subquery()
+  row = session.query(
+      updated_at, func.max(Show.updated_at), func.max(joined_model.updated_at), func.count(Show.id),
+      func.max(case((Show.start_time < now, Show.start_time)))) \
+    .select_from(Show).join(joined_model).filter(show_fk == entity_id).one()
+  if row[0] is None:
+    abort(404)
+  # start times are local, updated_at is UTC
+  started = row[4].astimezone(timezone.utc).replace(tzinfo=None) if row[4] else None
+  return tuple(row), max(t for t in (row[0], row[1], row[2], started) if t is not None)
+
+def venue_page_version(session, venue_id):
+  return entity_page_version(session, Venue, Show.venue_id, venue_id, Artist)
+
+def artist_page_version(session, artist_id):
+  return entity_page_version(session, Artist, Show.artist_id, artist_id, Venue)
+
+def venue_directory_version(session):
+  return directory_version(session, Venue)
+
+def artist_list_version(session):
+  return directory_version(session, Artist)
+
+def shows_page_version(session, args, limit=None):
+  # the shows on one /shows page, their venues and artists
+  rows = shows_page_query(session, parse_show_filters(args), args.get('after'),
+      Show.id, Show.updated_at, Venue.updated_at, Artist.updated_at) \
+    .limit(shows_page_limit(limit) + 1).all()
+  last_modified = max((max(r[1:]) for r in rows), default=None)
+  return (tuple(r[0] for r in rows), last_modified), last_modified
+
+def shows_listing_version(session):
+  return shows_page_version(session, request.args)
+
+def shows_listing_json_version(session):
+  return shows_page_version(session, request.args, request.args.get('limit', type=int))
+
+def feed_filters(args, **fixed):
+  # an .ics feed's filters, see parse_show_filters. without ?from= a feed
+  # starts ICS_FEED_PAST_DAYS before today, counted in whole days so its
+  # ETag holds through the day.
+  filters = parse_show_filters(args)
+  filters.update(fixed)
+  if 'from' not in filters:
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    filters['from'] = today - timedelta(days=current_app.config['ICS_FEED_PAST_DAYS'])
+  return filters
+
+def shows_feed_version(session, filters, model=None, entity_id=None):
+  # the shows in a feed, their venues and artists, and the venue or artist
+  # the feed is for. None when there is no such venue or artist.
+  columns = [func.count(Show.id), func.max(Show.updated_at), func.max(Venue.updated_at), func.max(Artist.updated_at)]
+  if model is not None:
+    columns.insert(0, session.query(model.updated_at).filter(model.id == entity_id).scalar_subquery())
+  row = shows_query(session, filters, *columns).one()
+  if model is not None and row[0] is None:
+    return None
+  last_modified = max((t for t in row if isinstance(t, datetime)), default=None)
+  return (tuple(row), sorted(filters.items())), last_modified
+
+def venue_feed_version(session, venue_id):
+  return shows_feed_version(session, feed_filters(request.args, venue_id=venue_id), Venue, venue_id)
+
+def artist_feed_version(session, artist_id):
+  return shows_feed_version(session, feed_filters(request.args, artist_id=artist_id), Artist, artist_id)
+
+def city_feed_version(session):
+  return shows_feed_version(session, feed_filters(request.args))
+
+def search_page_args():
+  # search term plus the requested page window, capped at SEARCH_RESULTS_LIMIT.
+  search_term = request.form.get('search_term', '')
+  limit = current_app.config['SEARCH_RESULTS_LIMIT']
+  limit = min(request.values.get('limit', limit, type=int), limit)
+  offset = max(request.values.get('offset', 0, type=int), 0)
+  return search_term, limit, offset
+
+#  Edit forms
+#  ----------------------------------------------------------------
+# an edit form carries the version and values of the row it was rendered
+# from. its submission writes only the fields that differ from those, in one
+# UPDATE ... WHERE id = ? AND version = ? (see Venue.version), and nothing
+# when none do. the row is not read: a version that moved on fails the
+# UPDATE with StaleDataError, reported as a conflict.
+
+# form field -> column
+VENUE_EDIT_FIELDS = {
+  'name': 'name', 'city': 'city', 'state': 'state', 'address': 'address', 'phone': 'phone',
+  'image_link': 'image_link', 'facebook_link': 'facebook_link', 'website_link': 'web_link',
+  'seeking_talent': 'looking_for_talent', 'seeking_description': 'seeking_description',
+}
+ARTIST_EDIT_FIELDS = {
+  'name': 'name', 'city': 'city', 'state': 'state', 'phone': 'phone',
+  'image_link': 'image_link', 'facebook_link': 'facebook_link', 'website_link': 'web_link',
+  'seeking_venue': 'looking_for_venues', 'seeking_description': 'seeking_description',
+}
+EDIT_CHECKBOXES = ('seeking_talent', 'seeking_venue')
+
+def edit_serializer(model):
+  # tokens are signed with SECRET_KEY: what they say is taken as the row's
+  # committed state, a client must not be able to make it up
+  return URLSafeSerializer(current_app.secret_key, salt='edit-' + model.__tablename__)
+
+def edit_token(entity, fields):
+  # the id, version, values and genres of an entity, for its edit form
+  state = {
+    'id': entity.id,
+    'version': entity.version,
+    'values': {column: getattr(entity, column) for column in fields.values()},
+    'genres': [[g.id, g.name] for g in entity.genres],
+  }
+  return edit_serializer(type(entity)).dumps(state)
+
+def edited_entity(model, entity_id, fields, token):
+  # the entity as of an edit form's token, in the session as if it had just
+  # been loaded. ValueError for a token that is not one, or not this entity's
+  try:
+    state = edit_serializer(model).loads(token)
+    if state['id'] != entity_id:
+      raise ValueError('edit token of another {}'.format(model.__tablename__))
+    version = int(state['version'])
+    values = {column: state['values'][column] for column in fields.values()}
+    genres = [Genre(id=int(genre_id), name=name) for genre_id, name in state['genres']]
+  except (BadData, KeyError, TypeError, ValueError) as e:
+    raise ValueError('malformed edit token') from e
+  entity = model(id=entity_id, version=version, **values)
+  for obj in genres + [entity]:
+    make_transient_to_detached(obj)
+    db.session.add(obj)
+  set_committed_value(entity, 'genres', genres)
+  return entity
+
+def apply_edit(entity, fields, form):
+  # set the submitted values that differ on the entity, and whether any did.
+  # genres go first, Genre.from_names autoflushes and the edit must reach
+  # the database in a single flush
+  names = form.getlist('genres')
+  changed = set(n for n in names if n) != set(g.name for g in entity.genres)
+  if changed:
+    entity.genres = Genre.from_names(names)
+  for field, column in fields.items():
+    value = form.get(field) == 'y' if field in EDIT_CHECKBOXES else form[field]
+    current = getattr(entity, column)
+    # the form shows a missing value as an empty field or an unchecked box
+    if value != current and not (current is None and not value):
+      setattr(entity, column, value)
+      changed = True
+  return changed
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@bp.route('/')
+def index():
+  return render_template('pages/home.html')
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+@bp.route('/venues')
+@cache.cached_view(['venues', 'shows'], validator=venue_directory_version)
+@query_budget(2)
+def venues():
+  # venues grouped by city/state, each with its number of upcoming shows.
+  areas = venue_directory(db.session, request.args.get('genre'))
+  return render_template('pages/venues.html', areas=areas);
+
+@bp.route('/venues/search', methods=['POST'])
+@query_budget(1)
+def search_venues():
+  # case-insensitive partial string search on venue names.
+  # seach for Hop should return "The Musical Hop".
+  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
+  search_term, limit, offset = search_page_args()
+  response = search_with_upcoming_shows(db.session, Venue, search_term, limit, offset)
+
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+@bp.route('/venues/near')
+@query_budget(5)
+def search_venues_near():
+  # venues around a point (the visitor's, from the browser) or in a box.
+  # ?lat=&lng=&radius= in km, or ?bbox=south,west,north,east
+  return render_template('pages/venues_near.html', results=venues_near(db.session, request.args))
+
+@bp.route('/venues/near.json')
+@query_budget(5)
+def search_venues_near_json():
+  return jsonify(venues_near(db.session, request.args))
+
+@bp.route('/venues/<int:venue_id>')
+@cache.cached_view(lambda venue_id: ['venue:{}'.format(venue_id), 'artists'], validator=venue_page_version)
+@query_budget(6)
+def show_venue(venue_id):
+  # shows the venue page with the given venue_id
+  # ?from=&to= narrow the shows to a time window
+  return render_template('pages/show_venue.html',
+    venue=venue_page(db.session, venue_id, parse_time_window(request.args)))
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
-@app.route('/venues/create', methods=['GET'])
+@bp.route('/venues/create', methods=['GET'])
 def create_venue_form():
   form = VenueForm()
   return render_template('forms/new_venue.html', form=form)
 
-@app.route('/venues/create', methods=['POST'])
+@bp.route('/venues/create', methods=['POST'])
 def create_venue_submission():
   # insert form data as a new Venue record in the db, instead
   # modify data to be the data object returned from db insertion
@@ -198,11 +760,12 @@ def create_venue_submission():
       phone=request.form['phone'],
       image_link=request.form['image_link'],
       facebook_link=request.form['facebook_link'],
-      genres=request.form.getlist('genres'),
+      genres=Genre.from_names(request.form.getlist('genres')),
       web_link= request.form['website_link'], 
       looking_for_talent=seeking_talent,
       seeking_description=request.form['seeking_description']
       )
+    geocoding.locate(venue)
     db.session.add(venue)
     db.session.commit()      
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
@@ -222,15 +785,30 @@ def create_venue_submission():
 
   return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['DELETE'])
+@bp.route('/venues/<venue_id>', methods=['DELETE'])
 def delete_venue(venue_id):
   # Complete this endpoint for taking a venue_id, and using
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
 
   try:
 
-    Venue.query.filter_by(Venue.id ==venue_id).delete()
-    db.session.commit()      
+    # the venue's shows go with it, uncounted from their artists
+    shows = db.session.query(Show.id, Show.venue_id, Show.artist_id, Show.start_time) \
+      .filter(Show.venue_id == venue_id).all()
+    record_deleted_shows([show._asdict() for show in shows])
+    Show.query.filter(Show.venue_id == venue_id).delete()
+    # the bulk delete skips the genres relationship, unlink them first
+    db.session.execute(venue_genres.delete().where(venue_genres.c.venue_id == venue_id))
+    Venue.query.filter_by(id=venue_id).delete()
+    # bulk deletes bypass the flush hook of the search index
+    remove_documents(db.session.connection(), 'show', [show.id for show in shows])
+    remove_documents(db.session.connection(), 'venue', [venue_id])
+    db.session.commit()
+    # the listings, the venue's page and the pages of its shows' artists
+    cache.invalidate(*Venue.bulk_cache_tags(), 'venue:{}'.format(venue_id),
+                     *sorted({'artist:{}'.format(show.artist_id) for show in shows}))
+    autocomplete.remove('venue', venue_id)
+    matchmaking.remove('venue', venue_id)
     flash('Venue was deleted successfully')
 
   except:
@@ -242,145 +820,84 @@ def delete_venue(venue_id):
 
   # BONUS CHALLENGE: Implement a button to delete a Venue on a Venue Page, have it so that
   # clicking that button delete it from the db then redirect the user to the homepage
-  return None
+  return render_template('pages/home.html')
 
 #  Artists
 #  ----------------------------------------------------------------
-@app.route('/artists')
+@bp.route('/artists')
+@cache.cached_view(['artists'], validator=artist_list_version)
+@query_budget(2)
 def artists():
-  # replace with real data returned from querying the database
-  data=[]
-  artist_query = Artist.query.with_entities(Artist.id,Artist.name).all()
-  for a in artist_query:
-       data.append({
-        "id": a.id,
-        "name": a.name
-      })
-      
-  return render_template('pages/artists.html', artists=data)
+  # all artists, ?genre=<name> narrows the list through the genre -> artist index.
+  return render_template('pages/artists.html', artists=artist_list(db.session, request.args.get('genre')))
 
 
 
-@app.route('/artists/search', methods=['POST'])
+@bp.route('/artists/search', methods=['POST'])
+@query_budget(1)
 def search_artists():
-  # implement search on artists with partial string search. Ensure it is case-insensitive.
+  # case-insensitive partial string search on artist names.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  search_term = request.form.get("search_term")
-  artist_data = Artist.query.filter(Artist.name.ilike('%' + search_term+ '%')).all()
-  artist_results_array=[]
-  for a in artist_data:
-    show_num = Show.query.filter(Show.artist_id == a.id).filter(Show.start_time>=datetime.now()).count()
-
-    artist_results_array.append({
-        "id": a.id,
-        "name": a.name,
-        "num_upcoming_show": show_num
-      })
-
-  response = {
-    "count": len(artist_results_array),
-    "data": artist_results_array
-  }
+  search_term, limit, offset = search_page_args()
+  response = search_with_upcoming_shows(db.session, Artist, search_term, limit, offset)
 
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
-@app.route('/artists/<int:artist_id>')
+@bp.route('/artists/<int:artist_id>')
+@cache.cached_view(lambda artist_id: ['artist:{}'.format(artist_id), 'venues'], validator=artist_page_version)
+@query_budget(6)
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # replace with real artist data from the artist table, using artist_id
-    data =[]
-
-    a = Artist.query.filter(Artist.id == artist_id).first()
-    shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id==artist_id)
-
-    past_shows=[]
-    upcoming_shows=[]
-
-
-    for s in shows_query:
-      show_object={
-      "venue_id": s.venue_id,
-      "venue_name": s.Venue.name,
-      "venue_image_link": s.Venue.image_link,
-      "start_time": s.start_time.ctime(),
-      }
-      if s.start_time >= datetime.now() : 
-        upcoming_shows.append(show_object)
-      else:
-        past_shows.append(show_object)
-
-    genresList =a.genres.strip('}{').split(',');
-
-    data={
-    "id": artist_id,
-    "name": a.name,
-    "genres": genresList,
-    "city": a.city,
-    "state": a.state,
-    "phone": a.phone,
-    "website": a.web_link,
-    "facebook_link": a.facebook_link,
-    "seeking_venue": a.looking_for_venues,
-    "seeking_description":a.seeking_description,
-    "image_link": a.image_link,
-    "past_shows":past_shows ,
-    "upcoming_shows": upcoming_shows,
-    "past_shows_count": len(past_shows),
-    "upcoming_shows_count": len(upcoming_shows),
-    }
-   
-    return render_template('pages/show_artist.html', artist=data)
+  # ?from=&to= narrow the shows to a time window
+  return render_template('pages/show_artist.html',
+    artist=artist_page(db.session, artist_id, parse_time_window(request.args)))
 
 #  Update
 #  ----------------------------------------------------------------
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@bp.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@query_budget(2)
 def edit_artist(artist_id):
   form = ArtistForm()
-  artist = Artist.query.get(artist_id)
+  artist = Artist.query.get_or_404(artist_id)
 
   form.name.data = artist.name
   form.city.data = artist.city
   form.state.data = artist.state
   form.phone.data = artist.phone
-  form.genres.data = artist.genres
+  form.genres.data = [g.name for g in artist.genres]
   form.image_link.data = artist.image_link
   form.facebook_link.data = artist.facebook_link
   form.website_link.data = artist.web_link
   form.seeking_venue.data = artist.looking_for_venues
   form.seeking_description.data = artist.seeking_description
+  form.version.data = edit_token(artist, ARTIST_EDIT_FIELDS)
 
   
   # populate form with fields from artist with ID <artist_id>
   return render_template('forms/edit_artist.html', form=form, artist=artist)
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@bp.route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
-  # take values from the form submitted, and update existing
-  # artist record with ID <artist_id> using the new attributes
+  # take values from the form submitted, and write those that changed to the
+  # artist record with ID <artist_id>, unless it changed since the form was rendered
 
   try:
 
-    artist = Artist.query.get(artist_id)
-
-    looking_for_venues_value=request.form.get('seeking_venue')
-    looking_for_venues=False
-    if looking_for_venues_value =='y':
-      looking_for_venues=True
+    artist = edited_entity(Artist, artist_id, ARTIST_EDIT_FIELDS, request.form['version'])
+    if apply_edit(artist, ARTIST_EDIT_FIELDS, request.form):
+      db.session.commit()
+      flash('Artist ' + request.form['name'] + ' was successfully updated!')
+    else:
+      flash('Artist ' + request.form['name'] + ' was not changed.')
 
-    artist.name=request.form['name']
-    artist.city=request.form['city']
-    artist.state=request.form['state']
-    artist.phone=request.form['phone']
-    artist.genres=request.form.getlist('genres')
-    artist.image_link=request.form['image_link']
-    artist.facebook_link=request.form['facebook_link']
-    artist.web_link= request.form['website_link']
-    artist.looking_for_venues=looking_for_venues
-    artist.seeking_description=request.form['seeking_description']
-      
-    db.session.commit()      
-    flash('Artist ' + request.form['name'] + ' was successfully updated!')
+  except StaleDataError:
+    db.session.rollback()
+    flash('Artist ' + request.form['name'] + ' was changed by someone else while you were editing it. '
+          'Your changes were not saved, here is the current version.')
+    # a replica may not have the other edit yet
+    replicas.stick()
+    return redirect(url_for('.edit_artist', artist_id=artist_id))
 
   except:
     db.session.rollback()
@@ -389,15 +906,16 @@ def edit_artist_submission(artist_id):
   finally:
     db.session.close()
 
-  return redirect(url_for('show_artist', artist_id=artist_id))
+  return redirect(url_for('.show_artist', artist_id=artist_id))
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@query_budget(2)
 def edit_venue(venue_id):
   form = VenueForm()
-  venue = Venue.query.get(venue_id)
+  venue = Venue.query.get_or_404(venue_id)
 
   form.name.data = venue.name
-  form.genres.data = venue.genres
+  form.genres.data = [g.name for g in venue.genres]
   form.address.data = venue.address
   form.city.data = venue.city
   form.state.data = venue.state
@@ -407,40 +925,37 @@ def edit_venue(venue_id):
   form.seeking_talent.data = venue.looking_for_talent
   form.seeking_description.data = venue.seeking_description
   form.image_link.data = venue.image_link
+  form.version.data = edit_token(venue, VENUE_EDIT_FIELDS)
 
 
   # populate form with values from venue with ID <venue_id>
   return render_template('forms/edit_venue.html', form=form, venue=venue)
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@bp.route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
-  # take values from the form submitted, and update existing
-  # venue record with ID <venue_id> using the new attributes
+  # take values from the form submitted, and write those that changed to the
+  # venue record with ID <venue_id>, unless it changed since the form was rendered
 
   try:
 
-    venue = Venue.query.get(venue_id)
-
-    seeking_talent_value=request.form.get('seeking_talent')
-    seeking_talent=False
-    if seeking_talent_value =='y':
-      seeking_talent=True
+    venue = edited_entity(Venue, venue_id, VENUE_EDIT_FIELDS, request.form['version'])
+    location = (venue.address, venue.city, venue.state)
+    if apply_edit(venue, VENUE_EDIT_FIELDS, request.form):
+      # a new address moves the venue
+      if (venue.address, venue.city, venue.state) != location:
+        geocoding.locate(venue)
+      db.session.commit()
+      flash('Venue ' + request.form['name'] + ' was successfully updated!')
+    else:
+      flash('Venue ' + request.form['name'] + ' was not changed.')
 
-    
-    venue.name=request.form['name']
-    venue.city=request.form['city']
-    venue.state=request.form['state']
-    venue.address=request.form['address']
-    venue.phone=request.form['phone']
-    venue.image_link=request.form['image_link']
-    venue.facebook_link=request.form['facebook_link']
-    venue.genres=request.form.getlist('genres')
-    venue.web_link= request.form['website_link']
-    venue.looking_for_talent=seeking_talent
-    venue.seeking_description=request.form['seeking_description']
-      
-    db.session.commit()      
-    flash('Venue ' + request.form['name'] + ' was successfully updated!')
+  except StaleDataError:
+    db.session.rollback()
+    flash('Venue ' + request.form['name'] + ' was changed by someone else while you were editing it. '
+          'Your changes were not saved, here is the current version.')
+    # a replica may not have the other edit yet
+    replicas.stick()
+    return redirect(url_for('.edit_venue', venue_id=venue_id))
 
   except:
     db.session.rollback()
@@ -449,17 +964,17 @@ def edit_venue_submission(venue_id):
   finally:
     db.session.close()
 
-  return redirect(url_for('show_venue', venue_id=venue_id))
+  return redirect(url_for('.show_venue', venue_id=venue_id))
 
 #  Create Artist
 #  ----------------------------------------------------------------
 
-@app.route('/artists/create', methods=['GET'])
+@bp.route('/artists/create', methods=['GET'])
 def create_artist_form():
   form = ArtistForm()
   return render_template('forms/new_artist.html', form=form)
 
-@app.route('/artists/create', methods=['POST'])
+@bp.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
   # insert form data as a new Venue record in the db, instead
@@ -476,7 +991,7 @@ def create_artist_submission():
       city=request.form['city'],
       state=request.form['state'],
       phone=request.form['phone'],
-      genres=request.form.getlist('genres'),
+      genres=Genre.from_names(request.form.getlist('genres')),
       image_link=request.form['image_link'],
       facebook_link=request.form['facebook_link'],
       web_link= request.form['website_link'], 
@@ -503,48 +1018,96 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@bp.route('/shows')
+@cache.cached_view(['shows', 'venues', 'artists'], validator=shows_listing_version)
+@query_budget(2)
 def shows():
-  # displays list of shows at /shows
-  # replace with real venues data.
-  #num_shows should be aggregated based on number of upcoming shows per venue.
-  data=[] 
-  show_query=Show.query.all() 
-
-  for s in show_query:
-    data.append({
-      "venue_id":s.Venue.id,
-      "venue_name":s.Venue.name,
-      "artist_id":s.Artist.id,
-      "artist_name":s.Artist.name,
-      "artist_image_link":s.Artist.image_link,
-      "start_time":s.start_time.ctime()
-    })
-   
-   
-  return render_template('pages/shows.html', shows=data)
+  # displays one page of shows at /shows, see shows_page for the filters.
+  return render_template('pages/shows.html', **shows_listing(db.session, request.args))
+
+@bp.route('/shows.json')
+@cache.cached_view(['shows', 'venues', 'artists'], validator=shows_listing_json_version)
+@query_budget(2)
+def shows_json():
+  # same page of shows as /shows, as JSON for the front end.
+  return jsonify(shows_listing_json(db.session, request.args))
+
+#  Feeds
+#  ----------------------------------------------------------------
 
-@app.route('/shows/create')
+def feed_response(name, filters):
+  # the shows matching `filters` as an iCalendar feed, written while the rows
+  # are read from a server-side cursor, see ics.py
+  shows = shows_query(db.session, filters,
+      Show.id, Show.start_time, Show.end_time, Show.updated_at, Show.artist_id,
+      Artist.name.label('artist_name'), Venue.name.label('venue_name'),
+      Venue.address.label('venue_address'), Venue.city.label('venue_city'), Venue.state.label('venue_state')) \
+    .order_by(Show.start_time, Show.id).yield_per(ics.FEED_BATCH_SIZE)
+  body = ics.calendar(name, shows, request.host, request.url_root)
+  return Response(stream_with_context(body), content_type=ics.CONTENT_TYPE)
+
+@bp.route('/venues/<int:venue_id>/shows.ics')
+@cache.conditional_view(venue_feed_version)
+@query_budget(3)
+def venue_feed(venue_id):
+  # the venue's shows for calendar apps, ?from=&to= as on /shows
+  venue = db.session.query(Venue.name).filter(Venue.id == venue_id).first()
+  if venue is None:
+    abort(404)
+  return feed_response('Shows at {}'.format(venue.name), feed_filters(request.args, venue_id=venue_id))
+
+@bp.route('/artists/<int:artist_id>/shows.ics')
+@cache.conditional_view(artist_feed_version)
+@query_budget(3)
+def artist_feed(artist_id):
+  # the artist's shows for calendar apps, ?from=&to= as on /shows
+  artist = db.session.query(Artist.name).filter(Artist.id == artist_id).first()
+  if artist is None:
+    abort(404)
+  return feed_response('{} shows'.format(artist.name), feed_filters(request.args, artist_id=artist_id))
+
+@bp.route('/shows.ics')
+@cache.conditional_view(city_feed_version)
+@query_budget(2)
+def city_feed():
+  # the shows in ?city=&state= for calendar apps, the other /shows filters apply too
+  filters = feed_filters(request.args)
+  place = ', '.join(filters[k] for k in ('city', 'state') if k in filters)
+  return feed_response('Shows in {}'.format(place) if place else 'Fyyur shows', filters)
+
+@bp.route('/shows/create')
 def create_shows():
   # renders form. do not touch.
   form = ShowForm()
   return render_template('forms/new_show.html', form=form)
 
-@app.route('/shows/create', methods=['POST'])
+@bp.route('/shows/create', methods=['POST'])
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # insert form data as a new Show record in the db, instead
 
   try:
 
+    start_time = dateutil.parser.parse(request.form['start_time'])
+    end_time = request.form.get('end_time', '').strip()
     show = Show(
-      artist_id=request.form['artist_id'],
-      venue_id=request.form['venue_id'],
-      start_time=request.form['start_time'],
+      artist_id=int(request.form['artist_id']),
+      venue_id=int(request.form['venue_id']),
+      start_time=start_time,
+      end_time=show_end_time(start_time, dateutil.parser.parse(end_time) if end_time else None),
       )
     db.session.add(show)
+    record_new_show(show)
     db.session.commit()      
     flash('Show was successfully listed!')
+  except IntegrityError as e:
+    # overlapping bookings are rejected by the database, see bookings.py
+    db.session.rollback()
+    kind = booking_conflict(e)
+    if kind:
+      flash('The {} is already booked at that time. Show could not be listed.'.format(kind))
+    else:
+      flash('An error occurred. Show could not be listed.')
   except:
     db.session.rollback()
     flash('An error occurred. Show could not be listed.')
@@ -558,36 +1121,164 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
-@app.errorhandler(404)
+#  Search
+#  ----------------------------------------------------------------
+
+def search_results(session, args):
+  # one page of ranked search results for ?q=<terms>&type=<kind>&page=<n>,
+  # each with a link to its venue, artist or show listing.
+  terms = args.get('q', '').strip()
+  kind = args.get('type') if args.get('type') in KINDS else None
+  page = max(args.get('page', 1, type=int), 1)
+  page_size = current_app.config['SEARCH_PAGE_SIZE']
+
+  results = search_documents(session, terms, kind, limit=page_size, offset=(page - 1) * page_size,
+    candidates=current_app.config['SEARCH_MAX_CANDIDATES'])
+  has_next = len(results) > page_size
+  results = results[:page_size]
+
+  show_ids = [r['id'] for r in results if r['type'] == 'show']
+  shows = {}
+  if show_ids:
+    shows = {s.id: s for s in session.query(Show.id, Show.venue_id, Show.start_time)
+      .filter(Show.id.in_(show_ids))}
+  for r in results:
+    if r['type'] == 'venue':
+      r['url'] = url_for('.show_venue', venue_id=r['id'])
+    elif r['type'] == 'artist':
+      r['url'] = url_for('.show_artist', artist_id=r['id'])
+    elif r['id'] in shows:
+      s = shows[r['id']]
+      r['url'] = url_for('.shows', venue_id=s.venue_id, **{'from': s.start_time.isoformat()})
+
+  return {"q": terms, "type": kind, "page": page, "has_next": has_next, "results": results}
+
+def search_results_json(session, args):
+  # search_results with the highlighted markup as plain strings
+  response = search_results(session, args)
+  for r in response["results"]:
+    r["title"], r["body"] = str(r["title"]), str(r["body"])
+  return response
+
+@bp.route('/search')
+@query_budget(2)
+def search():
+  # ranked full-text search over venue, artist and show names, places,
+  # genres and descriptions. see search.py for the index.
+  return render_template('pages/search.html', **search_results(db.session, request.args))
+
+@bp.route('/search.json')
+@query_budget(2)
+def search_json():
+  return jsonify(search_results_json(db.session, request.args))
+
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@bp.route('/autocomplete')
+@query_budget(0)
+def autocomplete_names():
+  # venue and artist names with a word starting with ?q=, from the in-process
+  # index. ?type=venue|artist narrows the kind.
+  kind = request.args.get('type') if request.args.get('type') in ('venue', 'artist') else None
+  limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+  return jsonify({
+    "results": [{"type": k, "id": i, "name": n}
+      for k, i, n in autocomplete.lookup(request.args.get('q', ''), kind, limit)]
+  })
+
+@bp.route('/autocomplete/stats')
+def autocomplete_stats():
+  return jsonify(autocomplete.stats())
+
+#  Matchmaking
+#  ----------------------------------------------------------------
+
+def entity_matches(session, kind, entity_id):
+  # the seeking artists for a venue, or the seeking venues for an artist,
+  # best match first. see matchmaking.py for the index and the score.
+  model = Venue if kind == 'venue' else Artist
+  entity = session.query(model).filter(model.id == entity_id).first()
+  if entity is None:
+    abort(404)
+  found = matchmaking.matches(kind, entity_id, Profile.of(kind, entity),
+    limit=current_app.config['MATCHMAKING_RESULTS_LIMIT'])
+  return {
+    "id": entity_id,
+    "name": entity.name,
+    "type": kind,
+    "matches": [{
+      "type": 'artist' if kind == 'venue' else 'venue',
+      "id": match_id,
+      "name": match.name,
+      "city": match.city,
+      "state": match.state,
+      "score": round(score, 3),
+      "genres": sorted(shared),
+      "shows_together": together
+    } for score, match_id, match, shared, together in found]
+  }
+
+@bp.route('/venues/<int:venue_id>/matches')
+@query_budget(2)
+def venue_matches(venue_id):
+  # artists looking for venues that suit this venue
+  return render_template('pages/matches.html', **entity_matches(db.session, 'venue', venue_id))
+
+@bp.route('/venues/<int:venue_id>/matches.json')
+@query_budget(2)
+def venue_matches_json(venue_id):
+  return jsonify(entity_matches(db.session, 'venue', venue_id))
+
+@bp.route('/artists/<int:artist_id>/matches')
+@query_budget(2)
+def artist_matches(artist_id):
+  # venues looking for talent that suit this artist
+  return render_template('pages/matches.html', **entity_matches(db.session, 'artist', artist_id))
+
+@bp.route('/artists/<int:artist_id>/matches.json')
+@query_budget(2)
+def artist_matches_json(artist_id):
+  return jsonify(entity_matches(db.session, 'artist', artist_id))
+
+@bp.route('/matchmaking/stats')
+def matchmaking_stats():
+  return jsonify(matchmaking.stats())
+
+#  Cache
+#  ----------------------------------------------------------------
+
+@bp.route('/cache/stats')
+def cache_stats():
+  return jsonify(cache.stats())
+
+#  Database
+#  ----------------------------------------------------------------
+
+@bp.route('/db/stats')
+def db_stats():
+  return jsonify(replicas.stats())
+
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
-    app.run()
+    create_app().run()
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port)
+    create_app().run(host='0.0.0.0', port=port)
 '''
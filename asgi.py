@@ -0,0 +1,295 @@
+#----------------------------------------------------------------------------#
+# ASGI entry point.
+#
+#   uvicorn --factory asgi:create_asgi_app --workers 4
+#
+# Serves the read routes (the venue and artist directories and pages, /shows,
+# the searches and their JSON variants) as coroutines over an async engine,
+# asyncpg on Postgres and aiosqlite on SQLite, so a worker keeps serving other
+# requests while one waits on the database. Their data comes from the same
+# functions as the WSGI views, run on the async connection through
+# AsyncSession.run_sync. Every other route, the writes included, is passed to
+# the Flask app unchanged in a thread pool and keeps its sync semantics;
+# streamed responses (the .ics feeds) are sent as they are produced.
+#
+# Requests go through the Flask URL map, request context, before/after
+# request hooks and error handlers either way, so caching, SQL
+# instrumentation, sessions and flashed messages work as under WSGI.
+#----------------------------------------------------------------------------#
+
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from flask import current_app, request, render_template, jsonify
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import HTTPException
+
+from app import (create_app, cache, search_page_args, parse_time_window, search_with_upcoming_shows,
+                 venue_directory, venue_page, artist_list, artist_page, shows_listing,
+                 shows_listing_json, search_results, search_results_json,
+                 venue_directory_version, venue_page_version, artist_list_version,
+                 artist_page_version, shows_listing_version, shows_listing_json_version)
+from models import Venue, Artist
+from replicas import read_replica
+
+ASYNC_DRIVERS = {'postgresql': 'postgresql+asyncpg', 'sqlite': 'sqlite+aiosqlite'}
+
+# endpoint -> coroutine view, the endpoints served without a thread
+ASYNC_VIEWS = {}
+
+
+def read_route(endpoint):
+    def decorator(f):
+        ASYNC_VIEWS['main.' + endpoint] = f
+        return f
+    return decorator
+
+
+async def run_sync(fn, *args):
+    return await current_app.extensions['async_reads'].run_sync(fn, *args)
+
+
+#  Read routes
+#  ----------------------------------------------------------------
+
+@read_route('venues')
+@cache.cached_view(['venues', 'shows'], validator=venue_directory_version)
+async def venues():
+    areas = await run_sync(venue_directory, request.args.get('genre'))
+    return render_template('pages/venues.html', areas=areas)
+
+
+@read_route('show_venue')
+@cache.cached_view(lambda venue_id: ['venue:{}'.format(venue_id), 'artists'], validator=venue_page_version)
+async def show_venue(venue_id):
+    return render_template('pages/show_venue.html', venue=await run_sync(venue_page, venue_id, parse_time_window(request.args)))
+
+
+@read_route('search_venues')
+async def search_venues():
+    search_term, limit, offset = search_page_args()
+    response = await run_sync(search_with_upcoming_shows, Venue, search_term, limit, offset)
+    return render_template('pages/search_venues.html', results=response, search_term=search_term)
+
+
+@read_route('artists')
+@cache.cached_view(['artists'], validator=artist_list_version)
+async def artists():
+    return render_template('pages/artists.html', artists=await run_sync(artist_list, request.args.get('genre')))
+
+
+@read_route('show_artist')
+@cache.cached_view(lambda artist_id: ['artist:{}'.format(artist_id), 'venues'], validator=artist_page_version)
+async def show_artist(artist_id):
+    return render_template('pages/show_artist.html', artist=await run_sync(artist_page, artist_id, parse_time_window(request.args)))
+
+
+@read_route('search_artists')
+async def search_artists():
+    search_term, limit, offset = search_page_args()
+    response = await run_sync(search_with_upcoming_shows, Artist, search_term, limit, offset)
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
+
+
+@read_route('shows')
+@cache.cached_view(['shows', 'venues', 'artists'], validator=shows_listing_version)
+async def shows():
+    return render_template('pages/shows.html', **await run_sync(shows_listing, request.args))
+
+
+@read_route('shows_json')
+@cache.cached_view(['shows', 'venues', 'artists'], validator=shows_listing_json_version)
+async def shows_json():
+    return jsonify(await run_sync(shows_listing_json, request.args))
+
+
+@read_route('search')
+async def search():
+    return render_template('pages/search.html', **await run_sync(search_results, request.args))
+
+
+@read_route('search_json')
+async def search_json():
+    return jsonify(await run_sync(search_results_json, request.args))
+
+
+#  Server
+#  ----------------------------------------------------------------
+
+def wsgi_environ(scope, body):
+    # the WSGI environ of an ASGI http request
+    script_name = scope.get('root_path', '')
+    path = scope['path']
+    if script_name and path.startswith(script_name):
+        path = path[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        environ[name] = environ[name] + ',' + value if name in environ else value
+    return environ
+
+
+def response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': int(status.split(' ', 1)[0]),
+        'headers': [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers],
+    }
+
+
+def async_engine(config, url):
+    url = make_url(url)
+    if url.get_backend_name() in ASYNC_DRIVERS and url.get_driver_name() not in ('asyncpg', 'aiosqlite'):
+        url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+    # like app.configure_engine, SQLite's pools take none of these options
+    options = {}
+    if url.get_backend_name() != 'sqlite':
+        options = {
+            'pool_size': config['ASYNC_POOL_SIZE'],
+            'max_overflow': config['ASYNC_MAX_OVERFLOW'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        }
+    return create_async_engine(url, **options)
+
+
+class AsyncReads(object):
+    # the ASGI application: async read routes, the Flask app in threads for the rest
+
+    def __init__(self, flask_app):
+        config = flask_app.config
+        config.setdefault('ASYNC_POOL_SIZE', 20)
+        config.setdefault('ASYNC_MAX_OVERFLOW', 10)
+        config.setdefault('ASGI_SYNC_THREADS', 8)
+        self.flask_app = flask_app
+
+        # the read replicas get async engines too, unless ASYNC_DATABASE_URI
+        # points the async reads somewhere else
+        self.engines = {'primary': async_engine(config, config.get('ASYNC_DATABASE_URI') or config['SQLALCHEMY_DATABASE_URI'])}
+        if not config.get('ASYNC_DATABASE_URI'):
+            for replica in flask_app.extensions['replicas'].replicas:
+                self.engines[replica.name] = async_engine(config, replica.engine.url)
+                replica.watch(self.engines[replica.name].sync_engine)
+        self.sessions = {name: sessionmaker(engine, class_=AsyncSession) for name, engine in self.engines.items()}
+        self.executor = ThreadPoolExecutor(config['ASGI_SYNC_THREADS'], thread_name_prefix='wsgi')
+        flask_app.extensions['async_reads'] = self
+
+    async def run_sync(self, fn, *args):
+        # fn(session, *args) on a session of the async engine of the
+        # request's replica, or of the primary
+        replica = read_replica()
+        sessions = self.sessions.get(replica.name if replica is not None else 'primary', self.sessions['primary'])
+        async with sessions() as session:
+            return await session.run_sync(fn, *args)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError('only http requests are served, got {!r}'.format(scope['type']))
+
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = wsgi_environ(scope, body)
+
+        try:
+            endpoint, view_args = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        view = ASYNC_VIEWS.get(endpoint)
+        if view is None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.executor, self.call_wsgi, environ, send, loop)
+        else:
+            status, headers, body = await self.dispatch(environ, view, view_args)
+            await send(response_start(status, headers))
+            await send({'type': 'http.response.body', 'body': body})
+
+    async def dispatch(self, environ, view, view_args):
+        # Flask.full_dispatch_request around a coroutine view
+        flask_app = self.flask_app
+        with flask_app.request_context(environ):
+            flask_app.try_trigger_before_first_request_functions()
+            try:
+                rv = flask_app.preprocess_request()
+                if rv is None:
+                    rv = await view(**view_args)
+            except Exception as e:
+                try:
+                    rv = flask_app.handle_user_exception(e)
+                except Exception as e:
+                    rv = flask_app.handle_exception(e)
+            response = flask_app.finalize_request(rv)
+            return response.status, response.headers.to_wsgi_list(), response.get_data()
+
+    def call_wsgi(self, environ, send, loop):
+        # the Flask app as a WSGI application, in one of the executor's threads.
+        # the body is sent as the app yields it, so streamed responses (the
+        # .ics feeds) stream: each chunk is sent from the event loop while
+        # this thread waits, which also holds a fast producer back to the
+        # pace of a slow client. the iteration stays in this one thread, as
+        # stream_with_context needs.
+        def send_sync(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+
+        app_iter = self.flask_app(environ, start_response)
+        try:
+            chunks = (chunk for chunk in app_iter if chunk)
+            body = next(chunks, b'')
+            send_sync(response_start(*started))
+            for chunk in chunks:
+                send_sync({'type': 'http.response.body', 'body': body, 'more_body': True})
+                body = chunk
+            send_sync({'type': 'http.response.body', 'body': body})
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for engine in self.engines.values():
+                    await engine.dispose()
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_asgi_app(config_object='config'):
+    return AsyncReads(create_app(config_object))
@@ -0,0 +1,275 @@
+#----------------------------------------------------------------------------#
+# Static asset pipeline.
+#
+#   flask assets build [--clean]
+#
+# The build concatenates the stylesheets and scripts the layout loads into the
+# BUNDLES below and minifies them. It copies them and every other file under
+# static/ to static/dist/ with a hash of their content in the file name. It
+# also writes a gzip and a brotli variant next to each file that compresses.
+# static/dist/manifest.json maps every logical name ('css/site.css',
+# 'img/front-splash.jpg') to its hashed file.
+#
+# Once a manifest exists, url_for('static', filename=...) and the asset_urls()
+# template helper return the hashed URLs. Files under dist/ never change, so
+# they are served with a year-long immutable Cache-Control, as the
+# precompressed variant the client accepts. Without a manifest (nothing built
+# yet, e.g. in development) the source files are served as before. Workers
+# read the manifest when they start, so rebuild before restarting them.
+#
+# Minifying needs the rcssmin and rjsmin packages, the brotli variants the
+# brotli package.
+#----------------------------------------------------------------------------#
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+
+import click
+from flask import current_app, request, send_from_directory, url_for
+from flask.cli import AppGroup
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:
+    rcssmin = rjsmin = None
+
+assets_cli = AppGroup('assets', help='Build the fingerprinted static assets.')
+
+# bundle name -> source files, in the order they are loaded. site.js keeps
+# the order the deferred scripts ran in before they were bundled. stylesheets
+# are bundled into their own directory, their url()s stay valid.
+BUNDLES = {
+    'css/site.css': ['css/bootstrap.min.css', 'css/layout.main.css', 'css/main.css',
+                     'css/main.responsive.css', 'css/main.quickfix.css'],
+    'js/head.js': ['js/libs/modernizr-2.8.2.min.js', 'js/libs/moment.min.js'],
+    'js/site.js': ['js/script.js', 'js/libs/bootstrap-3.1.1.min.js', 'js/plugins.js'],
+}
+
+DIST = 'dist'
+MANIFEST = DIST + '/manifest.json'
+# (Content-Encoding, file suffix), preferred first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.eot', '.otf', '.ttf')
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def hashed_name(name, content):
+    # 'css/site.css' -> 'dist/css/site.3f2a1b9c0d4e.css'
+    stem, ext = posixpath.splitext(name)
+    return '{}/{}.{}{}'.format(DIST, stem, hashlib.sha256(content).hexdigest()[:12], ext)
+
+
+def minify(name, content):
+    # already minified sources are left as they are
+    if '.min.' in name:
+        return content
+    if name.endswith('.css'):
+        return rcssmin.cssmin(content)
+    if name.endswith('.js'):
+        return rjsmin.jsmin(content)
+    return content
+
+
+def rewrite_css_urls(name, content, manifest):
+    # point relative url()s of css file `name` at the hashed files, relative
+    # to where it lands in dist/
+    source_dir = posixpath.dirname(name)
+    target_dir = posixpath.join(DIST, source_dir)
+
+    def replace(match):
+        quote, url = match.groups()
+        if re.match(r'^([a-z]+:|/|#)', url):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        path = posixpath.normpath(posixpath.join(source_dir, path))
+        path = manifest.get(path, path)
+        return 'url({0}{1}{2}{0})'.format(quote, posixpath.relpath(path, target_dir), suffix)
+
+    return CSS_URL.sub(replace, content)
+
+
+def static_files(static_folder):
+    # every file under static/ but the build output, as '/'-separated names
+    for root, dirs, files in os.walk(static_folder):
+        rel = os.path.relpath(root, static_folder).replace(os.sep, '/')
+        if rel == DIST or rel.startswith(DIST + '/'):
+            dirs[:] = []
+            continue
+        for filename in sorted(files):
+            yield filename if rel == '.' else rel + '/' + filename
+
+
+def build_assets(static_folder):
+    # write the hashed files, their compressed variants and the manifest.
+    # returns the manifest and the names of the files written.
+    missing = [name for name, module in (('rcssmin', rcssmin), ('rjsmin', rjsmin)) if module is None]
+    if missing:
+        raise click.ClickException('install {} to build the assets'.format(' and '.join(missing)))
+
+    def read(name):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            return f.read()
+
+    # plain files first, so stylesheets can refer to their hashed names
+    manifest, outputs = {}, {}
+    names = list(static_files(static_folder))
+    for name in names:
+        if not name.endswith(('.css', '.js')):
+            content = read(name)
+            manifest[name] = hashed_name(name, content)
+            outputs[manifest[name]] = content
+
+    built = {}
+    for name in names:
+        if name.endswith(('.css', '.js')):
+            content = minify(name, read(name).decode('utf8'))
+            if name.endswith('.css'):
+                content = rewrite_css_urls(name, content, manifest)
+            built[name] = content
+    for bundle, sources in BUNDLES.items():
+        # a script may end without a semicolon
+        separator = '\n;\n' if bundle.endswith('.js') else '\n'
+        built[bundle] = separator.join(built[source] for source in sources) + '\n'
+    for name, content in built.items():
+        content = content.encode('utf8')
+        manifest[name] = hashed_name(name, content)
+        outputs[manifest[name]] = content
+
+    written = []
+    for path, content in sorted(outputs.items()):
+        variants = [(path, content)]
+        if path.endswith(COMPRESSIBLE):
+            variants.append((path + '.gz', gzip.compress(content, 9, mtime=0)))
+            if brotli is not None:
+                variants.append((path + '.br', brotli.compress(content, quality=11)))
+        for variant, data in variants:
+            if variant != path and len(data) >= len(content):
+                continue
+            target = os.path.join(static_folder, *variant.split('/'))
+            if os.path.exists(target):
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            written.append(variant)
+
+    target = os.path.join(static_folder, *MANIFEST.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(target + '.tmp', target)
+    return manifest, written
+
+
+def clean_assets(static_folder, manifest):
+    # remove the hashed files of earlier builds
+    keep = {MANIFEST}
+    for path in manifest.values():
+        keep.update(path + suffix for suffix in ('',) + tuple(s for _, s in ENCODINGS))
+    removed = []
+    for root, _, files in os.walk(os.path.join(static_folder, DIST)):
+        for filename in files:
+            path = os.path.relpath(os.path.join(root, filename), static_folder).replace(os.sep, '/')
+            if path not in keep:
+                os.remove(os.path.join(root, filename))
+                removed.append(path)
+    return removed
+
+
+class AssetsState(object):
+    # one app's manifest of hashed filenames
+
+    def __init__(self, app):
+        self.max_age = app.config['ASSETS_MAX_AGE']
+        self.manifest = {}
+        self.load(app.static_folder)
+
+    def load(self, static_folder):
+        try:
+            with open(os.path.join(static_folder, *MANIFEST.split('/'))) as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+
+class Assets(object):
+    # binds an AssetsState to each app, found through current_app
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_MAX_AGE', 31536000)
+        app.extensions['assets'] = AssetsState(app)
+
+        app.url_defaults(self._hashed_static_url)
+        app.add_template_global(self.asset_urls)
+        app.view_functions['static'] = self.send_static_file
+
+    @property
+    def state(self):
+        return current_app.extensions['assets']
+
+    def _hashed_static_url(self, endpoint, values):
+        # url_for('static', filename='css/site.css') -> /static/dist/css/site.<hash>.css
+        manifest = self.state.manifest
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def asset_urls(self, name):
+        # the URL of a built bundle, or of its sources when there is no build
+        if name not in self.state.manifest and name in BUNDLES:
+            return [url_for('static', filename=source) for source in BUNDLES[name]]
+        return [url_for('static', filename=name)]
+
+    def send_static_file(self, filename):
+        # hashed files never change: cache them for good and send the
+        # precompressed variant the client accepts
+        if not filename.startswith(DIST + '/') or filename == MANIFEST:
+            return current_app.send_static_file(filename)
+        static_folder = current_app.static_folder
+        path, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+                path, encoding = filename + suffix, name
+                break
+        response = send_from_directory(
+            static_folder, path, max_age=self.state.max_age, download_name=posixpath.basename(filename),
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.cache_control.immutable = True
+        if encoding is not None:
+            response.content_encoding = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+@assets_cli.command('build')
+@click.option('--clean', is_flag=True, help='Remove the files of earlier builds.')
+def build_command(clean):
+    """Bundle, minify, fingerprint and precompress the static assets."""
+    static_folder = current_app.static_folder
+    manifest, written = build_assets(static_folder)
+    current_app.extensions['assets'].manifest = manifest
+    for bundle in BUNDLES:
+        path = os.path.join(static_folder, *manifest[bundle].split('/'))
+        sizes = ['{} {:,}'.format(manifest[bundle], os.path.getsize(path))]
+        sizes += ['{} {:,}'.format(suffix, os.path.getsize(path + suffix))
+                  for _, suffix in ENCODINGS if os.path.exists(path + suffix)]
+        click.echo('{:<14} {}'.format(bundle, ', '.join(sizes)))
+    click.echo('{} files in the manifest, {} written'.format(len(manifest), len(written)))
+    if brotli is None:
+        click.echo('brotli is not installed, no .br variants were written')
+    if clean:
+        click.echo('{} files of earlier builds removed'.format(len(clean_assets(static_folder, manifest))))
@@ -0,0 +1,301 @@
+#----------------------------------------------------------------------------#
+# In-process name autocomplete.
+#
+# Venue and artist names are kept in a sorted prefix index in each worker
+# process. Every name is indexed from the start of each of its first
+# MAX_WORDS words ("the velvet hall", "velvet hall", "hall"), folded to lower
+# case without diacritics and cut to KEY_LENGTH characters, so a lookup is a
+# binary search over the sorted keys and never touches the database. Keys are
+# kept as (name, word offset) pairs in two arrays rather than as strings.
+#
+# The index is built in a background thread when the worker handles its first
+# request. Venues and artists written through the ORM in this process are
+# applied when their transaction commits; rows written elsewhere (other
+# workers, `flask import`) show up when the index is rebuilt, at most every
+# AUTOCOMPLETE_MAX_AGE seconds.
+#----------------------------------------------------------------------------#
+
+import logging
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+
+from flask import current_app
+from sqlalchemy import event, select
+
+from models import Venue, Artist
+
+logger = logging.getLogger('fyyur.autocomplete')
+
+KINDS = ('venue', 'artist')
+MODELS = {'venue': Venue, 'artist': Artist}
+MAX_WORDS = 4
+KEY_LENGTH = 32
+
+
+def fold(value):
+    # lower case without diacritics, 'Café Ñandú' -> 'cafe nandu'
+    decomposed = unicodedata.normalize('NFKD', value.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def word_offsets(folded):
+    # offsets of the first MAX_WORDS words of a folded name
+    offsets = []
+    for i, c in enumerate(folded):
+        if not c.isspace() and (i == 0 or folded[i - 1].isspace()):
+            offsets.append(i)
+            if len(offsets) == MAX_WORDS:
+                break
+    return offsets
+
+
+class PrefixIndex(object):
+    # refs (id * 2 + the kind's code) index two lists holding each name as
+    # displayed and folded. ids are serial, so the lists are dense. the sorted
+    # keys are not stored as strings but as (ref, offset) pairs in two arrays,
+    # the key being the folded name from that word offset on.
+
+    def __init__(self):
+        self.names = []
+        self.folded = []
+        self.entry_refs = array('l')
+        self.entry_offsets = array('H')
+        self.count = 0
+
+    @classmethod
+    def build(cls, entries):
+        # entries: (kind, id, name) tuples
+        index = cls()
+        pairs = []
+        for kind, entity_id, name in entries:
+            if not name:
+                continue
+            ref = index._store(kind, entity_id, name)
+            folded = index.folded[ref]
+            pairs.extend((folded[offset:offset + KEY_LENGTH], ref, offset)
+                         for offset in word_offsets(folded))
+        pairs.sort()
+        index.entry_refs = array('l', (ref for _, ref, _ in pairs))
+        index.entry_offsets = array('H', (offset for _, _, offset in pairs))
+        return index
+
+    def _store(self, kind, entity_id, name):
+        ref = entity_id * 2 + KINDS.index(kind)
+        if ref >= len(self.names):
+            grow = ref + 1 - len(self.names) + len(self.names) // 4
+            self.names.extend([None] * grow)
+            self.folded.extend([None] * grow)
+        if self.names[ref] is None:
+            self.count += 1
+        self.names[ref] = name
+        self.folded[ref] = fold(name)
+        return ref
+
+    def _key(self, position):
+        offset = self.entry_offsets[position]
+        return self.folded[self.entry_refs[position]][offset:offset + KEY_LENGTH]
+
+    def _bisect(self, key):
+        lo, hi = 0, len(self.entry_refs)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def add(self, kind, entity_id, name):
+        self.remove(kind, entity_id)
+        if not name:
+            return
+        ref = self._store(kind, entity_id, name)
+        folded = self.folded[ref]
+        for offset in word_offsets(folded):
+            position = self._bisect(folded[offset:offset + KEY_LENGTH])
+            self.entry_refs.insert(position, ref)
+            self.entry_offsets.insert(position, offset)
+
+    def remove(self, kind, entity_id):
+        ref = entity_id * 2 + KINDS.index(kind)
+        if ref >= len(self.names) or self.names[ref] is None:
+            return
+        folded = self.folded[ref]
+        for offset in word_offsets(folded):
+            key = folded[offset:offset + KEY_LENGTH]
+            position = self._bisect(key)
+            while position < len(self.entry_refs) and self._key(position) == key:
+                if self.entry_refs[position] == ref and self.entry_offsets[position] == offset:
+                    del self.entry_refs[position]
+                    del self.entry_offsets[position]
+                    break
+                position += 1
+        self.names[ref] = self.folded[ref] = None
+        self.count -= 1
+
+    def lookup(self, prefix, kind=None, limit=10):
+        # [(kind, id, name)] of the names with a word starting with `prefix`,
+        # whole-name matches first
+        prefix = ' '.join(fold(prefix).split())[:KEY_LENGTH]
+        if not prefix:
+            return []
+        code = KINDS.index(kind) if kind else None
+        whole, partial, seen = [], [], set()
+        position = self._bisect(prefix)
+        while position < len(self.entry_refs) and len(whole) + len(partial) < limit:
+            if not self._key(position).startswith(prefix):
+                break
+            ref = self.entry_refs[position]
+            position += 1
+            if ref in seen or (code is not None and ref % 2 != code):
+                continue
+            seen.add(ref)
+            matches = whole if self.folded[ref].startswith(prefix) else partial
+            matches.append((KINDS[ref % 2], ref // 2, self.names[ref]))
+        return (whole + partial)[:limit]
+
+    def memory_usage(self):
+        # bytes held by the index: both name lists and their strings, and the
+        # two entry arrays
+        size = sys.getsizeof(self.names) + sys.getsizeof(self.folded)
+        size += sum(sys.getsizeof(n) for n in self.names if n is not None)
+        size += sum(sys.getsizeof(f) for f, n in zip(self.folded, self.names)
+                    if n is not None and f is not n)
+        size += sys.getsizeof(self.entry_refs) + sys.getsizeof(self.entry_offsets)
+        return size
+
+    def __len__(self):
+        return self.count
+
+
+class AutocompleteState(object):
+    # one app's index, in app.extensions['autocomplete']
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.max_age = app.config['AUTOCOMPLETE_MAX_AGE']
+        self.index = PrefixIndex()
+        self.built_at = None
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+        self.building = False
+        # changes committed while a build runs, replayed onto the new index
+        self.replay = []
+
+    def lookup(self, prefix, kind=None, limit=10):
+        if self.refreshed_at is not None and time.time() - self.refreshed_at > self.max_age:
+            self.refresh()
+        with self.lock:
+            return self.index.lookup(prefix, kind, limit)
+
+    def refresh(self):
+        # rebuild in the background, lookups use the current index meanwhile
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+            self.refreshed_at = time.time()
+            self.replay = []
+        threading.Thread(target=self._build, name='autocomplete-build', daemon=True).start()
+
+    def _build(self):
+        try:
+            started = time.time()
+            with self.app.app_context():
+                connection = self.db.session.connection()
+                entries = [(kind, entity_id, name)
+                           for kind, model in MODELS.items()
+                           for entity_id, name in connection.execute(select(model.id, model.name))]
+                self.db.session.remove()
+            index = PrefixIndex.build(entries)
+            with self.lock:
+                for kind, entity_id, name in self.replay:
+                    index.add(kind, entity_id, name)
+                self.index = index
+                self.built_at = started
+            logger.info('autocomplete index built: %d names in %.2fs', len(index), time.time() - started)
+        except Exception:
+            logger.exception('autocomplete index build failed')
+        finally:
+            with self.lock:
+                self.building = False
+                self.replay = []
+
+    def stats(self):
+        index = self.index
+        return {
+            'names': len(index),
+            'keys': len(index.entry_refs),
+            'bytes': index.memory_usage(),
+            'age': round(time.time() - self.built_at, 1) if self.built_at is not None else None,
+        }
+
+    def apply(self, changes):
+        # (kind, id, name) changes, a name of None removes the entry
+        with self.lock:
+            for kind, entity_id, name in changes:
+                self.index.add(kind, entity_id, name)
+            if self.building:
+                self.replay.extend(changes)
+
+    def remove(self, kind, entity_id):
+        # for bulk deletes, which bypass the flush hook
+        self.apply([(kind, int(entity_id), None)])
+
+
+class Autocomplete(object):
+    # binds an AutocompleteState to each app, found through current_app
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('AUTOCOMPLETE_MAX_AGE', 600)
+        state = app.extensions['autocomplete'] = AutocompleteState(app, db)
+        app.before_first_request(state.refresh)
+        if not event.contains(db.session, 'after_commit', self._apply_pending):
+            event.listen(db.session, 'after_flush', self._collect_names)
+            event.listen(db.session, 'after_commit', self._apply_pending)
+            event.listen(db.session, 'after_rollback', self._drop_pending)
+
+    @property
+    def state(self):
+        return current_app.extensions['autocomplete']
+
+    def lookup(self, prefix, kind=None, limit=10):
+        return self.state.lookup(prefix, kind, limit)
+
+    def refresh(self):
+        return self.state.refresh()
+
+    def stats(self):
+        return self.state.stats()
+
+    def apply(self, changes):
+        return self.state.apply(changes)
+
+    def remove(self, kind, entity_id):
+        return self.state.remove(kind, entity_id)
+
+    # venue and artist names flushed in a transaction are applied to the
+    # index when it commits, deletions included
+
+    def _collect_names(self, db_session, flush_context):
+        pending = db_session.info.setdefault('autocomplete_names', {})
+        for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+            for kind, model in MODELS.items():
+                if isinstance(obj, model) and obj.id is not None:
+                    pending[(kind, obj.id)] = None if obj in db_session.deleted else obj.name
+
+    def _apply_pending(self, db_session):
+        pending = db_session.info.pop('autocomplete_names', None)
+        if pending:
+            self.state.apply([(kind, entity_id, name) for (kind, entity_id), name in pending.items()])
+
+    def _drop_pending(self, db_session):
+        db_session.info.pop('autocomplete_names', None)
@@ -0,0 +1,65 @@
+"""Micro-benchmark for the `datetime` Jinja filter.
+
+Compares the original path (ctime() string -> dateutil parse -> babel
+format_datetime) with format_datetime in app.py fed datetime objects,
+with cold and warm timestamp memos.
+
+    python benchmarks/bench_datetime_filter.py [--shows 3000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import babel.dates
+import dateutil.parser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from app import DATETIME_FORMATS, format_datetime, format_datetime_cached
+
+
+def original_format_datetime(value, format='medium'):
+    date = dateutil.parser.parse(value)
+    return babel.dates.format_datetime(date, DATETIME_FORMATS[format], locale='en')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--shows', type=int, default=3000, help='show tiles rendered per run')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    start = datetime(2021, 7, 1, 20, 0)
+    times = [start + timedelta(hours=3 * i) for i in range(args.shows)]
+    strings = [t.ctime() for t in times]
+
+    for t, s in zip(times, strings):
+        assert format_datetime(t, 'full') == original_format_datetime(s, 'full')
+
+    def original():
+        for s in strings:
+            original_format_datetime(s, 'full')
+
+    def cold():
+        format_datetime_cached.cache_clear()
+        for t in times:
+            format_datetime(t, 'full')
+
+    def warm():
+        for t in times:
+            format_datetime(t, 'full')
+
+    print('{} show tiles, best of {}'.format(args.shows, args.repeat))
+    baseline = None
+    for name, fn in (('parse + format (original)', original),
+                     ('datetime, compiled pattern', cold),
+                     ('datetime, memoized', warm)):
+        best = min(timeit.repeat(fn, number=1, repeat=args.repeat))
+        baseline = baseline or best
+        print('{:<28} {:8.2f} ms  {:6.1f}x'.format(name, best * 1000, baseline / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+"""Load benchmark for the routes in app.py.
+
+Drives every GET route of the URL map and the searches (and, with --writes,
+the create forms) at a fixed concurrency and reports p50/p95/p99 latency,
+throughput and the mean number of SQL queries per request (from the
+X-DB-Queries header). Runs in-process through the Flask test client unless
+--url points at a running server.
+Results are written as JSON tagged with the git commit, so runs can be
+compared between commits with --compare.
+
+--serve starts a local server for the run instead: gunicorn sync workers
+for wsgi, uvicorn with asgi.py for asgi, --workers processes each; install
+the one used first (see SERVERS). Running both at the same high
+--concurrency and comparing the results shows what the async read routes
+gain over the sync worker cap.
+
+    flask seed --venues 5000 --artists 5000 --shows 200000
+    python benchmarks/bench_routes.py [--url http://localhost:5000]
+        [--serve wsgi|asgi] [--workers 2]
+        [--concurrency 8] [--requests 200] [--writes] [--no-cache]
+        [--output results.json] [--compare previous.json]
+"""
+import argparse
+import json
+import os
+import importlib.util
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+# query strings for the GET routes that need one to do real work, in the
+# densest city of the seed data
+QUERIES = {
+    'main.search': '?q=the',
+    'main.search_json': '?q=jazz',
+    'main.autocomplete_names': '?q=the',
+    'main.search_venues_near': '?lat=40.7128&lng=-74.0060&radius=10',
+    'main.search_venues_near_json': '?lat=40.7128&lng=-74.0060&radius=10',
+    'main.city_feed': '?city=New+York&state=NY',
+}
+# the servers --serve starts, as pinned in the README
+SERVERS = {'gunicorn': 'gunicorn==26.2.0', 'uvicorn': 'uvicorn==0.54.0'}
+# GET routes left out: static files and the diagnostics
+SKIPPED = {'static', 'main.autocomplete_stats', 'main.matchmaking_stats', 'main.cache_stats', 'main.db_stats'}
+SEARCH_ROUTES = [
+    ('POST', '/venues/search', lambda rng: {'search_term': rng.choice(['the', 'blue', 'hall', 'velvet'])}),
+    ('POST', '/artists/search', lambda rng: {'search_term': rng.choice(['the', 'band', 'neon', 'trio'])}),
+]
+
+
+def read_routes():
+    # every GET route of the URL map, '/venues/<int:venue_id>' as
+    # '/venues/{venue_id}', and the POST searches
+    from flask import Flask
+    from app import bp
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    routes = [('GET', re.sub(r'<(?:[^:>]+:)?([^>]+)>', r'{\1}', rule.rule) + QUERIES.get(rule.endpoint, ''), None)
+              for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule)
+              if 'GET' in rule.methods and rule.endpoint not in SKIPPED]
+    return routes + SEARCH_ROUTES
+
+
+def new_entity(rng, kind):
+    n = rng.randint(0, 10 ** 9)
+    data = {
+        'name': 'Bench {} {}'.format(kind, n), 'city': 'Austin', 'state': 'TX',
+        'phone': '512-555-0100', 'genres': ['Jazz', 'Blues'],
+        'image_link': '', 'facebook_link': '', 'website_link': '', 'seeking_description': '',
+    }
+    if kind == 'venue':
+        data['address'] = '{} Congress Ave'.format(n % 9999)
+    return data
+
+
+WRITE_ROUTES = [
+    ('POST', '/venues/create', lambda rng: new_entity(rng, 'venue')),
+    ('POST', '/artists/create', lambda rng: new_entity(rng, 'artist')),
+    ('POST', '/shows/create', lambda rng: {'venue_id': '{venue_id}', 'artist_id': '{artist_id}',
+        'start_time': (datetime.now() + timedelta(days=rng.randint(1, 365))).isoformat()}),
+]
+
+
+class TestClientTransport(object):
+    # requests through app.test_client(), one client per thread
+
+    def __init__(self):
+        from app import create_app
+        self.app = create_app()
+        self.local = threading.local()
+
+    def request(self, method, path, data=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, data=data)
+        return response.status_code, response.headers, response.get_data()
+
+
+class HTTPTransport(object):
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data, doseq=True).encode() if data is not None else None
+        req = urllib.request.Request(self.url + path, data=body, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+
+def start_server(mode, workers):
+    # a local server process and its url, polled until it answers
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    bind = '127.0.0.1:{}'.format(port)
+    server = 'gunicorn' if mode == 'wsgi' else 'uvicorn'
+    if importlib.util.find_spec(server) is None:
+        sys.exit('--serve {} needs {}: pip install {}'.format(mode, server, SERVERS[server]))
+    if mode == 'wsgi':
+        command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', bind,
+                   '--log-level', 'warning', 'app:create_app()']
+    else:
+        command = [sys.executable, '-m', 'uvicorn', '--factory', 'asgi:create_asgi_app',
+                   '--workers', str(workers), '--port', str(port), '--log-level', 'warning']
+    # the workers must share one key to accept each other's session cookies
+    os.environ.setdefault('SECRET_KEY', os.urandom(32).hex())
+    process = subprocess.Popen(command, cwd=ROOT)
+    url = 'http://' + bind
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url + '/', timeout=1).read()
+            return process, url
+        except (OSError, urllib.error.URLError):
+            if process.poll() is not None:
+                sys.exit('{} server exited with {}'.format(mode, process.returncode))
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit('{} server did not start'.format(mode))
+
+
+def sample_ids(transport, pages=5):
+    # venue and artist ids that exist, read from the first pages of /shows.json
+    venue_ids, artist_ids = set(), set()
+    path = '/shows.json?limit=200'
+    for _ in range(pages):
+        status, _, body = transport.request('GET', path)
+        if status != 200:
+            break
+        page = json.loads(body)
+        for show in page['shows']:
+            venue_ids.add(show['venue_id'])
+            artist_ids.add(show['artist_id'])
+        if not page['next_cursor']:
+            break
+        path = '/shows.json?limit=200&after=' + urllib.parse.quote(page['next_cursor'])
+    return sorted(venue_ids), sorted(artist_ids)
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_route(transport, route, ids, args):
+    method, template, make_data = route
+    rng = random.Random(args.random_seed)
+    venue_ids, artist_ids = ids
+    jobs = []
+    for _ in range(args.requests):
+        chosen = {'venue_id': rng.choice(venue_ids), 'artist_id': rng.choice(artist_ids)}
+        data = make_data(rng) if make_data else None
+        if data is not None:
+            data = {k: v.format(**chosen) if isinstance(v, str) else v for k, v in data.items()}
+        jobs.append((template.format(**chosen), data))
+
+    def call(job):
+        path, data = job
+        started = time.perf_counter()
+        status, headers, _ = transport.request(method, path, data)
+        elapsed = time.perf_counter() - started
+        return elapsed, status, headers.get('X-DB-Queries'), headers.get('X-Cache')
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(call, jobs))
+    wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    queries = [int(r[2]) for r in results if r[2] is not None]
+    return {
+        'route': '{} {}'.format(method, template),
+        'requests': len(results),
+        'statuses': dict(Counter(str(r[1]) for r in results)),
+        'cache_hits': sum(1 for r in results if r[3] == 'HIT'),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'throughput_rps': round(len(results) / wall, 1),
+        'queries_per_request': round(sum(queries) / float(len(queries)), 2) if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, previous=None):
+    before = {r['route']: r for r in (previous or {}).get('routes', [])}
+    row = '{:<' + str(max(len(r['route']) for r in results)) + '} {:>8} {:>8} {:>8} {:>9} {:>8} {:>6}'
+    print(row.format('route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'hits'))
+    for r in results:
+        line = row.format(
+            r['route'], r['p50_ms'], r['p95_ms'], r['p99_ms'], r['throughput_rps'],
+            '-' if r['queries_per_request'] is None else r['queries_per_request'], r['cache_hits'])
+        old = before.get(r['route'])
+        if old and old['p95_ms']:
+            line += '  p95 {:+.0f}%'.format((r['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100)
+        if old and old['throughput_rps']:
+            line += '  req/s {:+.0f}%'.format(
+                (r['throughput_rps'] - old['throughput_rps']) / old['throughput_rps'] * 100)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--serve', choices=['wsgi', 'asgi'], help='start a local server to benchmark')
+    parser.add_argument('--workers', type=int, default=2, help='--serve: server worker processes')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='requests per route')
+    parser.add_argument('--writes', action='store_true', help='also POST the create forms (adds rows)')
+    parser.add_argument('--no-cache', action='store_true', help='in-process or --serve: run with CACHE_BACKEND=null')
+    parser.add_argument('--random-seed', type=int, default=42)
+    parser.add_argument('--output', help='JSON results file (default benchmarks/results/<commit>-<time>.json)')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare p95 against')
+    args = parser.parse_args()
+
+    server = None
+    if args.serve:
+        if args.no_cache:
+            os.environ['CACHE_BACKEND'] = 'null'
+        server, args.url = start_server(args.serve, args.workers)
+    if args.url:
+        transport = HTTPTransport(args.url)
+    else:
+        if args.no_cache:
+            os.environ['CACHE_BACKEND'] = 'null'
+        transport = TestClientTransport()
+
+    try:
+        ids = sample_ids(transport)
+        if not ids[0] or not ids[1]:
+            parser.error('no shows found, run "flask seed" first')
+
+        routes = read_routes() + (WRITE_ROUTES if args.writes else [])
+        results = [run_route(transport, route, ids, args) for route in routes]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_table(results, previous)
+
+    commit = git_commit()
+    timestamp = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results',
+                                         '{}-{}.json'.format(commit or 'unknown', timestamp))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': timestamp,
+            'target': args.url or 'test client',
+            'server': '{} x{}'.format(args.serve, args.workers) if args.serve else None,
+            'concurrency': args.concurrency,
+            'requests_per_route': args.requests,
+            'cache': 'null' if args.no_cache else 'configured',
+            'routes': results,
+        }, f, indent=2)
+    print('results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#----------------------------------------------------------------------------#
+# Show bookings.
+#
+#   flask shows conflicts [--limit 100]
+#
+# A show occupies its venue and its artist from start_time up to (excluding)
+# end_time, and the database rejects a show overlapping another one at the
+# same venue or with the same artist. On Postgres these are exclusion
+# constraints over tsrange(start_time, end_time) with a GiST index. On SQLite
+# triggers check the show starting last before the new one ends, which is the
+# only one that can overlap when the existing shows do not; finding it is one
+# lookup in ix_Show_venue_id_start_time / ix_Show_artist_id_start_time.
+# See migration 4b7e2d9c1f05 for both definitions.
+#
+# `flask shows conflicts` lists overlapping shows in one pass over the table
+# in start_time order, for data loaded before the constraints existed.
+#----------------------------------------------------------------------------#
+
+from datetime import timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import DDL, event, select
+
+from models import db, Show
+
+shows_cli = AppGroup('shows', help='Check show bookings.')
+
+# (booked column, constraint name)
+BOOKED = (('venue_id', 'ex_Show_venue_overlap'), ('artist_id', 'ex_Show_artist_overlap'))
+
+SQLITE_TRIGGER = (
+    'CREATE TRIGGER "{name}_{event}" BEFORE {event} ON "Show" '
+    'WHEN (SELECT s.end_time FROM "Show" s '
+    'WHERE s.{column} = NEW.{column} AND s.start_time < NEW.end_time AND s.id IS NOT NEW.id '
+    'ORDER BY s.start_time DESC LIMIT 1) > NEW.start_time '
+    "BEGIN SELECT RAISE(ABORT, '{name}: the {kind} is already booked at that time'); END"
+)
+
+# same definitions as migration 4b7e2d9c1f05, so db.create_all() builds them too
+POSTGRES_DDL = ['CREATE EXTENSION IF NOT EXISTS btree_gist'] + [
+    'ALTER TABLE "Show" ADD CONSTRAINT "{}" EXCLUDE USING gist '
+    '({} WITH =, tsrange(start_time, end_time) WITH &&)'.format(name, column)
+    for column, name in BOOKED]
+SQLITE_DDL = [
+    SQLITE_TRIGGER.format(name=name, event=event_name, column=column, kind=column[:-3])
+    for column, name in BOOKED
+    for event_name in ('INSERT', 'UPDATE')]
+
+for statement in POSTGRES_DDL:
+    event.listen(Show.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(Show.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+
+
+def show_end_time(start_time, end_time=None):
+    # end_time, or start_time plus the default show length when none is given
+    if end_time is not None:
+        return end_time
+    return start_time + timedelta(minutes=current_app.config['SHOW_DEFAULT_DURATION'])
+
+
+def booking_conflict(error):
+    # 'venue' or 'artist' when an IntegrityError is an overlapping booking
+    message = str(getattr(error, 'orig', error))
+    for column, name in BOOKED:
+        if name in message:
+            return column[:-3]
+    return None
+
+
+def find_conflicts(batch_size=10000):
+    # yield (kind, entity id, earlier show, later show) for every overlapping
+    # pair of shows, each show an (id, start_time, end_time) row. the shows
+    # still running at each venue and artist are the only ones kept.
+    running = {column: {} for column, _ in BOOKED}
+    query = select(Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.end_time) \
+        .order_by(Show.start_time, Show.id)
+    result = db.session.connection().execution_options(stream_results=True).execute(query)
+    for rows in iter(lambda: result.fetchmany(batch_size), []):
+        for row in rows:
+            show = (row.id, row.start_time, row.end_time)
+            for column, _ in BOOKED:
+                entity_id = getattr(row, column)
+                if entity_id is None:
+                    continue
+                shows = [s for s in running[column].get(entity_id, ()) if s[2] > row.start_time]
+                for earlier in shows:
+                    yield column[:-3], entity_id, earlier, show
+                shows.append(show)
+                running[column][entity_id] = shows
+
+
+@shows_cli.command('conflicts')
+@click.option('--limit', default=100, show_default=True, help='Stop after this many conflicts.')
+def conflicts_command(limit):
+    """List shows overlapping another show at the same venue or with the same artist."""
+    found = 0
+    for kind, entity_id, earlier, later in find_conflicts():
+        found += 1
+        click.echo('{} {}: show {} ({:%Y-%m-%d %H:%M} - {:%H:%M}) overlaps show {} ({:%Y-%m-%d %H:%M} - {:%H:%M})'.format(
+            kind, entity_id, earlier[0], earlier[1], earlier[2], later[0], later[1], later[2]))
+        if found == limit:
+            break
+    if found:
+        raise click.ClickException('{}{} overlapping show{}'.format(
+            'at least ' if found == limit else '', found, '' if found == 1 else 's'))
+    click.echo('no overlapping shows')
@@ -0,0 +1,543 @@
+#----------------------------------------------------------------------------#
+# Response and data cache.
+#
+# Entries are stored under keys that embed the current version of every tag
+# they depend on (e.g. 'venues', 'venue:3'). Committing a write bumps the
+# versions of the tags it touches, so stale entries are never read again and
+# simply age out through TTL / LRU eviction.
+#
+# Cached views can also take a validator returning the version of the rows
+# the page shows. It becomes the page's ETag (and Last-Modified), and a
+# conditional GET that still matches is answered 304 without rendering.
+#
+# Inside templates, {% cache key, ... %}...{% endcache %} keeps the rendered
+# block in a per-process LRU bounded to FRAGMENT_CACHE_MAX_BYTES, under the
+# block and the given keys, e.g. a show tile under the show id and the
+# updated_at of the rows it shows. Tiles then survive the writes that
+# invalidate whole pages. Compiled templates are kept on disk by a Jinja
+# bytecode cache, so worker starts skip compiling them.
+#----------------------------------------------------------------------------#
+
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+from functools import partial, wraps
+
+from flask import current_app, request, session, make_response
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class NullCache(object):
+    # backend used when caching is disabled, every lookup misses
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def tag_versions(self, tags):
+        return [0] * len(tags)
+
+    def bump(self, tags):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+
+class MemoryCache(object):
+    # in-process backend: TTL per entry, LRU eviction past max_entries
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def tag_versions(self, tags):
+        with self._lock:
+            return [self._tags.get(tag, 0) for tag in tags]
+
+    def bump(self, tags):
+        with self._lock:
+            for tag in tags:
+                self._tags[tag] = self._tags.get(tag, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache(object):
+    # shared backend for several workers. `client` is anything speaking the
+    # redis-py API, so a local stand-in (e.g. fakeredis) works for tests.
+    # size is bounded server side, run Redis with maxmemory-policy allkeys-lru.
+
+    def __init__(self, client, prefix='fyyur:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return pickle.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=max(int(ttl), 1))
+
+    def tag_versions(self, tags):
+        if not tags:
+            return []
+        values = self.client.mget([self.prefix + 'tag:' + tag for tag in tags])
+        return [int(v) if v is not None else 0 for v in values]
+
+    def bump(self, tags):
+        pipe = self.client.pipeline()
+        for tag in tags:
+            pipe.incr(self.prefix + 'tag:' + tag)
+        pipe.execute()
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.prefix + '*'))
+
+
+class FragmentCache(object):
+    # rendered template blocks, LRU evicted past max_bytes. entries never go
+    # stale, their keys carry the version of what they show.
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = sys.getsizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= sys.getsizeof(previous)
+            self._entries[key] = value
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= sys.getsizeof(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class FragmentCacheExtension(Extension):
+    # {% cache show.id, show.version %}...{% endcache %} compiles to
+    #
+    #   {% set fragment = cache_get(block, keys) %}
+    #   {% if fragment is none %}
+    #     {% set fragment %}...{% endset %}{% set fragment = cache_set(block, keys, fragment) %}
+    #   {% endif %}{{ fragment }}
+    #
+    # `block` is random per compilation, so an edited template never reads
+    # the fragments of its previous version.
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        keys = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            keys.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+
+        name = 'fragment_{}'.format(parser.free_identifier().name)
+        args = [nodes.Const(os.urandom(8).hex()), nodes.Tuple(keys, 'load')]
+        fragment = nodes.Name(name, 'load')
+        return [
+            nodes.Assign(nodes.Name(name, 'store'), self.call_method('_get', args)),
+            nodes.If(nodes.Test(fragment, 'none', [], [], None, None), [
+                nodes.AssignBlock(nodes.Name(name, 'store'), None, body),
+                nodes.Assign(nodes.Name(name, 'store'), self.call_method('_set', args + [fragment])),
+            ], [], []),
+            nodes.Output([fragment]),
+        ]
+
+    def _get(self, block, keys):
+        fragments = self.environment.fragment_cache
+        return fragments.get((block, keys)) if fragments is not None else None
+
+    def _set(self, block, keys, value):
+        fragments = self.environment.fragment_cache
+        if fragments is not None:
+            fragments.set((block, keys), value)
+        return value
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    # workers starting together may write the same template's file, each
+    # writes a temporary file and moves it in place
+
+    def dump_bytecode(self, bucket):
+        filename = self._get_cache_filename(bucket)
+        with tempfile.NamedTemporaryFile('wb', dir=self.directory, delete=False) as f:
+            bucket.write_bytecode(f)
+        os.replace(f.name, filename)
+
+
+class CacheState(object):
+    # one app's backend, counters and page version, in app.extensions['cache']
+
+    def __init__(self, app, db):
+        self.db = db
+        backend = app.config['CACHE_BACKEND']
+        if backend == 'memory':
+            self.backend = MemoryCache(app.config['CACHE_MAX_ENTRIES'])
+        elif backend == 'redis':
+            if redis is None:
+                raise RuntimeError('CACHE_BACKEND is redis but the redis package is not installed')
+            self.backend = RedisCache(redis.Redis.from_url(app.config['CACHE_REDIS_URL']))
+        elif backend == 'null':
+            self.backend = NullCache()
+        else:
+            raise ValueError('Unknown CACHE_BACKEND {!r}'.format(backend))
+        self.default_ttl = app.config['CACHE_DEFAULT_TTL']
+        self.page_version = app.config['PAGE_VERSION'] or templates_fingerprint(app)
+        self.fragments = FragmentCache(app.config['FRAGMENT_CACHE_MAX_BYTES'])
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def key(self, name, tags):
+        versions = self.backend.tag_versions(tags)
+        return '{}|{}'.format(name, ','.join('{}={}'.format(t, v) for t, v in zip(tags, versions)))
+
+    def get_or_set(self, name, fn, tags=(), ttl=None):
+        # cached value of fn() for `name`, recomputed whenever one of `tags` is invalidated
+        tags = list(tags)
+        key = self.key(name, tags)
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = fn()
+        self.backend.set(key, value, ttl or self.default_ttl)
+        return value
+
+    def view_key(self, tags, view_args, etag=None):
+        # None when the request must not be cached
+        if request.method != 'GET' or '_flashes' in session:
+            return None
+        view_tags = tags(**view_args) if callable(tags) else list(tags)
+        return self.key('view:' + request.full_path + ('|' + etag if etag else ''), view_tags)
+
+    def page_validators(self, validated):
+        # (etag, last_modified) of a validator's result. the ETag covers the
+        # templates too, see templates_fingerprint.
+        if validated is None:
+            return None, None
+        version, last_modified = validated
+        etag = hashlib.sha1((self.page_version + repr(version)).encode('utf8')).hexdigest()[:20]
+        if last_modified is not None:
+            last_modified = last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+        return etag, last_modified
+
+    def not_modified_response(self, etag, last_modified):
+        # If-None-Match takes precedence, If-Modified-Since is only looked at
+        # without it. a date cannot tell a deleted row, only the ETag does.
+        if etag is None:
+            return None
+        if request.if_none_match:
+            matched = request.if_none_match.contains_weak(etag)
+        else:
+            matched = (last_modified is not None and request.if_modified_since is not None
+                       and last_modified <= request.if_modified_since)
+        if not matched:
+            return None
+        self.not_modified += 1
+        return current_app.response_class(status=304)
+
+    def cached_response(self, key):
+        value = self.backend.get(key) if key is not None else None
+        if value is None:
+            return None
+        self.hits += 1
+        body, mimetype = value
+        response = make_response(body)
+        response.mimetype = mimetype
+        response.headers['X-Cache'] = 'HIT'
+        return response
+
+    def store_response(self, key, response, ttl):
+        if key is None:
+            return response
+        self.misses += 1
+        if response.status_code == 200 and not response.direct_passthrough:
+            self.backend.set(key, (response.get_data(), response.mimetype), ttl or self.default_ttl)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+
+    def invalidate(self, *tags):
+        self.backend.bump(tags)
+
+    def clear(self):
+        self.backend.clear()
+        self.fragments.clear()
+        self.hits = self.misses = self.not_modified = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "not_modified": self.not_modified,
+            "fragments": self.fragments.stats(),
+        }
+
+
+class Cache(object):
+    # CACHE_BACKEND selects the backend: 'memory' (default), 'redis' or 'null'.
+    # each app keeps its own CacheState, views and hooks find it through
+    # current_app.
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_DEFAULT_TTL', 60)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('PAGE_VERSION', None)
+        app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024)
+        app.config.setdefault('TEMPLATE_BYTECODE_CACHE', True)
+        app.config.setdefault('TEMPLATE_BYTECODE_CACHE_DIR', None)
+        state = app.extensions['cache'] = CacheState(app, db)
+
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = state.fragments if state.fragments.max_bytes > 0 else None
+        if app.config['TEMPLATE_BYTECODE_CACHE']:
+            # without a directory, Jinja uses one per user in the temp directory.
+            # entries are keyed on the template source: clear the directory
+            # when a deploy changes FragmentCacheExtension's output
+            directory = app.config['TEMPLATE_BYTECODE_CACHE_DIR']
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = AtomicBytecodeCache(directory)
+
+        # collect the tags touched by each flush, bump them once the
+        # transaction commits and forget them if it rolls back
+        if not event.contains(db.session, 'after_commit', self._bump_pending):
+            event.listen(db.session, 'after_flush', self._collect_tags)
+            event.listen(db.session, 'after_bulk_delete', self._collect_bulk_tags)
+            event.listen(db.session, 'after_bulk_update', self._collect_bulk_tags)
+            event.listen(db.session, 'after_commit', self._bump_pending)
+            event.listen(db.session, 'after_rollback', self._drop_pending)
+
+    @property
+    def state(self):
+        return current_app.extensions['cache']
+
+    def get_or_set(self, name, fn, tags=(), ttl=None):
+        return self.state.get_or_set(name, fn, tags, ttl)
+
+    def invalidate(self, *tags):
+        self.state.invalidate(*tags)
+
+    def clear(self):
+        self.state.clear()
+
+    def stats(self):
+        return self.state.stats()
+
+    def cached_view(self, tags, ttl=None, validator=None):
+        # caches a GET view's rendered response. `tags` is a list or a callable
+        # receiving the view arguments. pages carrying flashed messages are
+        # personal to one visitor and bypass the cache. coroutine views (see
+        # asgi.py) are cached the same way.
+        #
+        # `validator(session, **view_args)` returns the (version, last_modified)
+        # of the rows the page shows, or None when there is no page. one cheap
+        # query, run before the view: the version makes the ETag and is part of
+        # the cache key, so a cached page is never served past a write made by
+        # another worker either.
+        def decorator(f):
+            if inspect.iscoroutinefunction(f):
+                @wraps(f)
+                async def async_wrapper(*args, **kwargs):
+                    state = self.state
+                    validated = None
+                    if self._validates(validator):
+                        validated = await current_app.extensions['async_reads'].run_sync(
+                            partial(validator, **kwargs))
+                    etag, last_modified = state.page_validators(validated)
+                    response = state.not_modified_response(etag, last_modified)
+                    if response is None:
+                        key = state.view_key(tags, kwargs, etag)
+                        response = state.cached_response(key)
+                        if response is None:
+                            response = state.store_response(key, make_response(await f(*args, **kwargs)), ttl)
+                    return self._set_validators(response, etag, last_modified)
+                return async_wrapper
+
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                state = self.state
+                validated = validator(state.db.session, **kwargs) if self._validates(validator) else None
+                etag, last_modified = state.page_validators(validated)
+                response = state.not_modified_response(etag, last_modified)
+                if response is None:
+                    key = state.view_key(tags, kwargs, etag)
+                    response = state.cached_response(key)
+                    if response is None:
+                        response = state.store_response(key, make_response(f(*args, **kwargs)), ttl)
+                return self._set_validators(response, etag, last_modified)
+            return wrapper
+        return decorator
+
+    def conditional_view(self, validator):
+        # the ETag, Last-Modified and 304s of cached_view without keeping the
+        # response, for views streaming theirs
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                state = self.state
+                validated = validator(state.db.session, **kwargs) if self._validates(validator) else None
+                etag, last_modified = state.page_validators(validated)
+                response = state.not_modified_response(etag, last_modified)
+                if response is None:
+                    response = make_response(f(*args, **kwargs))
+                return self._set_validators(response, etag, last_modified)
+            return wrapper
+        return decorator
+
+    def _validates(self, validator):
+        # pages carrying flashed messages must be rendered to show them
+        return validator is not None and request.method in ('GET', 'HEAD') and '_flashes' not in session
+
+    def _set_validators(self, response, etag, last_modified):
+        if etag is not None and response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            # browsers revalidate on every visit, which costs the validator only
+            response.cache_control.no_cache = True
+        return response
+
+    def _collect_tags(self, db_session, flush_context):
+        pending = db_session.info.setdefault('cache_tags', set())
+        for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+            cache_tags = getattr(obj, 'cache_tags', None)
+            if cache_tags is not None:
+                pending.update(cache_tags())
+
+    def _collect_bulk_tags(self, update_context):
+        # bulk query.delete()/update() do not go through the unit of work,
+        # so fall back to the model wide tag
+        mapper = update_context.mapper
+        cache_tags = getattr(mapper.class_, 'bulk_cache_tags', None)
+        if cache_tags is not None:
+            update_context.session.info.setdefault('cache_tags', set()).update(cache_tags())
+
+    def _bump_pending(self, db_session):
+        pending = db_session.info.pop('cache_tags', None)
+        if pending:
+            self.state.backend.bump(sorted(pending))
+
+    def _drop_pending(self, db_session):
+        db_session.info.pop('cache_tags', None)
+
+
+def templates_fingerprint(app):
+    # hash of the templates and the static asset manifest: a deploy changing
+    # how pages render changes every ETag. set PAGE_VERSION when it changes
+    # them by other means.
+    digest = hashlib.sha1()
+    paths = [os.path.join(app.static_folder, 'dist', 'manifest.json')]
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        paths.extend(os.path.join(root, filename) for filename in files)
+    for path in sorted(paths):
+        if os.path.isfile(path):
+            digest.update(os.path.relpath(path, app.root_path).encode('utf8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
@@ -1,10 +1,13 @@
 import os
-SECRET_KEY = os.urandom(32)
+# Signs the session cookie (flashed messages, the read-your-writes deadline of
+# replicas.py) and the edit forms, so every worker must share it. Required
+# outside debug mode, which falls back to a key of its own per process
+SECRET_KEY = os.getenv('SECRET_KEY')
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
 # Enable debug mode.
-DEBUG = True
+DEBUG = os.getenv('DEBUG', 'true').lower() in ('1', 'true', 'yes')
 
 # Connect to the database
 
@@ -17,4 +20,96 @@ DB_PATH = 'postgresql://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NA
 
 
 # IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = DB_PATH
\ No newline at end of file
+SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', DB_PATH)
+SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Connection pool, one per worker process
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+
+# Read replicas for GET requests, comma separated URLs with the same schema
+# as DATABASE_URL; each gets a pool with the settings above
+SQLALCHEMY_REPLICA_URIS = [uri for uri in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if uri]
+# seconds a visitor reads from the primary after their own write
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+# seconds between replica health checks, and the replication lag beyond
+# which a replica is skipped
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', 10))
+REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', 30))
+
+# ASGI mode (asgi.py): async engine for the read routes, defaults to
+# DATABASE_URL with the asyncpg / aiosqlite driver, and the threads running
+# the other routes
+ASYNC_DATABASE_URI = os.getenv('ASYNC_DATABASE_URL')
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', 20))
+ASYNC_MAX_OVERFLOW = int(os.getenv('ASYNC_MAX_OVERFLOW', 10))
+ASGI_SYNC_THREADS = int(os.getenv('ASGI_SYNC_THREADS', 8))
+
+# Maximum number of results returned by one venue or artist search page
+SEARCH_RESULTS_LIMIT = int(os.getenv('SEARCH_RESULTS_LIMIT', 50))
+
+# Number of results per full-text /search page
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 20))
+# matches ranked per /search query, broader terms rank only the first ones found
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', 2000))
+
+# Maximum number of past shows loaded on a venue or artist page
+PAST_SHOWS_LIMIT = int(os.getenv('PAST_SHOWS_LIMIT', 30))
+
+# Number of shows per /shows page
+SHOWS_PAGE_SIZE = int(os.getenv('SHOWS_PAGE_SIZE', 30))
+
+# Days of past shows in the .ics feeds when no ?from= is given
+ICS_FEED_PAST_DAYS = int(os.getenv('ICS_FEED_PAST_DAYS', 30))
+
+# Venue geocoder: 'file' (offline, GEOCODER_FILE, defaulting to
+# data/geocode.csv) or 'module:callable' returning one for the app config.
+# Addresses the file does not list are placed within GEOCODER_SPREAD_KM of their city
+GEOCODER = os.getenv('GEOCODER', 'file')
+GEOCODER_FILE = os.getenv('GEOCODER_FILE')
+GEOCODER_SPREAD_KM = float(os.getenv('GEOCODER_SPREAD_KM', 10))
+
+# /venues/near: default and largest radius in km, and the number of venues listed
+GEO_DEFAULT_RADIUS_KM = float(os.getenv('GEO_DEFAULT_RADIUS_KM', 10))
+GEO_MAX_RADIUS_KM = float(os.getenv('GEO_MAX_RADIUS_KM', 200))
+GEO_RESULTS_LIMIT = int(os.getenv('GEO_RESULTS_LIMIT', 50))
+
+# Minutes a show books its venue and artist for when no end time is given
+SHOW_DEFAULT_DURATION = int(os.getenv('SHOW_DEFAULT_DURATION', 180))
+
+# Seconds browsers may keep the hashed files from `flask assets build`
+ASSETS_MAX_AGE = int(os.getenv('ASSETS_MAX_AGE', 31536000))
+
+# Page and data cache: 'memory' (per process), 'redis' (shared) or 'null'
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+CACHE_DEFAULT_TTL = int(os.getenv('CACHE_DEFAULT_TTL', 60))
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+
+# Part of every page ETag, defaults to a hash of the templates and the asset
+# manifest. Change it when a deploy changes pages in other ways
+PAGE_VERSION = os.getenv('PAGE_VERSION')
+
+# Memory each worker may spend on rendered template fragments ({% cache %}), 0 disables them
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+# Keep compiled templates on disk between worker starts, in a per-user temp
+# directory unless TEMPLATE_BYTECODE_CACHE_DIR is set
+TEMPLATE_BYTECODE_CACHE = os.getenv('TEMPLATE_BYTECODE_CACHE', 'true').lower() in ('1', 'true', 'yes')
+TEMPLATE_BYTECODE_CACHE_DIR = os.getenv('TEMPLATE_BYTECODE_CACHE_DIR')
+
+# Seconds between rebuilds of each worker's autocomplete index from the database
+AUTOCOMPLETE_MAX_AGE = int(os.getenv('AUTOCOMPLETE_MAX_AGE', 600))
+
+# Seconds between rebuilds of each worker's matchmaking index, and the number
+# of matches listed
+MATCHMAKING_MAX_AGE = int(os.getenv('MATCHMAKING_MAX_AGE', 600))
+MATCHMAKING_RESULTS_LIMIT = int(os.getenv('MATCHMAKING_RESULTS_LIMIT', 20))
+
+# SQL instrumentation: statements slower than this are logged with their route
+SQL_SLOW_QUERY_MS = int(os.getenv('SQL_SLOW_QUERY_MS', 100))
+# identical statements repeated this often in one request are reported as N+1
+SQL_REPEAT_THRESHOLD = int(os.getenv('SQL_REPEAT_THRESHOLD', 5))
+# fail requests running more queries than their budget (for tests)
+SQL_STRICT = os.getenv('SQL_STRICT', 'false').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,168 @@
+#----------------------------------------------------------------------------#
+# Denormalized show counters.
+#
+# Venue and Artist carry upcoming_shows_count / past_shows_count. A show
+# counts as upcoming while its start_time is at or after the boundary stored
+# in ShowCounterState.rolled_forward_at, which only moves when roll_forward
+# runs. Using that boundary (and not the wall clock) when a show is inserted
+# keeps every show counted exactly once.
+#----------------------------------------------------------------------------#
+
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, case, bindparam
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Venue, Artist, Show, ShowCounterState
+
+counters_cli = AppGroup('counters', help='Maintain the denormalized show counters.')
+
+# (entity table, Show foreign key column name)
+COUNTED = ((Venue, 'venue_id'), (Artist, 'artist_id'))
+
+
+def counter_state(lock=False, share=False):
+    # lock takes the row FOR UPDATE to move the boundary, share FOR SHARE to
+    # count shows against it: either way it holds until the transaction ends
+    query = ShowCounterState.query
+    if lock:
+        query = query.with_for_update()
+    elif share:
+        query = query.with_for_update(read=True)
+    state = query.get(1)
+    if state is None:
+        # the migration and create_all insert the row. should it be missing,
+        # the first writers race to add it and the others read it back
+        try:
+            with db.session.begin_nested():
+                db.session.add(ShowCounterState(id=1, rolled_forward_at=datetime.now()))
+        except IntegrityError:
+            pass
+        state = query.get(1)
+    return state
+
+
+def record_new_show(show):
+    # count a show being inserted in the current transaction
+    record_new_shows([{'venue_id': show.venue_id, 'artist_id': show.artist_id,
+                       'start_time': show.start_time}])
+
+
+def record_new_shows(shows):
+    # count a batch of shows (dicts with venue_id, artist_id and start_time)
+    # inserted in the current transaction, one executemany per table
+    count_shows(shows, 1)
+
+
+def record_deleted_shows(shows):
+    # uncount a batch of shows deleted in the current transaction, against
+    # the same boundary they were counted (or since rolled forward) with
+    count_shows(shows, -1)
+
+
+def count_shows(shows, step):
+    # the share lock makes a concurrent roll_forward wait for this transaction,
+    # and so see its shows, instead of moving the boundary past them unseen
+    boundary = counter_state(share=True).rolled_forward_at
+    for model, fk in COUNTED:
+        increments = {}
+        for show in shows:
+            if show[fk] is None:
+                continue
+            upcoming, past = increments.get(show[fk], (0, 0))
+            if show['start_time'] < boundary:
+                past += step
+            else:
+                upcoming += step
+            increments[show[fk]] = (upcoming, past)
+        if not increments:
+            continue
+        table = model.__table__
+        db.session.execute(table.update()
+            .where(table.c.id == bindparam('entity_id'))
+            .values(upcoming_shows_count=table.c.upcoming_shows_count + bindparam('upcoming'),
+                    past_shows_count=table.c.past_shows_count + bindparam('past')),
+            [{'entity_id': entity_id, 'upcoming': upcoming, 'past': past}
+             for entity_id, (upcoming, past) in increments.items()])
+
+
+def roll_forward(now=None):
+    # move the shows that started since the last run from the upcoming to the
+    # past counters. only those shows are read, through the start_time index.
+    now = now or datetime.now()
+    state = counter_state(lock=True)
+    since = state.rolled_forward_at
+    moved = 0
+    if now > since:
+        for model, fk in COUNTED:
+            fk_column = getattr(Show, fk)
+            crossed = db.session.query(fk_column, func.count(Show.id)) \
+                .filter(Show.start_time >= since).filter(Show.start_time < now) \
+                .filter(fk_column.isnot(None)).group_by(fk_column).all()
+            if not crossed:
+                continue
+            table = model.__table__
+            db.session.execute(table.update()
+                .where(table.c.id == bindparam('entity_id'))
+                .values(upcoming_shows_count=table.c.upcoming_shows_count - bindparam('n'),
+                        past_shows_count=table.c.past_shows_count + bindparam('n')),
+                [{'entity_id': entity_id, 'n': n} for entity_id, n in crossed])
+            moved += sum(n for _, n in crossed)
+        state.rolled_forward_at = now
+    db.session.commit()
+    return moved
+
+
+def true_counts(fk, boundary):
+    # {entity id: (upcoming, past)} from one grouped pass over the Show table
+    fk_column = getattr(Show, fk)
+    is_upcoming = case((Show.start_time >= boundary, 1), else_=0)
+    rows = db.session.query(fk_column, func.sum(is_upcoming), func.count(Show.id)) \
+        .filter(fk_column.isnot(None)).group_by(fk_column)
+    return {entity_id: (int(upcoming), total - int(upcoming)) for entity_id, upcoming, total in rows}
+
+
+def check_counters(repair=False):
+    # list the venues and artists whose counters disagree with the Show
+    # table. with repair=True the wrong counters are rewritten in bulk.
+    state = counter_state(lock=repair)
+    boundary = state.rolled_forward_at
+    mismatches = []
+    for model, fk in COUNTED:
+        counts = true_counts(fk, boundary)
+        wrong = []
+        for entity_id, upcoming, past in db.session.query(
+                model.id, model.upcoming_shows_count, model.past_shows_count):
+            expected = counts.get(entity_id, (0, 0))
+            if (upcoming, past) != expected:
+                mismatches.append((model.__tablename__, entity_id, upcoming, past) + expected)
+                wrong.append({'entity_id': entity_id, 'upcoming': expected[0], 'past': expected[1]})
+        if repair and wrong:
+            table = model.__table__
+            db.session.execute(table.update()
+                .where(table.c.id == bindparam('entity_id'))
+                .values(upcoming_shows_count=bindparam('upcoming'), past_shows_count=bindparam('past')),
+                wrong)
+    if repair:
+        db.session.commit()
+    return mismatches
+
+
+@counters_cli.command('roll-forward')
+def roll_forward_command():
+    """Move shows that have started since the last run to the past counters."""
+    moved = roll_forward()
+    click.echo('{} show(s) rolled forward'.format(moved))
+
+
+@counters_cli.command('check')
+@click.option('--repair', is_flag=True, help='Rebuild every counter from the Show table.')
+def check_command(repair):
+    """Compare the counters with the Show table."""
+    mismatches = check_counters(repair=repair)
+    for table, entity_id, upcoming, past, true_upcoming, true_past in mismatches:
+        click.echo('{} {}: upcoming {} (expected {}), past {} (expected {})'.format(
+            table, entity_id, upcoming, true_upcoming, past, true_past))
+    click.echo('{} mismatch(es){}'.format(len(mismatches), ', repaired' if repair and mismatches else ''))
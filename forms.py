@@ -1,7 +1,7 @@
 from datetime import datetime
 from flask_wtf import Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField
-from wtforms.validators import DataRequired, AnyOf, URL
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, HiddenField
+from wtforms.validators import DataRequired, AnyOf, URL, Optional, ValidationError
 
 class ShowForm(Form):
     artist_id = StringField(
@@ -15,6 +15,16 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # left empty, the show lasts SHOW_DEFAULT_DURATION minutes
+    end_time = DateTimeField(
+        'end_time',
+        validators=[Optional()]
+    )
+
+    def validate_end_time(self, field):
+        if field.data is not None and self.start_time.data is not None \
+                and field.data <= self.start_time.data:
+            raise ValidationError('The show must end after it starts.')
 
 class VenueForm(Form):
     name = StringField(
@@ -126,6 +136,11 @@ class VenueForm(Form):
         'seeking_description'
     )
 
+    # edit form only: the version and values it was rendered from, see app.edit_token
+    version = HiddenField(
+        'version'
+    )
+
 
 
 class ArtistForm(Form):
@@ -237,3 +252,8 @@ class ArtistForm(Form):
             'seeking_description'
      )
 
+    # edit form only, see VenueForm.version
+    version = HiddenField(
+        'version'
+     )
+
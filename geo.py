@@ -0,0 +1,314 @@
+#----------------------------------------------------------------------------#
+# Venue locations.
+#
+#   flask geo geocode [--all]
+#
+# Venues have a latitude and longitude, filled by the geocoder GEOCODER names
+# when a venue's address is edited and by `flask geo geocode` for venues
+# without one. The default, 'file', is an offline stand-in reading
+# GEOCODER_FILE, a CSV of latitude and longitude per address or per city and
+# state. An address it does not list is placed at a stable point within
+# GEOCODER_SPREAD_KM of its city's entry. Any other value is a
+# 'module:callable' returning a geocoder for the app config.
+#
+# Venue.geohash is the position's 12 character geohash, kept up to date on
+# every ORM write. Points in one geohash cell share its prefix, so a box is
+# covered by at most MAX_CELLS ranges of the ix_Venue_geohash b-tree, on
+# Postgres and SQLite alike. /venues/near reads the ranges of a circle around
+# the point, drops the candidates outside it and sorts the rest by distance,
+# widening the circle until it holds a page of venues or the whole area.
+#----------------------------------------------------------------------------#
+
+import csv
+import hashlib
+import importlib
+import logging
+import math
+import os
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import and_, event, inspect, or_, select
+
+from importer import batches
+from models import db, Venue
+
+logger = logging.getLogger('fyyur.geo')
+
+geo_cli = AppGroup('geo', help='Geocode venues.')
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+# 12 characters locate a point to a few centimetres
+PRECISION = 12
+MAX_CELLS = 16
+EARTH_RADIUS_KM = 6371.0088
+
+
+def cell_bits(precision):
+    # (longitude bits, latitude bits) of a geohash, longitude takes the odd one
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2
+
+
+def cell_index(value, low, high, bits):
+    return min(max(int((value - low) / (high - low) * (1 << bits)), 0), (1 << bits) - 1)
+
+
+def interleave(x, y, lng_bits, lat_bits):
+    # the geohash bits of cell (x, y): longitude and latitude bits alternate,
+    # longitude first
+    value = 0
+    for i in range(lng_bits + lat_bits):
+        if i % 2 == 0:
+            bit = (x >> (lng_bits - 1 - i // 2)) & 1
+        else:
+            bit = (y >> (lat_bits - 1 - i // 2)) & 1
+        value = (value << 1) | bit
+    return value
+
+
+def geohash_string(value, precision):
+    return ''.join(BASE32[(value >> (5 * (precision - 1 - k))) & 31] for k in range(precision))
+
+
+def encode(latitude, longitude, precision=PRECISION):
+    lng_bits, lat_bits = cell_bits(precision)
+    x = cell_index(longitude, -180.0, 180.0, lng_bits)
+    y = cell_index(latitude, -90.0, 90.0, lat_bits)
+    return geohash_string(interleave(x, y, lng_bits, lat_bits), precision)
+
+
+def cover(south, west, north, east, max_cells=MAX_CELLS):
+    # [(low, high)] geohash ranges together covering the box, from the
+    # longest prefixes for which it spans at most max_cells cells. cells
+    # following each other in geohash order merge into one range. a box with
+    # west > east crosses the antimeridian.
+    if west > east:
+        return cover(south, west, north, 180.0, max_cells) + cover(south, -180.0, north, east, max_cells)
+    for precision in range(PRECISION, 0, -1):
+        lng_bits, lat_bits = cell_bits(precision)
+        x0, x1 = cell_index(west, -180.0, 180.0, lng_bits), cell_index(east, -180.0, 180.0, lng_bits)
+        y0, y1 = cell_index(south, -90.0, 90.0, lat_bits), cell_index(north, -90.0, 90.0, lat_bits)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_cells:
+            break
+    cells = sorted(interleave(x, y, lng_bits, lat_bits)
+                   for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    ranges = []
+    for cell in cells:
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = cell + 1
+        else:
+            ranges.append([cell, cell + 1])
+    # the last cell's range has no upper bound
+    return [(geohash_string(low, precision), geohash_string(high, precision) if high < 32 ** precision else None)
+            for low, high in ranges]
+
+
+def distance_km(lat1, lng1, lat2, lng2):
+    # great circle distance, haversine formula
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def destination(latitude, longitude, bearing, distance):
+    # the point `distance` km from a point in direction `bearing` (radians)
+    delta = distance / EARTH_RADIUS_KM
+    phi1, lambda1 = math.radians(latitude), math.radians(longitude)
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(bearing))
+    lambda2 = lambda1 + math.atan2(math.sin(bearing) * math.sin(delta) * math.cos(phi1),
+                                   math.cos(delta) - math.sin(phi1) * math.sin(phi2))
+    return math.degrees(phi2), (math.degrees(lambda2) + 540.0) % 360.0 - 180.0
+
+
+def box_around(latitude, longitude, radius):
+    # (south, west, north, east) of the circle of `radius` km around a point
+    delta = math.degrees(radius / EARTH_RADIUS_KM)
+    south, north = max(latitude - delta, -90.0), min(latitude + delta, 90.0)
+    ratio = math.sin(radius / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)) if abs(latitude) < 90 else 2
+    if south == -90.0 or north == 90.0 or ratio >= 1:
+        return south, -180.0, north, 180.0
+    spread = math.degrees(math.asin(ratio))
+    west, east = longitude - spread, longitude + spread
+    if west < -180.0:
+        west += 360.0
+    if east > 180.0:
+        east -= 360.0
+    return south, west, north, east
+
+
+def set_geohash(mapper, connection, target):
+    target.geohash = encode(target.latitude, target.longitude) \
+        if target.latitude is not None and target.longitude is not None else None
+
+
+def update_geohash(mapper, connection, target):
+    # only a moved venue is hashed again, so a write need not load the
+    # position it leaves alone (the edit forms' partial updates, see app.py)
+    attrs = inspect(target).attrs
+    if attrs.latitude.history.has_changes() or attrs.longitude.history.has_changes():
+        set_geohash(mapper, connection, target)
+
+event.listen(Venue, 'before_insert', set_geohash)
+event.listen(Venue, 'before_update', update_geohash)
+
+
+def nearby_venues(session, box, center, radius=None, limit=50):
+    # the `limit` venues in `box` (south, west, north, east) closest to
+    # `center`, within `radius` km of it when given, as [(distance, venue row)],
+    # and whether there are more. the search starts close to the center and
+    # widens until it has found enough, so in a crowded city it reads little
+    # more than the venues it returns
+    south, west, north, east = box
+    reach = max(distance_km(center[0], center[1], lat, lng) for lat in (south, north) for lng in (west, east))
+    if radius is not None:
+        reach = min(reach, radius)
+    in_longitudes = Venue.longitude.between(west, east) if west <= east \
+        else or_(Venue.longitude >= west, Venue.longitude <= east)
+    query = session.query(
+            Venue.id, Venue.name, Venue.city, Venue.state, Venue.latitude, Venue.longitude,
+            Venue.upcoming_shows_count.label('num_upcoming_shows')) \
+        .filter(Venue.latitude.between(south, north), in_longitudes)
+
+    distance = min(reach, max(reach / 16, 0.5))
+    while True:
+        final = distance >= reach
+        area = box if final else box_around(center[0], center[1], distance)
+        in_cells = or_(*[and_(Venue.geohash >= low, Venue.geohash < high) if high is not None else Venue.geohash >= low
+                         for low, high in cover(*area)])
+        found = []
+        for row in query.filter(in_cells):
+            d = distance_km(center[0], center[1], row.latitude, row.longitude)
+            if d <= distance or (final and radius is None):
+                found.append((d, row))
+        if final or len(found) > limit:
+            found.sort(key=lambda pair: (pair[0], pair[1].id))
+            return found[:limit], len(found) > limit
+        # on to where `limit` venues are expected at the density seen so far,
+        # at least twice as far: at most 5 queries
+        distance = min(reach, distance * max(2.0, 1.5 * math.sqrt((limit + 1) / max(len(found), 1))))
+
+
+class FileGeocoder(object):
+    # offline stand-in: a CSV with address, city, state, latitude and
+    # longitude columns, rows with an empty address standing for their city
+
+    def __init__(self, path, spread=10.0):
+        self.spread = spread
+        self.addresses = {}
+        self.cities = {}
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                position = (float(row['latitude']), float(row['longitude']))
+                city = (row['city'].strip().lower(), row['state'].strip().lower())
+                if row.get('address', '').strip():
+                    self.addresses[(row['address'].strip().lower(),) + city] = position
+                else:
+                    self.cities[city] = position
+
+    def geocode(self, address, city, state):
+        # (latitude, longitude) or None
+        address = (address or '').strip().lower()
+        city = ((city or '').strip().lower(), (state or '').strip().lower())
+        if (address,) + city in self.addresses:
+            return self.addresses[(address,) + city]
+        centre = self.cities.get(city)
+        if centre is None or not address or not self.spread:
+            return centre
+        # spread evenly over the disc, the same point for the same address
+        digest = hashlib.sha1(address.encode('utf8')).digest()
+        bearing = int.from_bytes(digest[:4], 'big') / 2 ** 32 * 2 * math.pi
+        distance = self.spread * math.sqrt(int.from_bytes(digest[4:8], 'big') / 2 ** 32)
+        return destination(centre[0], centre[1], bearing, distance)
+
+
+def file_geocoder(config):
+    return FileGeocoder(config['GEOCODER_FILE'], config['GEOCODER_SPREAD_KM'])
+
+
+def load_geocoder(config):
+    name = config['GEOCODER']
+    if name == 'file':
+        return file_geocoder(config)
+    module, _, attribute = name.partition(':')
+    return getattr(importlib.import_module(module), attribute)(config)
+
+
+class GeocodingState(object):
+    # one app's geocoder, loaded on first use
+
+    def __init__(self, app):
+        self.config = app.config
+        self.geocoder = None
+
+    def geocode(self, address, city, state):
+        # loaded on first use, a remote geocoder may be slow to set up
+        if self.geocoder is None:
+            self.geocoder = load_geocoder(self.config)
+        return self.geocoder.geocode(address, city, state)
+
+
+class Geocoding(object):
+    # binds a GeocodingState to each app, found through current_app
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GEOCODER', 'file')
+        if not app.config.get('GEOCODER_FILE'):
+            app.config['GEOCODER_FILE'] = os.path.join(app.root_path, 'data', 'geocode.csv')
+        app.config.setdefault('GEOCODER_SPREAD_KM', 10.0)
+        app.config.setdefault('GEO_DEFAULT_RADIUS_KM', 10.0)
+        app.config.setdefault('GEO_MAX_RADIUS_KM', 200.0)
+        app.config.setdefault('GEO_RESULTS_LIMIT', 50)
+        app.extensions['geocoding'] = GeocodingState(app)
+
+    @property
+    def state(self):
+        return current_app.extensions['geocoding']
+
+    def geocode(self, address, city, state):
+        return self.state.geocode(address, city, state)
+
+    def locate(self, venue):
+        # set a venue's position from its address, None where not found. a
+        # failing geocoder does not fail the write, `flask geo geocode` places
+        # the venue later
+        try:
+            position = self.geocode(venue.address, venue.city, venue.state)
+        except Exception:
+            logger.exception('geocoding venue %s failed', venue.id)
+            position = None
+        venue.latitude, venue.longitude = position or (None, None)
+
+
+@geo_cli.command('geocode')
+@click.option('--all', 'everything', is_flag=True, help='Geocode every venue, not only those without a position.')
+@click.option('--batch-size', default=1000, show_default=True)
+def geocode_command(everything, batch_size):
+    """Fill in the latitude and longitude of venues from their address."""
+    geocoding = current_app.extensions['geocoding']
+    query = select(Venue.id, Venue.address, Venue.city, Venue.state).order_by(Venue.id)
+    if not everything:
+        query = query.where(Venue.latitude.is_(None))
+    venues = db.session.execute(query).all()
+    table = Venue.__table__
+    located = 0
+    for batch in batches(venues, batch_size):
+        rows = []
+        for venue in batch:
+            position = geocoding.geocode(venue.address, venue.city, venue.state)
+            if position is not None:
+                rows.append({'venue_id': venue.id, 'latitude': position[0], 'longitude': position[1],
+                             'geohash': encode(*position)})
+        if rows:
+            db.session.execute(table.update().where(table.c.id == db.bindparam('venue_id'))
+                .values(latitude=db.bindparam('latitude'), longitude=db.bindparam('longitude'),
+                        geohash=db.bindparam('geohash')), rows)
+            db.session.commit()
+        located += len(rows)
+    click.echo('{} venues located, {} not found'.format(located, len(venues) - located))
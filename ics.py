@@ -0,0 +1,86 @@
+#----------------------------------------------------------------------------#
+# iCalendar feeds.
+#
+# The venue, artist and city show feeds (/venues/<id>/shows.ics,
+# /artists/<id>/shows.ics, /shows.ics?city=&state=) are written as the rows
+# arrive from a server-side cursor, FEED_BATCH_SIZE events per chunk, so a
+# feed of any length is never held in memory whole.
+#
+# Start and end times are written as floating local times, like the pages
+# show them; DTSTAMP and LAST-MODIFIED are the show's updated_at in UTC.
+#----------------------------------------------------------------------------#
+
+FEED_BATCH_SIZE = 200
+
+CONTENT_TYPE = 'text/calendar; charset=utf-8'
+
+
+def escape_text(value):
+    # TEXT values escape backslashes, semicolons, commas and line breaks
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def fold(line):
+    # lines longer than 75 octets continue on the next one after a space,
+    # never splitting a UTF-8 sequence
+    encoded = line.encode('utf8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf8'))
+        start, limit = end, 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def local_time(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def utc_time(value):
+    # updated_at is naive UTC
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def show_event(show, host, url_root):
+    # one VEVENT. `show` has the Show id, start_time, end_time, updated_at,
+    # artist_id and the artist and venue names and location
+    location = ', '.join(part for part in (show.venue_name, show.venue_address,
+                                           show.venue_city, show.venue_state) if part)
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:show-{}@{}'.format(show.id, host),
+        'DTSTAMP:' + utc_time(show.updated_at),
+        'LAST-MODIFIED:' + utc_time(show.updated_at),
+        'DTSTART:' + local_time(show.start_time),
+        'DTEND:' + local_time(show.end_time),
+        'SUMMARY:' + escape_text('{} at {}'.format(show.artist_name, show.venue_name)),
+        'LOCATION:' + escape_text(location),
+        'URL:{}artists/{}'.format(url_root, show.artist_id),
+        'END:VEVENT',
+    ]
+    return ''.join(fold(line) for line in lines)
+
+
+def calendar(name, shows, host, url_root):
+    # the feed as chunks of text: header, the events in batches, footer
+    yield ''.join(fold(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Fyyur//Shows//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:' + escape_text(name),
+    ))
+    batch = []
+    for show in shows:
+        batch.append(show_event(show, host, url_root))
+        if len(batch) == FEED_BATCH_SIZE:
+            yield ''.join(batch)
+            batch = []
+    batch.append('END:VCALENDAR\r\n')
+    yield ''.join(batch)
@@ -0,0 +1,347 @@
+#----------------------------------------------------------------------------#
+# Bulk import of venues, artists and shows.
+#
+#   flask import venues  venues.csv
+#   flask import artists artists.ndjson --rejects rejected.ndjson
+#   flask import shows   shows.csv --batch-size 5000
+#
+# Files are streamed in batches. Every row is validated with the same rules
+# as VenueForm / ArtistForm / ShowForm; rows that fail are reported and
+# skipped. Venues and artists may carry an external_id, which shows use to
+# reference them (venue_external_id / artist_external_id) instead of our ids.
+# Shows overlapping another booking of their venue or artist are rejected.
+# On Postgres each batch is loaded with COPY, elsewhere with executemany, and
+# the new rows are added to the search index.
+#
+# CSV columns are the form field names. Multiple genres are separated by ';'
+# in CSV files and given as a list in NDJSON files.
+#----------------------------------------------------------------------------#
+
+import csv
+import io
+import json
+import time
+from abc import ABC, abstractmethod
+from itertools import islice
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+from werkzeug.datastructures import MultiDict
+
+from bookings import booking_conflict, show_end_time
+from counters import record_new_shows
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres
+from search import index_documents
+
+import_cli = AppGroup('import', help='Bulk import venues, artists and shows.')
+
+
+def read_rows(path, format=None):
+    # yield a dict for every record of a CSV or NDJSON file
+    format = format or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as f:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                if row.get('genres'):
+                    row['genres'] = [g.strip() for g in row['genres'].split(';')]
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def formdata(row):
+    data = MultiDict()
+    for key, value in row.items():
+        if isinstance(value, list):
+            data.setlist(key, [str(v) for v in value])
+        elif isinstance(value, bool):
+            data[key] = 'y' if value else 'false'
+        elif value is not None:
+            data[key] = str(value)
+    return data
+
+
+def validate(form_class, row):
+    form = form_class(formdata=formdata(row), meta={'csrf': False})
+    if form.validate():
+        return form, None
+    return form, form.errors
+
+
+def insert_rows(table, rows):
+    # insert a batch into `table`, through COPY on Postgres
+    if not rows:
+        return
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql' and connection.dialect.driver == 'psycopg2':
+        # COPY skips the column defaults SQLAlchemy fills into an INSERT
+        defaults = {}
+        for column in table.columns:
+            default = column.default
+            if default is not None and column.name not in rows[0] and (default.is_scalar or default.is_callable):
+                defaults[column.name] = default.arg(None) if default.is_callable else default.arg
+        if defaults:
+            rows = [dict(row, **defaults) for row in rows]
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(['\\N' if row[c] is None else row[c] for c in columns])
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert('COPY "{}" ({}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')'.format(
+            table.name, ', '.join('"{}"'.format(c) for c in columns)), buffer)
+    else:
+        connection.execute(table.insert(), rows)
+
+
+class Importer(ABC):
+    # one batch at a time: validate, resolve references, insert, commit
+
+    form_class = None
+
+    def __init__(self, rejects=None):
+        self.rejects = rejects
+        self.inserted = 0
+        self.rejected = 0
+
+    def reject(self, record, row, errors):
+        self.rejected += 1
+        if self.rejects is not None:
+            self.rejects.write(json.dumps({'record': record, 'row': row, 'errors': errors}, default=str) + '\n')
+
+    def run(self, rows, batch_size):
+        for batch in batches(enumerate(rows, start=1), batch_size):
+            valid = []
+            for record, row in batch:
+                form, errors = validate(self.form_class, row)
+                if errors:
+                    self.reject(record, row, errors)
+                else:
+                    valid.append((record, row, form))
+            self.load(valid)
+            db.session.commit()
+
+    @abstractmethod
+    def load(self, valid):
+        # insert the batch's valid (record, row, form) triples, rejecting
+        # those that conflict with existing rows
+        pass
+
+
+class EntityImporter(Importer):
+    # venues and artists, with their genres
+
+    kind = None
+    model = None
+    genres_table = None
+    genres_fk = None
+    seeking_field = None
+    seeking_column = None
+
+    def values(self, row, form):
+        return {
+            'external_id': row.get('external_id') or None,
+            'name': form.name.data,
+            'city': form.city.data,
+            'state': form.state.data,
+            'phone': form.phone.data,
+            'image_link': form.image_link.data,
+            'facebook_link': form.facebook_link.data,
+            'web_link': form.website_link.data,
+            self.seeking_column: bool(getattr(form, self.seeking_field).data),
+            'seeking_description': form.seeking_description.data,
+        }
+
+    def load(self, valid):
+        model = self.model
+        external_ids = [row['external_id'] for _, row, _ in valid if row.get('external_id')]
+        taken = set()
+        if external_ids:
+            taken = {e for e, in db.session.query(model.external_id)
+                     .filter(model.external_id.in_(external_ids))}
+
+        rows, genres = [], []
+        for record, row, form in valid:
+            external_id = row.get('external_id') or None
+            if external_id is not None and external_id in taken:
+                self.reject(record, row, {'external_id': ['Already imported.']})
+                continue
+            taken.add(external_id)
+            rows.append(self.values(row, form))
+            genres.append(form.genres.data)
+        if not rows:
+            return
+
+        if all(r['external_id'] for r in rows):
+            insert_rows(model.__table__, rows)
+            ids = dict(db.session.query(model.external_id, model.id)
+                       .filter(model.external_id.in_([r['external_id'] for r in rows])))
+            ids = [ids[r['external_id']] for r in rows]
+        else:
+            # without external keys the new ids have to come back one by one
+            ids = [db.session.execute(model.__table__.insert().values(**r)).inserted_primary_key[0]
+                   for r in rows]
+
+        known_genres = Genre.from_names(name for names in genres for name in names)
+        db.session.flush()
+        genre_ids = {g.name: g.id for g in known_genres}
+        insert_rows(self.genres_table, [{self.genres_fk: entity_id, 'genre_id': genre_ids[name]}
+            for entity_id, names in zip(ids, genres) for name in set(names)])
+        index_documents(db.session.connection(), self.kind, ids)
+        self.inserted += len(rows)
+
+
+class VenueImporter(EntityImporter):
+    form_class = VenueForm
+    kind = 'venue'
+    model = Venue
+    genres_table = venue_genres
+    genres_fk = 'venue_id'
+    seeking_field = 'seeking_talent'
+    seeking_column = 'looking_for_talent'
+
+    def values(self, row, form):
+        values = super(VenueImporter, self).values(row, form)
+        values['address'] = form.address.data
+        return values
+
+
+class ArtistImporter(EntityImporter):
+    form_class = ArtistForm
+    kind = 'artist'
+    model = Artist
+    genres_table = artist_genres
+    genres_fk = 'artist_id'
+    seeking_field = 'seeking_venue'
+    seeking_column = 'looking_for_venues'
+
+
+class ShowImporter(Importer):
+    form_class = ShowForm
+
+    def reference(self, row, form, name):
+        # ('external_id', key) or ('id', id) for the show's venue or artist
+        if row.get(name + '_external_id'):
+            return ('external_id', str(row[name + '_external_id']))
+        value = (getattr(form, name + '_id').data or '').strip()
+        return ('id', int(value)) if value.isdigit() else None
+
+    def resolve(self, model, references):
+        # map the batch's references to existing ids, one query per kind of key
+        resolved = {}
+        for kind in ('external_id', 'id'):
+            keys = list({key for k, key in references if k == kind})
+            if keys:
+                column = getattr(model, kind)
+                resolved.update(((kind, key), id) for key, id in
+                    db.session.query(column, model.id).filter(column.in_(keys)))
+        return resolved
+
+    def load(self, valid):
+        references = [(self.reference(row, form, 'venue'), self.reference(row, form, 'artist'))
+                      for _, row, form in valid]
+        venues = self.resolve(Venue, [v for v, _ in references if v])
+        artists = self.resolve(Artist, [a for _, a in references if a])
+
+        rows = []
+        for (record, row, form), (venue, artist) in zip(valid, references):
+            errors = {}
+            if venue not in venues:
+                errors['venue'] = ['Unknown venue.']
+            if artist not in artists:
+                errors['artist'] = ['Unknown artist.']
+            if errors:
+                self.reject(record, row, errors)
+                continue
+            rows.append((record, row, {'venue_id': venues[venue], 'artist_id': artists[artist],
+                         'start_time': form.start_time.data,
+                         'end_time': show_end_time(form.start_time.data, form.end_time.data)}))
+
+        if rows:
+            # COPY does not return ids, the batch is everything after the current maximum
+            last_id = db.session.query(func.max(Show.id)).scalar() or 0
+            rows = self.insert_bookings(rows)
+            record_new_shows(rows)
+            connection = db.session.connection()
+            index_documents(connection, 'show', [i for i, in connection.execute(
+                select(Show.id).where(Show.id > last_id))])
+        self.inserted += len(rows)
+
+    def insert_bookings(self, rows):
+        # insert the batch, or when a show overlaps another booking insert it
+        # row by row to reject the overlapping ones. returns the inserted rows
+        try:
+            with db.session.begin_nested():
+                insert_rows(Show.__table__, [values for _, _, values in rows])
+            return [values for _, _, values in rows]
+        except IntegrityError as e:
+            if booking_conflict(e) is None:
+                raise
+        inserted = []
+        for record, row, values in rows:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(Show.__table__.insert().values(**values))
+                inserted.append(values)
+            except IntegrityError as e:
+                kind = booking_conflict(e)
+                if kind is None:
+                    raise
+                self.reject(record, row, {kind: ['The {} is already booked at that time.'.format(kind)]})
+        return inserted
+
+
+IMPORTERS = {
+    'venues': VenueImporter,
+    'artists': ArtistImporter,
+    'shows': ShowImporter,
+}
+
+
+def import_file(kind, path, format=None, batch_size=1000, rejects=None):
+    importer = IMPORTERS[kind](rejects=rejects)
+    started = time.perf_counter()
+    importer.run(read_rows(path, format), batch_size)
+    return importer, time.perf_counter() - started
+
+
+def add_import_command(kind):
+    @import_cli.command(kind)
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', type=click.Choice(['csv', 'ndjson']),
+                  help='Defaults to ndjson for .ndjson/.jsonl files, csv otherwise.')
+    @click.option('--batch-size', default=1000, show_default=True)
+    @click.option('--rejects', type=click.Path(dir_okay=False),
+                  help='Write rejected rows and their errors to this NDJSON file.')
+    def command(path, format, batch_size, rejects):
+        rejects_file = open(rejects, 'w', encoding='utf-8') if rejects else None
+        try:
+            importer, elapsed = import_file(kind, path, format, batch_size, rejects_file)
+        finally:
+            if rejects_file is not None:
+                rejects_file.close()
+        total = importer.inserted + importer.rejected
+        click.echo('{}: {} inserted, {} rejected in {:.2f}s ({:.0f} rows/s)'.format(
+            kind, importer.inserted, importer.rejected, elapsed, total / elapsed if elapsed else 0))
+
+    command.__doc__ = 'Import {} from a CSV or NDJSON file.'.format(kind)
+    return command
+
+
+for kind in IMPORTERS:
+    add_import_command(kind)
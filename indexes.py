@@ -0,0 +1,122 @@
+#----------------------------------------------------------------------------#
+# Index usage check.
+#
+#   flask indexes check
+#
+# Requests the hot routes through the test client, records the statements
+# they run and EXPLAINs each one, failing unless the plan uses the index the
+# route relies on. On Postgres sequential scans are disabled for the EXPLAIN
+# so the result does not depend on the size of the tables; on SQLite the
+# trigram name indexes do not exist and the search routes are skipped.
+#----------------------------------------------------------------------------#
+
+from urllib.parse import quote
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event
+
+from models import db, Show, Venue
+
+indexes_cli = AppGroup('indexes', help='Check that the hot queries use their indexes.')
+
+# (method, path, form data, expected index or a tuple of acceptable ones,
+#  dialects it exists on or None for all)
+HOT_QUERIES = [
+    ('GET', '/venues', None, 'ix_Venue_state_city', None),
+    ('GET', '/venues/{venue_id}', None, 'ix_Show_venue_id_start_time', None),
+    ('GET', '/artists/{artist_id}', None, 'ix_Show_artist_id_start_time', None),
+    ('GET', '/shows', None, 'ix_Show_start_time', None),
+    ('GET', '/shows?venue_id={venue_id}', None, 'ix_Show_venue_id_start_time', None),
+    ('GET', '/shows?artist_id={artist_id}', None, 'ix_Show_artist_id_start_time', None),
+    # a city's venues and their shows in the window, or for a city with many
+    # shows the start_time order filtered by venue until the page is full
+    ('GET', '/shows?city={city}&state={state}', None,
+     ('ix_Show_venue_id_start_time', 'ix_Show_start_time'), None),
+    ('GET', '/venues/{venue_id}/shows.ics', None, 'ix_Show_venue_id_start_time', None),
+    ('GET', '/artists/{artist_id}/shows.ics', None, 'ix_Show_artist_id_start_time', None),
+    ('GET', '/shows.ics?city={city}&state={state}', None, 'ix_Show_venue_id_start_time', None),
+    ('GET', '/venues/near.json?lat={lat}&lng={lng}', None, 'ix_Venue_geohash', None),
+    ('POST', '/venues/search', {'search_term': 'the'}, 'ix_Venue_name', ('postgresql',)),
+    ('POST', '/artists/search', {'search_term': 'the'}, 'ix_Artist_name', ('postgresql',)),
+]
+
+
+def recorded_statements(client, method, path, data):
+    # the (statement, parameters) pairs run while handling one request
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    current_app.extensions['cache'].clear()
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        # buffered, so streamed responses run their queries here
+        response = client.open(path, method=method, data=data, buffered=True)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return response.status_code, statements
+
+
+def explain(statement, parameters):
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters)
+        plan = '\n'.join(row[0] for row in rows)
+    else:
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)
+        plan = '\n'.join(row[-1] for row in rows)
+    db.session.rollback()
+    return plan
+
+
+def check_indexes():
+    # [(path, index, plans or None when skipped, ok)]
+    sample = db.session.query(Show.venue_id, Show.artist_id, Venue.city, Venue.state).join(Venue) \
+        .filter(Show.artist_id.isnot(None)).first()
+    if sample is None:
+        raise click.ClickException('no shows to query, run "flask seed" first')
+    ids = {'venue_id': sample.venue_id, 'artist_id': sample.artist_id,
+           'city': quote(sample.city), 'state': quote(sample.state)}
+    # a geocoded venue's position, the query plan is the same without one
+    position = db.session.query(Venue.latitude, Venue.longitude).filter(Venue.latitude.isnot(None)).first()
+    ids['lat'], ids['lng'] = ('{:.4f}'.format(value) for value in position or (0.0, 0.0))
+    dialect = db.engine.dialect.name
+
+    client = current_app.test_client()
+    results = []
+    for method, path, data, index, dialects in HOT_QUERIES:
+        path = path.format(**ids)
+        if dialects and dialect not in dialects:
+            results.append((path, index, None, True))
+            continue
+        status, statements = recorded_statements(client, method, path, data)
+        if status != 200:
+            raise click.ClickException('{} {} returned {}'.format(method, path, status))
+        plans = [explain(statement, parameters) for statement, parameters in statements]
+        indexes = index if isinstance(index, tuple) else (index,)
+        results.append((path, ' or '.join(indexes), plans,
+                        any(name in plan for name in indexes for plan in plans)))
+    return results
+
+
+@indexes_cli.command('check')
+@click.option('--verbose', is_flag=True, help='Print every plan, not only the failing ones.')
+def check_command(verbose):
+    """EXPLAIN the hot queries and fail if they do not use their indexes."""
+    results = check_indexes()
+    for path, index, plans, ok in results:
+        if plans is None:
+            click.echo('skip {:<32} {} (not on {})'.format(path, index, db.engine.dialect.name))
+            continue
+        click.echo('{} {:<32} {}'.format('ok  ' if ok else 'FAIL', path, index))
+        if verbose or not ok:
+            for plan in plans:
+                click.echo('    ' + plan.replace('\n', '\n    '))
+    failed = sum(1 for _, _, _, ok in results if not ok)
+    if failed:
+        raise click.ClickException('{} hot quer{} did not use the expected index'.format(
+            failed, 'y' if failed == 1 else 'ies'))
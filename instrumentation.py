@@ -0,0 +1,152 @@
+#----------------------------------------------------------------------------#
+# Per-request SQL instrumentation.
+#
+# Every statement executed while handling a request is counted and timed.
+# The totals are returned in the X-DB-Queries / X-DB-Time headers and logged
+# as one JSON line per request on the 'fyyur.sql' logger. Statements slower
+# than SQL_SLOW_QUERY_MS go to 'fyyur.sql.slow' with their route, and a
+# statement repeated SQL_REPEAT_THRESHOLD times or more in one request (the
+# signature of an N+1 loop) is reported on 'fyyur.sql.repeated'.
+#
+# With SQL_STRICT enabled, a request running more statements than its view's
+# budget (see query_budget) or SQL_QUERY_BUDGET raises QueryBudgetExceeded,
+# which fails the test that issued it.
+#
+# A streamed response (the .ics feeds) runs queries while its body is sent,
+# after its headers: its X-DB-Queries / X-DB-Time count the statements run
+# before the body, and the log line, the N+1 reports and the budget check
+# are done once the body is, when the response is closed.
+#----------------------------------------------------------------------------#
+
+import json
+import logging
+import time
+from collections import Counter
+
+from flask import g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('fyyur.sql')
+slow_logger = logging.getLogger('fyyur.sql.slow')
+repeated_logger = logging.getLogger('fyyur.sql.repeated')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(n):
+    # decorator declaring the most statements a view may run per request
+    def decorator(f):
+        f.query_budget = n
+        return f
+    return decorator
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, elapsed):
+        self.queries += 1
+        self.time += elapsed
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        return [(s, n) for s, n in self.statements.most_common() if n >= threshold]
+
+
+def current_stats():
+    return g.get('sql_stats') if has_request_context() else None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_stats() is not None:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = current_stats()
+    if stats is None or not conn.info.get('query_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    stats.record(statement, elapsed)
+    if elapsed * 1000 >= current_app.config['SQL_SLOW_QUERY_MS']:
+        slow_logger.warning(json.dumps({
+            'route': request.endpoint,
+            'path': request.path,
+            'ms': round(elapsed * 1000, 2),
+            'statement': statement,
+        }))
+
+
+class SQLInstrumentation(object):
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQL_INSTRUMENTATION', True)
+        app.config.setdefault('SQL_SLOW_QUERY_MS', 100)
+        app.config.setdefault('SQL_REPEAT_THRESHOLD', 5)
+        app.config.setdefault('SQL_STRICT', False)
+        app.config.setdefault('SQL_QUERY_BUDGET', None)
+        if not app.config['SQL_INSTRUMENTATION']:
+            return
+
+        # engines are created lazily, so listen on all of them
+        if not event.contains(Engine, 'after_cursor_execute', after_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+
+    def start(self):
+        g.sql_stats = RequestStats()
+
+    def finish(self, response):
+        # a streamed body runs in the request's context, its queries are
+        # counted until the response is closed
+        stats = g.get('sql_stats') if response.is_streamed else g.pop('sql_stats', None)
+        if stats is None:
+            return response
+
+        response.headers['X-DB-Queries'] = str(stats.queries)
+        response.headers['X-DB-Time'] = '{:.2f}'.format(stats.time * 1000)
+
+        view = current_app.view_functions.get(request.endpoint)
+        config = current_app.config
+        route = {
+            'route': request.endpoint,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+        }
+        budget = getattr(view, 'query_budget', config['SQL_QUERY_BUDGET']) if config['SQL_STRICT'] else None
+        if response.is_streamed:
+            response.call_on_close(lambda: self.report(stats, route, config['SQL_REPEAT_THRESHOLD'], budget))
+        else:
+            self.report(stats, route, config['SQL_REPEAT_THRESHOLD'], budget)
+        return response
+
+    def report(self, stats, route, repeat_threshold, budget):
+        repeated = stats.repeated(repeat_threshold)
+        for statement, n in repeated:
+            repeated_logger.warning(json.dumps({
+                'route': route['route'],
+                'path': route['path'],
+                'count': n,
+                'statement': statement,
+            }))
+        logger.info(json.dumps(dict(route, queries=stats.queries, db_ms=round(stats.time * 1000, 2),
+                                    repeated=len(repeated))))
+
+        if budget is not None and stats.queries > budget:
+            raise QueryBudgetExceeded('{} ran {} queries, budget is {}'.format(
+                route['route'], stats.queries, budget))
@@ -0,0 +1,428 @@
+#----------------------------------------------------------------------------#
+# In-process artist / venue matchmaking.
+#
+# Ranks the venues looking for talent for an artist, and the artists looking
+# for venues for a venue. Each worker process keeps every venue's and
+# artist's city, genres and seeking flag, inverted lists of the seeking ones
+# per genre and per city, and what the shows booked so far say about them:
+# the genres of the artists each venue has hosted, the cities each artist has
+# played and which artist played which venue. A lookup scores only the
+# seeking counterparts sharing a genre or a city with the entity, so it never
+# joins artists with venues in the database.
+#
+# A match scores, with the WEIGHTS below, the genres both have in common (of
+# those either has), being in the same city or state, the share of the
+# venue's past shows by artists of those genres, how often the artist has
+# played the venue's city and whether they have played the venue itself.
+#
+# Like the autocomplete index the lists are built in a background thread on
+# the worker's first request and rebuilt at most every MATCHMAKING_MAX_AGE
+# seconds. Venues, artists and shows written through the ORM in this process
+# are applied when their transaction commits; changes made elsewhere (other
+# workers, `flask import`) show up after the next rebuild. Shows committed
+# while a rebuild runs are counted from the rebuild after it.
+#----------------------------------------------------------------------------#
+
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import current_app
+from sqlalchemy import event, func, inspect, select
+
+from models import Venue, Artist, Show, Genre, venue_genres, artist_genres
+
+logger = logging.getLogger('fyyur.matchmaking')
+
+KINDS = ('venue', 'artist')
+OTHER = {'venue': 'artist', 'artist': 'venue'}
+MODELS = {'venue': Venue, 'artist': Artist}
+SEEKING = {'venue': Venue.looking_for_talent, 'artist': Artist.looking_for_venues}
+GENRES = {'venue': venue_genres, 'artist': artist_genres}
+
+WEIGHTS = {
+    'genres': 3.0,
+    'same_city': 2.0,
+    'same_state': 1.0,
+    'hosted_genres': 1.0,
+    'played_city': 1.0,
+    'played_venue': 0.5,
+}
+# shows in a city after which an artist counts as fully at home there
+PLAYED_CITY_SATURATION = 3
+# the most the booking history adds to a score
+HISTORY_WEIGHT = WEIGHTS['hosted_genres'] + WEIGHTS['played_city'] + WEIGHTS['played_venue']
+
+
+# inverted lists of the seeking venues and artists: by city and genre, state
+# and genre, set of genres, genre and number of genres, and city
+LISTS = ('place_genre', 'state_genre', 'genres', 'genre_count', 'place')
+
+
+def seeking_keys(profile):
+    # (list name, key) of the inverted lists holding a seeking entity
+    keys = [('place', profile.place), ('genres', profile.genres)]
+    for genre in profile.genres:
+        keys.extend([('place_genre', profile.place + (genre,)), ('state_genre', (profile.state, genre)),
+                     ('genre_count', (genre, len(profile.genres)))])
+    return keys
+
+
+def union(lists):
+    return set().union(*[ids for ids in lists if ids is not None])
+
+
+class Profile(object):
+    __slots__ = ('name', 'city', 'state', 'seeking', 'genres')
+
+    def __init__(self, name, city, state, seeking, genres):
+        self.name = name
+        self.city = city
+        self.state = state
+        self.seeking = bool(seeking)
+        self.genres = frozenset(genres)
+
+    @classmethod
+    def of(cls, kind, entity, genres=None):
+        # the profile of a Venue or Artist instance, `genres` (names) when
+        # its genres are not loaded
+        if genres is None:
+            genres = [g.name for g in entity.genres]
+        seeking = entity.looking_for_talent if kind == 'venue' else entity.looking_for_venues
+        return cls(entity.name, entity.city, entity.state, seeking, genres)
+
+    @property
+    def place(self):
+        return (self.city, self.state)
+
+
+class MatchIndex(object):
+
+    def __init__(self):
+        self.profiles = {kind: {} for kind in KINDS}
+        # kind -> list name -> key -> ids of the seeking entities, the keys
+        # of an entity being those of seeking_keys()
+        self.seeking = {kind: {name: defaultdict(set) for name in LISTS} for kind in KINDS}
+        # booking history: shows per (artist, venue), per venue, per venue and
+        # genre of the artist, per artist and (city, state) of the venue
+        self.played = Counter()
+        self.hosted = Counter()
+        self.hosted_genres = defaultdict(Counter)
+        self.played_places = defaultdict(Counter)
+
+    @classmethod
+    def build(cls, profiles, pairs):
+        # profiles: (kind, id, Profile), pairs: (artist_id, venue_id, shows)
+        index = cls()
+        for kind, entity_id, profile in profiles:
+            index.add(kind, entity_id, profile)
+        for artist_id, venue_id, shows in pairs:
+            index.add_shows(artist_id, venue_id, shows)
+        return index
+
+    def add(self, kind, entity_id, profile):
+        # add or replace an entity, a profile of None removes it and its shows
+        if profile is None:
+            self._remove_shows(kind, entity_id)
+        old = self.profiles[kind].pop(entity_id, None)
+        if old is not None and old.seeking:
+            for name, key in seeking_keys(old):
+                self._discard(self.seeking[kind][name], key, entity_id)
+        if profile is None:
+            return
+        self.profiles[kind][entity_id] = profile
+        if profile.seeking:
+            for name, key in seeking_keys(profile):
+                self.seeking[kind][name][key].add(entity_id)
+
+    @staticmethod
+    def _discard(lists, key, entity_id):
+        ids = lists.get(key)
+        if ids is not None:
+            ids.discard(entity_id)
+            if not ids:
+                del lists[key]
+
+    def add_shows(self, artist_id, venue_id, shows=1):
+        # record shows of an artist at a venue, negative to remove them.
+        # the genres and place are the artist's and venue's current ones
+        artist = self.profiles['artist'].get(artist_id)
+        venue = self.profiles['venue'].get(venue_id)
+        self.played[(artist_id, venue_id)] += shows
+        if self.played[(artist_id, venue_id)] <= 0:
+            del self.played[(artist_id, venue_id)]
+        self.hosted[venue_id] += shows
+        if artist is not None:
+            hosted = self.hosted_genres[venue_id]
+            for genre in artist.genres:
+                hosted[genre] += shows
+        if venue is not None:
+            self.played_places[artist_id][venue.place] += shows
+
+    def _remove_shows(self, kind, entity_id):
+        # a removed venue's or artist's shows leave the other side's history
+        # too. removals are rare, so the pairs are scanned rather than indexed
+        side = 0 if kind == 'artist' else 1
+        for pair, shows in [(pair, shows) for pair, shows in self.played.items() if pair[side] == entity_id]:
+            self.add_shows(pair[0], pair[1], -shows)
+        if kind == 'venue':
+            self.hosted.pop(entity_id, None)
+            self.hosted_genres.pop(entity_id, None)
+        else:
+            self.played_places.pop(entity_id, None)
+
+    def history(self, artist_id, artist, venue_id, venue):
+        # (score, shows together) of what the booking history says about a pair
+        score = 0.0
+        hosted = self.hosted.get(venue_id)
+        if hosted and hosted > 0:
+            genres = self.hosted_genres.get(venue_id, {})
+            score += WEIGHTS['hosted_genres'] * min(1.0, sum(genres.get(g, 0) for g in artist.genres) / hosted)
+        places = self.played_places.get(artist_id)
+        if places:
+            score += WEIGHTS['played_city'] * min(places[venue.place], PLAYED_CITY_SATURATION) / PLAYED_CITY_SATURATION
+        together = self.played.get((artist_id, venue_id), 0)
+        if together:
+            score += WEIGHTS['played_venue']
+        return score, together
+
+    def tiers(self, kind, profile):
+        # [(the most their genres and place can score, ids)] of the seeking
+        # entities of `kind` sharing a genre or the city with `profile`, in
+        # tiers for matches() to go through best first: same city and a
+        # genre, same state and a genre, elsewhere with the same genres,
+        # elsewhere with a genre in common and n genres for each n, same city
+        # and no genre. the large tiers come as a callable putting them
+        # together when they are needed
+        lists = self.seeking[kind]
+        genres, (city, state) = profile.genres, profile.place
+        same_city = union(lists['place_genre'].get((city, state, g)) for g in genres)
+        same_state = union(lists['state_genre'].get((state, g)) for g in genres) - same_city
+        tiers = [
+            (WEIGHTS['same_city'] + WEIGHTS['genres'], same_city),
+            (WEIGHTS['same_state'] + WEIGHTS['genres'], same_state),
+            (WEIGHTS['same_city'], lambda: lists['place'].get((city, state), set()) - same_city),
+        ]
+        if genres:
+            identical = lists['genres'].get(genres, set()) - same_city - same_state
+            tiers.append((WEIGHTS['genres'], identical))
+            for n in {n for _, n in lists['genre_count']}:
+                # the best Jaccard index of n genres against ours, other than the same ones
+                common = [c for c in range(1, min(len(genres), n) + 1) if not c == len(genres) == n]
+                if common:
+                    tiers.append((WEIGHTS['genres'] * max(c / (len(genres) + n - c) for c in common),
+                                  lambda n=n: union(lists['genre_count'].get((g, n)) for g in genres)
+                                  - same_city - same_state - identical))
+        tiers.sort(key=lambda tier: tier[0], reverse=True)
+        return tiers
+
+    def matches(self, kind, entity_id, profile, limit=20):
+        # [(score, id, Profile, shared genres, shows together)] of the seeking
+        # entities of the other kind, best first. candidates share a genre or
+        # the city with `profile`
+        other = OTHER[kind]
+        profiles = self.profiles[other]
+        genres, (city, state) = profile.genres, profile.place
+        best = []
+        for most, candidates in self.tiers(other, profile):
+            # the booking history adds at most HISTORY_WEIGHT: a tier, and the
+            # rest of one sorted by its genres and place, can be skipped once
+            # they could not make the list
+            if len(best) == limit and most + HISTORY_WEIGHT < best[0][0]:
+                break
+            partial = []
+            for candidate_id in candidates() if callable(candidates) else candidates:
+                candidate = profiles[candidate_id]
+                common = len(genres & candidate.genres)
+                score = WEIGHTS['genres'] * common / (len(genres) + len(candidate.genres) - common) if common else 0.0
+                if candidate.state == state:
+                    score += WEIGHTS['same_city'] if candidate.city == city else WEIGHTS['same_state']
+                partial.append((score, -candidate_id))
+            partial.sort(reverse=True)
+            for score, negative_id in partial:
+                if len(best) == limit and score + HISTORY_WEIGHT < best[0][0]:
+                    break
+                candidate = profiles[-negative_id]
+                if kind == 'artist':
+                    extra, together = self.history(entity_id, profile, -negative_id, candidate)
+                else:
+                    extra, together = self.history(-negative_id, candidate, entity_id, profile)
+                match = (score + extra, negative_id, together)
+                if len(best) < limit:
+                    heapq.heappush(best, match)
+                elif match > best[0]:
+                    heapq.heapreplace(best, match)
+        return [(score, -negative_id, profiles[-negative_id], genres & profiles[-negative_id].genres, together)
+                for score, negative_id, together in sorted(best, reverse=True)]
+
+    def __len__(self):
+        return sum(len(self.profiles[kind]) for kind in KINDS)
+
+
+class MatchmakingState(object):
+    # one app's index, in app.extensions['matchmaking']
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.max_age = app.config['MATCHMAKING_MAX_AGE']
+        self.index = MatchIndex()
+        self.built_at = None
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+        self.building = False
+        # entity changes committed while a build runs, replayed onto the new index
+        self.replay = []
+
+    def matches(self, kind, entity_id, profile, limit=20):
+        # `profile` is the entity as just read from the database, so its own
+        # latest city and genres are used even before the index has them
+        if self.refreshed_at is not None and time.time() - self.refreshed_at > self.max_age:
+            self.refresh()
+        with self.lock:
+            return self.index.matches(kind, entity_id, profile, limit)
+
+    def refresh(self):
+        # rebuild in the background, lookups use the current index meanwhile
+        with self.lock:
+            if self.building:
+                return
+            self.building = True
+            self.refreshed_at = time.time()
+            self.replay = []
+        threading.Thread(target=self._build, name='matchmaking-build', daemon=True).start()
+
+    def _build(self):
+        try:
+            started = time.time()
+            with self.app.app_context():
+                connection = self.db.session.connection()
+                profiles = []
+                for kind, model in MODELS.items():
+                    genres = defaultdict(list)
+                    table = GENRES[kind]
+                    fk = table.c[kind + '_id']
+                    for entity_id, name in connection.execute(
+                            select(fk, Genre.name).join(Genre, Genre.id == table.c.genre_id)):
+                        genres[entity_id].append(name)
+                    for entity_id, name, city, state, seeking in connection.execute(
+                            select(model.id, model.name, model.city, model.state, SEEKING[kind])):
+                        profiles.append((kind, entity_id, Profile(name, city, state, seeking, genres[entity_id])))
+                pairs = connection.execute(
+                    select(Show.artist_id, Show.venue_id, func.count())
+                    .where(Show.artist_id.isnot(None))
+                    .group_by(Show.artist_id, Show.venue_id)).all()
+                self.db.session.remove()
+            index = MatchIndex.build(profiles, pairs)
+            with self.lock:
+                for kind, entity_id, profile in self.replay:
+                    index.add(kind, entity_id, profile)
+                self.index = index
+                self.built_at = started
+            logger.info('matchmaking index built: %d venues and artists, %d pairs in %.2fs',
+                        len(index), len(index.played), time.time() - started)
+        except Exception:
+            logger.exception('matchmaking index build failed')
+        finally:
+            with self.lock:
+                self.building = False
+                self.replay = []
+
+    def stats(self):
+        index = self.index
+        return {
+            'venues': len(index.profiles['venue']),
+            'artists': len(index.profiles['artist']),
+            'seeking_venues': sum(p.seeking for p in index.profiles['venue'].values()),
+            'seeking_artists': sum(p.seeking for p in index.profiles['artist'].values()),
+            'pairs': len(index.played),
+            'age': round(time.time() - self.built_at, 1) if self.built_at is not None else None,
+        }
+
+    def apply(self, changes, shows=()):
+        # (kind, id, Profile) changes, a profile of None removes the entity
+        # and its shows, and {(artist_id, venue_id): shows} added. the shows
+        # of a removed entity are already gone with it
+        removed = {(kind, entity_id) for kind, entity_id, profile in changes if profile is None}
+        with self.lock:
+            for kind, entity_id, profile in changes:
+                self.index.add(kind, entity_id, profile)
+            for (artist_id, venue_id), count in dict(shows).items():
+                if ('artist', artist_id) not in removed and ('venue', venue_id) not in removed:
+                    self.index.add_shows(artist_id, venue_id, count)
+            if self.building:
+                self.replay.extend(changes)
+
+    def remove(self, kind, entity_id):
+        # for bulk deletes, which bypass the flush hook
+        self.apply([(kind, int(entity_id), None)])
+
+
+class Matchmaking(object):
+    # binds a MatchmakingState to each app, found through current_app
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('MATCHMAKING_MAX_AGE', 600)
+        app.config.setdefault('MATCHMAKING_RESULTS_LIMIT', 20)
+        state = app.extensions['matchmaking'] = MatchmakingState(app, db)
+        app.before_first_request(state.refresh)
+        if not event.contains(db.session, 'after_commit', self._apply_pending):
+            event.listen(db.session, 'after_flush', self._collect_changes)
+            event.listen(db.session, 'after_commit', self._apply_pending)
+            event.listen(db.session, 'after_rollback', self._drop_pending)
+
+    @property
+    def state(self):
+        return current_app.extensions['matchmaking']
+
+    def matches(self, kind, entity_id, profile, limit=20):
+        return self.state.matches(kind, entity_id, profile, limit)
+
+    def refresh(self):
+        return self.state.refresh()
+
+    def stats(self):
+        return self.state.stats()
+
+    def apply(self, changes, shows=()):
+        return self.state.apply(changes, shows)
+
+    def remove(self, kind, entity_id):
+        return self.state.remove(kind, entity_id)
+
+    # venues, artists and shows flushed in a transaction are applied to the
+    # index when it commits, deletions included
+
+    def _collect_changes(self, db_session, flush_context):
+        pending = db_session.info.setdefault('matchmaking_changes', {'entities': {}, 'shows': Counter()})
+        for obj in list(db_session.new) + list(db_session.dirty) + list(db_session.deleted):
+            if isinstance(obj, Show):
+                if obj.artist_id is not None and (obj in db_session.new or obj in db_session.deleted):
+                    pending['shows'][(obj.artist_id, obj.venue_id)] += -1 if obj in db_session.deleted else 1
+                continue
+            for kind, model in MODELS.items():
+                if isinstance(obj, model) and obj.id is not None:
+                    if obj in db_session.deleted:
+                        pending['entities'][(kind, obj.id)] = None
+                        continue
+                    # unloaded genres have not changed, keep the indexed ones
+                    genres = None
+                    if 'genres' in inspect(obj).unloaded:
+                        known = self.state.index.profiles[kind].get(obj.id)
+                        genres = known.genres if known is not None else ()
+                    pending['entities'][(kind, obj.id)] = Profile.of(kind, obj, genres)
+
+    def _apply_pending(self, db_session):
+        pending = db_session.info.pop('matchmaking_changes', None)
+        if pending:
+            self.state.apply([(kind, entity_id, profile) for (kind, entity_id), profile in pending['entities'].items()],
+                             pending['shows'])
+
+    def _drop_pending(self, db_session):
+        db_session.info.pop('matchmaking_changes', None)
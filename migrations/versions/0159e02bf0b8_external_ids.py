@@ -0,0 +1,34 @@
+"""external ids for bulk imported venues and artists
+
+Revision ID: 0159e02bf0b8
+Revises: 7130b25914fa
+Create Date: 2026-10-18 11:20:07.563120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0159e02bf0b8'
+down_revision = '7130b25914fa'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.add_column(sa.Column('external_id', sa.String(length=120), nullable=True))
+        batch_op.create_unique_constraint('uq_Venue_external_id', ['external_id'])
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.add_column(sa.Column('external_id', sa.String(length=120), nullable=True))
+        batch_op.create_unique_constraint('uq_Artist_external_id', ['external_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.drop_constraint('uq_Artist_external_id', type_='unique')
+        batch_op.drop_column('external_id')
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_constraint('uq_Venue_external_id', type_='unique')
+        batch_op.drop_column('external_id')
@@ -0,0 +1,67 @@
+"""reject shows overlapping at the same venue or with the same artist
+
+Revision ID: 4b7e2d9c1f05
+Revises: d1f4a8b2c6e3
+Create Date: 2026-10-18 16:12:09.118540
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e2d9c1f05'
+down_revision = 'd1f4a8b2c6e3'
+branch_labels = None
+depends_on = None
+
+# (booked column, constraint name), as in bookings.py
+BOOKED = (('venue_id', 'ex_Show_venue_overlap'), ('artist_id', 'ex_Show_artist_overlap'))
+
+
+def overlapping(column):
+    # number of shows starting before an earlier show of the same venue or
+    # artist has ended
+    return op.get_bind().execute(sa.text(
+        'SELECT COUNT(*) FROM (SELECT start_time, MAX(end_time) OVER ('
+        'PARTITION BY {0} ORDER BY start_time, id '
+        'ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS booked_until '
+        'FROM "Show" WHERE {0} IS NOT NULL) s '
+        'WHERE booked_until > start_time'.format(column))).scalar()
+
+
+def upgrade():
+    conflicts = {column: overlapping(column) for column, _ in BOOKED}
+    if any(conflicts.values()):
+        raise RuntimeError(
+            'overlapping shows ({}), list them with "flask shows conflicts" after '
+            '"flask db upgrade d1f4a8b2c6e3" and move or delete them first'.format(
+                ', '.join('{} by {}'.format(n, column) for column, n in conflicts.items() if n)))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for column, name in BOOKED:
+            op.execute('ALTER TABLE "Show" ADD CONSTRAINT "{}" EXCLUDE USING gist '
+                       '({} WITH =, tsrange(start_time, end_time) WITH &&)'.format(name, column))
+    else:
+        # the show starting last before NEW ends is the only one that can
+        # overlap NEW, found through ix_Show_<column>_start_time
+        for column, name in BOOKED:
+            for event in ('INSERT', 'UPDATE'):
+                op.execute(
+                    'CREATE TRIGGER "{name}_{event}" BEFORE {event} ON "Show" '
+                    'WHEN (SELECT s.end_time FROM "Show" s '
+                    'WHERE s.{column} = NEW.{column} AND s.start_time < NEW.end_time AND s.id IS NOT NEW.id '
+                    'ORDER BY s.start_time DESC LIMIT 1) > NEW.start_time '
+                    "BEGIN SELECT RAISE(ABORT, '{name}: the {kind} is already booked at that time'); END"
+                    .format(name=name, event=event, column=column, kind=column[:-3]))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for column, name in reversed(BOOKED):
+            op.execute('ALTER TABLE "Show" DROP CONSTRAINT "{}"'.format(name))
+    else:
+        for column, name in reversed(BOOKED):
+            for event in ('UPDATE', 'INSERT'):
+                op.execute('DROP TRIGGER "{}_{}"'.format(name, event))
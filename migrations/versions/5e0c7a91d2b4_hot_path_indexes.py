@@ -0,0 +1,40 @@
+"""indexes for the show, venue directory and name search predicates
+
+Revision ID: 5e0c7a91d2b4
+Revises: 0159e02bf0b8
+Create Date: 2026-10-18 13:41:22.905118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0c7a91d2b4'
+down_revision = '0159e02bf0b8'
+branch_labels = None
+depends_on = None
+
+# on Postgres the name indexes are trigram GIN indexes serving ilike '%term%',
+# other databases get a plain b-tree (the postgresql_* options are ignored)
+TRIGRAM = {'postgresql_using': 'gin', 'postgresql_ops': {'name': 'gin_trgm_ops'}}
+
+
+def upgrade():
+    op.create_index('ix_Show_venue_id_start_time', 'Show', ['venue_id', 'start_time'])
+    op.create_index('ix_Show_artist_id_start_time', 'Show', ['artist_id', 'start_time'])
+    op.create_index('ix_Show_start_time', 'Show', ['start_time', 'id'])
+    op.create_index('ix_Venue_state_city', 'Venue', ['state', 'city'])
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_Venue_name', 'Venue', ['name'], **TRIGRAM)
+    op.create_index('ix_Artist_name', 'Artist', ['name'], **TRIGRAM)
+
+
+def downgrade():
+    op.drop_index('ix_Artist_name', table_name='Artist')
+    op.drop_index('ix_Venue_name', table_name='Venue')
+    op.drop_index('ix_Venue_state_city', table_name='Venue')
+    op.drop_index('ix_Show_start_time', table_name='Show')
+    op.drop_index('ix_Show_artist_id_start_time', table_name='Show')
+    op.drop_index('ix_Show_venue_id_start_time', table_name='Show')
@@ -0,0 +1,43 @@
+"""updated_at of venues, artists and shows
+
+Revision ID: 6a2d8e4f0b13
+Revises: 4b7e2d9c1f05
+Create Date: 2026-10-18 17:48:12.330915
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a2d8e4f0b13'
+down_revision = '4b7e2d9c1f05'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist', 'Show')
+
+
+def upgrade():
+    # existing rows are stamped with the time of the migration. a constant
+    # default fills them without rewriting the tables on Postgres, and is the
+    # only kind SQLite accepts when adding a NOT NULL column. SQLite keeps it,
+    # dropping it would rebuild "Show" and lose its booking triggers.
+    migrated_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+    postgresql = op.get_bind().dialect.name == 'postgresql'
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=migrated_at))
+        if postgresql:
+            op.alter_column(table, 'updated_at', server_default=None)
+    op.create_index('ix_Venue_updated_at', 'Venue', ['updated_at'])
+    op.create_index('ix_Artist_updated_at', 'Artist', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_Artist_updated_at', table_name='Artist')
+    op.drop_index('ix_Venue_updated_at', table_name='Venue')
+    # a plain DROP COLUMN (SQLite 3.35+), batch mode would rebuild "Show"
+    for table in TABLES:
+        op.execute('ALTER TABLE "{}" DROP COLUMN updated_at'.format(table))
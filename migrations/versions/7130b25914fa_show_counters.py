@@ -0,0 +1,50 @@
+"""denormalized upcoming/past show counters on Venue and Artist
+
+Revision ID: 7130b25914fa
+Revises: a2583c40e7b7
+Create Date: 2026-10-18 10:02:51.410377
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7130b25914fa'
+down_revision = 'a2583c40e7b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('Venue', 'Artist'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+            batch_op.add_column(sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+    state = op.create_table('ShowCounterState',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('rolled_forward_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+    # backfill every counter relative to the initial boundary
+    now = datetime.now()
+    op.bulk_insert(state, [{'id': 1, 'rolled_forward_at': now}])
+    for table, fk in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.get_bind().execute(sa.text(
+            'UPDATE "{table}" SET '
+            'upcoming_shows_count = (SELECT COUNT(*) FROM "Show" s '
+            'WHERE s.{fk} = "{table}".id AND s.start_time >= :now), '
+            'past_shows_count = (SELECT COUNT(*) FROM "Show" s '
+            'WHERE s.{fk} = "{table}".id AND s.start_time < :now)'.format(table=table, fk=fk)),
+            {'now': now})
+
+
+def downgrade():
+    op.drop_table('ShowCounterState')
+    for table in ('Artist', 'Venue'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
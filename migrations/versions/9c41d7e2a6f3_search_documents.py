@@ -0,0 +1,43 @@
+"""full-text search documents for venues, artists and shows
+
+Revision ID: 9c41d7e2a6f3
+Revises: 5e0c7a91d2b4
+Create Date: 2026-10-18 14:36:05.271840
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c41d7e2a6f3'
+down_revision = '5e0c7a91d2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the table starts empty, fill it with `flask search rebuild`
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            'CREATE TABLE "SearchDocument" ('
+            'id BIGINT PRIMARY KEY, '
+            'kind VARCHAR(16) NOT NULL, '
+            'entity_id INTEGER NOT NULL, '
+            'title TEXT NOT NULL, '
+            'body TEXT NOT NULL, '
+            'search_vector TSVECTOR GENERATED ALWAYS AS ('
+            "setweight(to_tsvector('simple', title), 'A') || "
+            "setweight(to_tsvector('simple', body), 'B')) STORED)")
+        # venues and artists are indexed apart from the far more numerous shows
+        op.execute('CREATE INDEX "ix_SearchDocument_entities" ON "SearchDocument" USING gin (search_vector) WHERE id % 4 <> 2')
+        op.execute('CREATE INDEX "ix_SearchDocument_shows" ON "SearchDocument" USING gin (search_vector) WHERE id % 4 = 2')
+    else:
+        op.execute(
+            'CREATE VIRTUAL TABLE "SearchDocument" USING fts5('
+            'kind UNINDEXED, entity_id UNINDEXED, title, body, '
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+
+
+def downgrade():
+    op.execute('DROP TABLE "SearchDocument"')
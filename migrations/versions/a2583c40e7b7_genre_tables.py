@@ -0,0 +1,105 @@
+"""normalize genres into Genre and association tables
+
+Revision ID: a2583c40e7b7
+Revises: ed5ab10da399
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a2583c40e7b7'
+down_revision = 'ed5ab10da399'
+branch_labels = None
+depends_on = None
+
+# genre vocabulary of VenueForm / ArtistForm at the time of this migration
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+    'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+    'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll',
+    'Soul', 'Other',
+]
+
+
+def parse_genres(value):
+    # genres were stored as a stringified list, e.g. '{Jazz,"Rock n Roll"}'
+    if not value:
+        return []
+    names = (n.strip().strip('"') for n in value.strip('}{').split(','))
+    return [n for n in names if n]
+
+
+def upgrade():
+    genre = op.create_table('Genre',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('venue_genres',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+    sa.ForeignKeyConstraint(['venue_id'], ['Venue.id'], ),
+    sa.PrimaryKeyConstraint('venue_id', 'genre_id')
+    )
+    op.create_index('ix_venue_genres_genre_id_venue_id', 'venue_genres', ['genre_id', 'venue_id'], unique=False)
+    op.create_table('artist_genres',
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('genre_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['Artist.id'], ),
+    sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+    sa.PrimaryKeyConstraint('artist_id', 'genre_id')
+    )
+    op.create_index('ix_artist_genres_genre_id_artist_id', 'artist_genres', ['genre_id', 'artist_id'], unique=False)
+
+    # seed the vocabulary, then backfill the association tables from the old strings
+    conn = op.get_bind()
+    op.bulk_insert(genre, [{'name': name} for name in GENRES])
+    genre_ids = dict((name, id) for id, name in conn.execute(sa.text('SELECT id, name FROM "Genre"')))
+
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        rows = []
+        for entity_id, value in conn.execute(sa.text('SELECT id, genres FROM "{}"'.format(table))):
+            for name in set(parse_genres(value)):
+                if name not in genre_ids:
+                    genre_ids[name] = conn.execute(
+                        genre.insert().values(name=name)).inserted_primary_key[0]
+                rows.append({column: entity_id, 'genre_id': genre_ids[name]})
+        if rows:
+            conn.execute(sa.text(
+                'INSERT INTO {}_genres ({}, genre_id) VALUES (:{}, :genre_id)'.format(
+                    table.lower(), column, column)), rows)
+
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.drop_column('genres')
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.drop_column('genres')
+
+
+def downgrade():
+    with op.batch_alter_table('Artist') as batch_op:
+        batch_op.add_column(sa.Column('genres', sa.String(length=120), nullable=True))
+    with op.batch_alter_table('Venue') as batch_op:
+        batch_op.add_column(sa.Column('genres', sa.String(), nullable=True))
+
+    # rebuild the stringified lists from the association tables
+    conn = op.get_bind()
+    for table, column in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        genres = {}
+        for entity_id, name in conn.execute(sa.text(
+                'SELECT a.{}, g.name FROM {}_genres a JOIN "Genre" g ON g.id = a.genre_id '
+                'ORDER BY g.name'.format(column, table.lower()))):
+            genres.setdefault(entity_id, []).append(name)
+        for entity_id, names in genres.items():
+            conn.execute(sa.text('UPDATE "{}" SET genres = :genres WHERE id = :id'.format(table)),
+                {'genres': '{' + ','.join(names) + '}', 'id': entity_id})
+
+    op.drop_index('ix_artist_genres_genre_id_artist_id', table_name='artist_genres')
+    op.drop_table('artist_genres')
+    op.drop_index('ix_venue_genres_genre_id_venue_id', table_name='venue_genres')
+    op.drop_table('venue_genres')
+    op.drop_table('Genre')
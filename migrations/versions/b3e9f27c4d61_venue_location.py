@@ -0,0 +1,34 @@
+"""latitude, longitude and geohash of venues
+
+Revision ID: b3e9f27c4d61
+Revises: 6a2d8e4f0b13
+Create Date: 2026-10-18 21:04:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3e9f27c4d61'
+down_revision = '6a2d8e4f0b13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # nullable columns without a default, added without rewriting the table.
+    # `flask geo geocode` fills them in for the existing venues
+    op.add_column('Venue', sa.Column('latitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('Venue', sa.Column('geohash', sa.String(length=12).with_variant(
+        postgresql.VARCHAR(length=12, collation='C'), 'postgresql'), nullable=True))
+    op.create_index('ix_Venue_geohash', 'Venue', ['geohash'])
+
+
+def downgrade():
+    op.drop_index('ix_Venue_geohash', table_name='Venue')
+    # a plain DROP COLUMN (SQLite 3.35+), like 6a2d8e4f0b13
+    for column in ('geohash', 'longitude', 'latitude'):
+        op.execute('ALTER TABLE "Venue" DROP COLUMN {}'.format(column))
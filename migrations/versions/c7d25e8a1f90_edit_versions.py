@@ -0,0 +1,32 @@
+"""version of venues and artists, for the edit forms
+
+Revision ID: c7d25e8a1f90
+Revises: b3e9f27c4d61
+Create Date: 2026-10-18 23:12:05.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d25e8a1f90'
+down_revision = 'b3e9f27c4d61'
+branch_labels = None
+depends_on = None
+
+TABLES = ('Venue', 'Artist')
+
+
+def upgrade():
+    # a constant default fills the existing rows without rewriting the
+    # tables on Postgres, and is kept so rows inserted outside the ORM
+    # (`flask import`) start at version 1 too
+    for table in TABLES:
+        op.add_column(table, sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+
+
+def downgrade():
+    # a plain DROP COLUMN (SQLite 3.35+), like 6a2d8e4f0b13
+    for table in TABLES:
+        op.execute('ALTER TABLE "{}" DROP COLUMN version'.format(table))
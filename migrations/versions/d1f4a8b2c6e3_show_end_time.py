@@ -0,0 +1,41 @@
+"""end time of shows
+
+Revision ID: d1f4a8b2c6e3
+Revises: 9c41d7e2a6f3
+Create Date: 2026-10-18 16:05:47.630214
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd1f4a8b2c6e3'
+down_revision = '9c41d7e2a6f3'
+branch_labels = None
+depends_on = None
+
+# existing shows are given the default SHOW_DEFAULT_DURATION of config.py
+BACKFILL_HOURS = 3
+
+
+def upgrade():
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.add_column(sa.Column('end_time', sa.DateTime(), nullable=True))
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('UPDATE "Show" SET end_time = start_time + interval \'{} hours\''.format(BACKFILL_HOURS))
+    else:
+        # keep the fractional seconds SQLAlchemy stores, so values compare as strings
+        op.execute('UPDATE "Show" SET end_time = '
+                   'datetime(start_time, \'+{} hours\') || substr(start_time, 20)'.format(BACKFILL_HOURS))
+
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_check_constraint('ck_Show_end_after_start', 'end_time > start_time')
+
+
+def downgrade():
+    with op.batch_alter_table('Show') as batch_op:
+        batch_op.drop_constraint('ck_Show_end_after_start', type_='check')
+        batch_op.drop_column('end_time')
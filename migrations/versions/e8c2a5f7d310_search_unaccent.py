@@ -0,0 +1,52 @@
+"""match search documents without diacritics on Postgres
+
+Revision ID: e8c2a5f7d310
+Revises: c7d25e8a1f90
+Create Date: 2026-10-18 23:48:31.207415
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c2a5f7d310'
+down_revision = 'c7d25e8a1f90'
+branch_labels = None
+depends_on = None
+
+
+def search_vector(title, body):
+    return ('ALTER TABLE "SearchDocument" ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS ('
+            "setweight(to_tsvector('simple', {}), 'A') || "
+            "setweight(to_tsvector('simple', {}), 'B')) STORED".format(title, body))
+
+
+def create_indexes():
+    op.execute('CREATE INDEX "ix_SearchDocument_entities" ON "SearchDocument" USING gin (search_vector) WHERE id % 4 <> 2')
+    op.execute('CREATE INDEX "ix_SearchDocument_shows" ON "SearchDocument" USING gin (search_vector) WHERE id % 4 = 2')
+
+
+def upgrade():
+    # FTS5 already folds diacritics on SQLite. on Postgres the vectors are
+    # rebuilt from the unaccented title and body; unaccent() is only STABLE,
+    # a generated column needs an IMMUTABLE function with its dictionary fixed
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS unaccent')
+    op.execute('CREATE OR REPLACE FUNCTION search_unaccent(text) RETURNS text '
+               'LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT '
+               "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$")
+    # dropping the column drops its indexes
+    op.execute('ALTER TABLE "SearchDocument" DROP COLUMN search_vector')
+    op.execute(search_vector('search_unaccent(title)', 'search_unaccent(body)'))
+    create_indexes()
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('ALTER TABLE "SearchDocument" DROP COLUMN search_vector')
+    op.execute(search_vector('title', 'body'))
+    create_indexes()
+    op.execute('DROP FUNCTION search_unaccent(text)')
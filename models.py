@@ -1,13 +1,64 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-app = Flask(__name__)
-app.config.from_object('config')
-db = SQLAlchemy(app)
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import object_session
+
+from replicas import RoutingSQLAlchemy
+
+# bound to the application in app.create_app(). its sessions read from a
+# replica during GET requests when replicas are configured, see replicas.py
+db = RoutingSQLAlchemy()
+
+# genres are normalized into the Genre table. each association table's primary
+# key indexes the entity -> genre direction, the extra index covers genre -> entity.
+venue_genres = db.Table('venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table('artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
+class Genre(db.Model):
+    __tablename__ = "Genre"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def from_names(cls, names):
+        # Genre rows for the given names, creating any that are missing
+        names = list(dict.fromkeys(n for n in names if n))
+        genres = cls.query.filter(cls.name.in_(names)).all() if names else []
+        known = {g.name for g in genres}
+        for name in names:
+            if name not in known:
+                genre = cls(name=name)
+                db.session.add(genre)
+                genres.append(genre)
+        return sorted(genres, key=lambda g: g.name)
 
 class Venue(db.Model):
     __tablename__ = "Venue"
+    __table_args__ = (
+        # the /venues directory is ordered by state, city
+        db.Index('ix_Venue_state_city', 'state', 'city'),
+        # ilike '%term%' search: trigram index on Postgres, plain b-tree elsewhere
+        db.Index('ix_Venue_name', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        # the /venues validator, see app.directory_version
+        db.Index('ix_Venue_updated_at', 'updated_at'),
+        # /venues/near reads ranges of geohashes, see geo.py
+        db.Index('ix_Venue_geohash', 'geohash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
+    # key of the row in the partner catalog it was bulk imported from
+    external_id = db.Column(db.String(120), unique=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
@@ -15,45 +66,133 @@ class Venue(db.Model):
     phone = db.Column(db.String(120))
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
-    genres=db.Column(db.String())
+    genres = db.relationship("Genre", secondary=venue_genres, order_by="Genre.name", backref="venues")
     web_link = db.Column(db.String(120))
     looking_for_talent=db.Column(db.Boolean(), default=False)
     seeking_description=db.Column(db.String())
+    # maintained by counters.py, relative to ShowCounterState.rolled_forward_at
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # UTC time of the last write, the pages' ETag and Last-Modified derive from it
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # from the geocoder, see geo.py. geohash is set from them whenever they change;
+    # its ranges must sort bytewise, hence the C collation on Postgres
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12).with_variant(postgresql.VARCHAR(12, collation='C'), 'postgresql'))
+    # bumped by every ORM write, which is conditioned on it: the edit forms
+    # carry it and a flush over a newer row fails with StaleDataError
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     shows = db.relationship("Show", backref="Venue")
 
+    __mapper_args__ = {'version_id_col': version}
+
+    def cache_tags(self):
+        return ["venues", "venue:{}".format(self.id)]
+
+    @staticmethod
+    def bulk_cache_tags():
+        return ["venues", "shows"]
+
     #implemented any missing fields, as a database migration using Flask-Migrate
 
 
       
 class Artist(db.Model):
     __tablename__ = "Artist"
+    __table_args__ = (
+        db.Index('ix_Artist_name', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_Artist_updated_at', 'updated_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
+    # key of the row in the partner catalog it was bulk imported from
+    external_id = db.Column(db.String(120), unique=True)
     name = db.Column(db.String)
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship("Genre", secondary=artist_genres, order_by="Genre.name", backref="artists")
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     web_link = db.Column(db.String(120))
     looking_for_venues=db.Column(db.Boolean(), default=False)
     seeking_description=db.Column(db.String())
+    # maintained by counters.py, relative to ShowCounterState.rolled_forward_at
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # see Venue.version
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     
     #implement any missing fields, as a database migration using Flask-Migrate
     shows = db.relationship("Show", backref="Artist")
 
+    __mapper_args__ = {'version_id_col': version}
+
+    def cache_tags(self):
+        return ["artists", "artist:{}".format(self.id)]
+
+    @staticmethod
+    def bulk_cache_tags():
+        return ["artists", "shows"]
+
 
 
 class Show(db.Model):
   __tablename__ = "Show"
+  __table_args__ = (
+    # a venue's / artist's shows on either side of now
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    # /shows keyset pagination and the counters roll-forward
+    db.Index('ix_Show_start_time', 'start_time', 'id'),
+    db.CheckConstraint('end_time > start_time', name='ck_Show_end_after_start'),
+    # overlapping bookings are rejected by the constraints in bookings.py
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   artist_id=db.Column(db.Integer , db.ForeignKey("Artist.id"))
   venue_id=db.Column(db.Integer, db.ForeignKey("Venue.id"))
   start_time=db.Column(db.DateTime)
+  # the venue and the artist are booked from start_time until end_time
+  end_time=db.Column(db.DateTime, nullable=False)
+  updated_at=db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 #Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
   artistFK = db.relationship("Artist", foreign_keys=[artist_id])
-  venueFK = db.relationship("Venue", foreign_keys=[venue_id])
\ No newline at end of file
+  venueFK = db.relationship("Venue", foreign_keys=[venue_id])
+
+  def cache_tags(self):
+    return ["shows", "venue:{}".format(self.venue_id), "artist:{}".format(self.artist_id)]
+
+  @staticmethod
+  def bulk_cache_tags():
+    return ["shows", "venues", "artists"]
+
+
+def touch_updated_at(mapper, connection, target):
+    # onupdate only fires when a column of the row changes, a flush changing
+    # nothing but a collection (genres) counts as a write too
+    if object_session(target).is_modified(target):
+        target.updated_at = datetime.utcnow()
+
+for model in (Venue, Artist, Show):
+    event.listen(model, 'before_update', touch_updated_at)
+
+
+class ShowCounterState(db.Model):
+    # single row recording up to when shows have been rolled from the
+    # upcoming to the past counters
+    __tablename__ = "ShowCounterState"
+
+    id = db.Column(db.Integer, primary_key=True)
+    rolled_forward_at = db.Column(db.DateTime, nullable=False)
+
+
+def insert_counter_state(table, connection, **kw):
+    # the row migration 7130b25914fa inserts, so db.create_all() has it too
+    connection.execute(table.insert().values(id=1, rolled_forward_at=datetime.now()))
+
+event.listen(ShowCounterState.__table__, 'after_create', insert_counter_state)
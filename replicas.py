@@ -0,0 +1,281 @@
+#----------------------------------------------------------------------------#
+# Read replicas.
+#
+# With SQLALCHEMY_REPLICA_URIS set, GET and HEAD requests read from the
+# replicas, taking turns, while every other request, and any write or
+# SELECT ... FOR UPDATE a GET request makes, goes to the primary. Once a
+# session has written, the rest of it reads from the primary too.
+#
+# Replication lags, so a visitor who has just written reads from the primary
+# for REPLICA_STICKY_SECONDS afterwards and sees their own change. The
+# deadline is kept in their session cookie, signed with the SECRET_KEY all
+# workers share, so it holds whichever worker serves their next request. Pages other visitors get from the cache may still
+# come from a replica that had not caught up, for at most their TTL.
+#
+# Each replica is checked in the background every REPLICA_CHECK_INTERVAL
+# seconds, and is skipped while its last check failed, it is more than
+# REPLICA_MAX_LAG seconds behind (Postgres) or a query on it failed to
+# connect. Until its first check passes, reads stay on the primary.
+#
+# /db/stats reports each bind's pool and how many requests read from it.
+#----------------------------------------------------------------------------#
+
+import itertools
+import logging
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, request, session, has_app_context, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, exc, orm
+
+logger = logging.getLogger('fyyur.replicas')
+
+# Flask session key holding the time until which the visitor reads from the primary
+STICKY_KEY = '_primary_until'
+
+# replication lag in seconds, 0 when the replica has replayed all it received
+POSTGRES_LAG = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() '
+    'OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+def engine_options(config, uri):
+    # like app.configure_engine, SQLite's pools take none of these options
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def is_write(clause):
+    # INSERT / UPDATE / DELETE, or a SELECT locking its rows
+    if clause is None:
+        return False
+    return getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None
+
+
+def read_replica():
+    # the replica chosen for the current request, if any
+    return g.get('read_replica') if has_app_context() else None
+
+
+def pool_stats(engine):
+    pool = engine.pool
+    stats = {'class': type(pool).__name__}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        if hasattr(pool, name):
+            stats[name] = getattr(pool, name)()
+    return stats
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self._flushing or is_write(clause):
+            self.info['wrote'] = True
+        elif not self.info.get('wrote'):
+            replica = read_replica()
+            if replica is not None:
+                return replica.engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    # db.session routes reads to the request's replica, see RoutingSession
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class Replica(object):
+
+    def __init__(self, name, uri, options):
+        self.name = name
+        self.engine = create_engine(uri, **options)
+        self.healthy = False
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+        self.watch(self.engine)
+
+    def watch(self, engine):
+        # take the replica out of rotation when it cannot be reached
+        if not event.contains(engine, 'handle_error', self._handle_error):
+            event.listen(engine, 'handle_error', self._handle_error)
+
+    def _handle_error(self, context):
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+            self.down(context.original_exception)
+
+    def down(self, error):
+        if self.healthy:
+            logger.warning('replica %s is down: %s', self.name, error)
+        self.healthy = False
+        self.error = str(error).strip()
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as connection:
+                if connection.dialect.name == 'postgresql':
+                    lag = float(connection.exec_driver_sql(POSTGRES_LAG).scalar())
+                else:
+                    connection.exec_driver_sql('SELECT 1')
+                    lag = 0.0
+        except Exception as e:
+            self.down(e)
+        else:
+            self.lag = lag
+            if lag > max_lag:
+                self.down('{:.1f}s behind the primary'.format(lag))
+            else:
+                if not self.healthy:
+                    logger.info('replica %s is up', self.name)
+                self.healthy = True
+                self.error = None
+        finally:
+            self.checked_at = time.time()
+
+
+class ReplicasState(object):
+    # the replicas of one app and their read counts, in app.extensions['replicas']
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self.sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        self.check_interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.reads = Counter()
+        self.connects = Counter()
+        self.checkouts = Counter()
+        self.counted = set()
+        self.lock = threading.Lock()
+        self.checking = False
+        self.next_check = 0
+        self.turn = itertools.count()
+        # engines only connect on first use, after the workers have forked
+        self.replicas = [
+            Replica('replica{}'.format(i), uri, engine_options(app.config, uri))
+            for i, uri in enumerate(app.config['SQLALCHEMY_REPLICA_URIS'], 1)]
+        for replica in self.replicas:
+            self._count(replica.name, replica.engine)
+
+    def _count(self, name, engine):
+        # per bind connection counts for stats()
+        if name in self.counted:
+            return
+        self.counted.add(name)
+        event.listen(engine, 'connect', lambda *args: self.connects.update((name,)))
+        event.listen(engine, 'checkout', lambda *args: self.checkouts.update((name,)))
+
+    def primary_engine(self):
+        engine = self.db.get_engine(self.app)
+        self._count('primary', engine)
+        return engine
+
+    def route_request(self):
+        # before_request: pick the bind the request reads from
+        if request.method not in ('GET', 'HEAD'):
+            return
+        replica = None
+        if self.replicas and session.get(STICKY_KEY, 0) < time.time():
+            replica = self.choose()
+        g.read_replica = replica
+        self.reads[replica.name if replica is not None else 'primary'] += 1
+
+    def choose(self):
+        # the next healthy replica, None to read from the primary
+        if time.time() >= self.next_check:
+            self.check_in_background()
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self.turn) % len(healthy)]
+
+    def check_in_background(self):
+        with self.lock:
+            if self.checking:
+                return
+            self.checking = True
+            self.next_check = time.time() + self.check_interval
+        threading.Thread(target=self.check, name='replica-check', daemon=True).start()
+
+    def check(self):
+        try:
+            for replica in self.replicas:
+                replica.check(self.max_lag)
+        finally:
+            with self.lock:
+                self.checking = False
+
+    def stick(self):
+        # the visitor reads from the primary for the next REPLICA_STICKY_SECONDS
+        session[STICKY_KEY] = time.time() + self.sticky_seconds
+
+    def stats(self):
+        now = time.time()
+        async_reads = self.app.extensions.get('async_reads')
+        primary = self.primary_engine()
+        binds = [('primary', primary, {'url': repr(primary.url)})]
+        for replica in self.replicas:
+            binds.append((replica.name, replica.engine, {
+                'url': repr(replica.engine.url),
+                'healthy': replica.healthy,
+                'lag': replica.lag,
+                'error': replica.error,
+                'checked': round(now - replica.checked_at, 1) if replica.checked_at is not None else None,
+            }))
+        stats = {}
+        for name, engine, info in binds:
+            info.update({
+                'reads': self.reads[name],
+                'connects': self.connects[name],
+                'checkouts': self.checkouts[name],
+                'pool': pool_stats(engine),
+            })
+            if async_reads is not None and name in async_reads.engines:
+                info['async_pool'] = pool_stats(async_reads.engines[name].sync_engine)
+            stats[name] = info
+        return {'sticky_seconds': self.sticky_seconds, 'binds': stats}
+
+
+class Replicas(object):
+    # binds a ReplicasState to each app, found through current_app
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        app.config.setdefault('REPLICA_CHECK_INTERVAL', 10)
+        app.config.setdefault('REPLICA_MAX_LAG', 30)
+        state = app.extensions['replicas'] = ReplicasState(app, db)
+        app.before_first_request(state.primary_engine)
+        app.before_request(state.route_request)
+        if not event.contains(db.session, 'after_commit', self._after_commit):
+            event.listen(db.session, 'after_commit', self._after_commit)
+
+    @property
+    def state(self):
+        return current_app.extensions['replicas']
+
+    def stick(self):
+        self.state.stick()
+
+    def stats(self):
+        return self.state.stats()
+
+    def _after_commit(self, db_session):
+        # read your writes: the visitor reads from the primary for a while
+        if db_session.info.get('wrote') and has_request_context() and self.state.replicas:
+            self.state.stick()
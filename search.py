@@ -0,0 +1,339 @@
+#----------------------------------------------------------------------------#
+# Full-text search over venues, artists and shows.
+#
+# Every venue, artist and show has one row in the SearchDocument table: a
+# title (the name, or "artist at venue" for a show) and a body (city, state,
+# genres and seeking description). On Postgres the table carries a generated
+# tsvector column with a GIN index, on SQLite it is an FTS5 virtual table.
+# Both match without diacritics: FTS5 through its tokenizer, Postgres through
+# unaccent on the documents and the queries. See migrations 9c41d7e2a6f3 and
+# e8c2a5f7d310 for the definitions.
+#
+# Documents are keyed by entity_id * 4 + the kind's code, so one document can
+# be replaced or removed through its primary key (FTS5's rowid on SQLite).
+# They are rewritten whenever the ORM flushes a venue, artist or show; bulk
+# loaders call index_documents themselves and `flask search rebuild`
+# reindexes everything.
+#----------------------------------------------------------------------------#
+
+import re
+import time
+import unicodedata
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, event, inspect, select, text
+
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres
+
+search_cli = AppGroup('search', help='Maintain the full-text search index.')
+
+KINDS = ('venue', 'artist', 'show')
+MODELS = {'venue': Venue, 'artist': Artist, 'show': Show}
+GENRE_TABLES = {'venue': (venue_genres, venue_genres.c.venue_id),
+                'artist': (artist_genres, artist_genres.c.artist_id)}
+
+TOKEN = re.compile(r'\w+')
+# shortest last token matched as a prefix, FTS5 keeps a prefix index from 2 characters
+MIN_PREFIX = 2
+WORDS = re.compile(r'(\w+)')
+
+# a show's title repeats its venue's and artist's names, scale its rank down so
+# the venue or artist itself comes first
+SHOW_WEIGHT = 0.5
+# the venue and artist columns a show's document is made of, see show_documents
+SHOW_COLUMNS = {'venue': ('name', 'city', 'state'), 'artist': ('name',)}
+
+
+# same definitions as migrations 9c41d7e2a6f3 and e8c2a5f7d310, so
+# db.create_all() builds the table too
+POSTGRES_DDL = [
+    'CREATE EXTENSION IF NOT EXISTS unaccent',
+    # unaccent() is only STABLE, a generated column needs an IMMUTABLE
+    # function with its dictionary fixed
+    'CREATE OR REPLACE FUNCTION search_unaccent(text) RETURNS text '
+    'LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT '
+    "AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$",
+    'CREATE TABLE "SearchDocument" ('
+    'id BIGINT PRIMARY KEY, '
+    'kind VARCHAR(16) NOT NULL, '
+    'entity_id INTEGER NOT NULL, '
+    'title TEXT NOT NULL, '
+    'body TEXT NOT NULL, '
+    'search_vector TSVECTOR GENERATED ALWAYS AS ('
+    "setweight(to_tsvector('simple', search_unaccent(title)), 'A') || "
+    "setweight(to_tsvector('simple', search_unaccent(body)), 'B')) STORED)",
+    # venues and artists are indexed apart from the far more numerous shows,
+    # see search_documents
+    'CREATE INDEX "ix_SearchDocument_entities" ON "SearchDocument" USING gin (search_vector) WHERE id % 4 <> 2',
+    'CREATE INDEX "ix_SearchDocument_shows" ON "SearchDocument" USING gin (search_vector) WHERE id % 4 = 2',
+]
+SQLITE_DDL = [
+    'CREATE VIRTUAL TABLE "SearchDocument" USING fts5('
+    'kind UNINDEXED, entity_id UNINDEXED, title, body, '
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+]
+
+# DDL() substitutes %(table)s style names, the partial indexes' modulo is escaped
+for statement in POSTGRES_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement.replace('%', '%%')).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(db.metadata, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(db.metadata, 'before_drop', DDL('DROP TABLE IF EXISTS "SearchDocument"'))
+
+
+def document_id(kind, entity_id):
+    return entity_id * 4 + KINDS.index(kind)
+
+
+def chunks(ids, size):
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+#  Documents
+#  ----------------------------------------------------------------
+
+def entity_documents(connection, kind, ids):
+    model = MODELS[kind]
+    genre_table, genre_fk = GENRE_TABLES[kind]
+    genres = {}
+    for entity_id, name in connection.execute(
+            select(genre_fk, Genre.name).select_from(genre_table.join(Genre))
+            .where(genre_fk.in_(ids))):
+        genres.setdefault(entity_id, []).append(name)
+
+    rows = connection.execute(select(model.id, model.name, model.city, model.state,
+                                     model.seeking_description).where(model.id.in_(ids)))
+    return [{
+        'id': document_id(kind, row.id),
+        'kind': kind,
+        'entity_id': row.id,
+        'title': row.name or '',
+        'body': ' '.join(filter(None, [row.city, row.state] + sorted(genres.get(row.id, []))
+                                + [row.seeking_description])),
+    } for row in rows]
+
+
+def show_documents(connection, ids):
+    rows = connection.execute(
+        select(Show.id, Show.start_time, Artist.name.label('artist_name'),
+               Venue.name.label('venue_name'), Venue.city, Venue.state)
+        .select_from(Show.__table__.join(Artist.__table__).join(Venue.__table__))
+        .where(Show.id.in_(ids)))
+    return [{
+        'id': document_id('show', row.id),
+        'kind': 'show',
+        'entity_id': row.id,
+        'title': '{} at {}'.format(row.artist_name or '', row.venue_name or ''),
+        'body': ' '.join(filter(None, [row.city, row.state,
+                                       row.start_time.strftime('%B %Y') if row.start_time else None])),
+    } for row in rows]
+
+
+def remove_documents(connection, kind, ids):
+    key = 'rowid' if connection.dialect.name == 'sqlite' else 'id'
+    for batch in chunks(ids, 500):
+        connection.execute(text('DELETE FROM "SearchDocument" WHERE {} IN ({})'.format(
+            key, ', '.join(str(document_id(kind, int(i))) for i in batch))))
+
+
+def index_documents(connection, kind, ids):
+    # (re)write the documents of the given venues, artists or shows
+    ids = list(ids)
+    if not ids:
+        return 0
+    if connection.dialect.name == 'sqlite':
+        insert = text('INSERT INTO "SearchDocument" (rowid, kind, entity_id, title, body) '
+                      'VALUES (:id, :kind, :entity_id, :title, :body)')
+    else:
+        insert = text('INSERT INTO "SearchDocument" (id, kind, entity_id, title, body) '
+                      'VALUES (:id, :kind, :entity_id, :title, :body)')
+    indexed = 0
+    for batch in chunks(ids, 1000):
+        remove_documents(connection, kind, batch)
+        if kind == 'show':
+            documents = show_documents(connection, batch)
+        else:
+            documents = entity_documents(connection, kind, batch)
+        if documents:
+            connection.execute(insert, documents)
+        indexed += len(documents)
+    return indexed
+
+
+def rebuild_documents(connection, batch_size=10000):
+    connection.execute(text('DELETE FROM "SearchDocument"'))
+    counts = {}
+    for kind in KINDS:
+        model = MODELS[kind]
+        counts[kind], last_id = 0, 0
+        while True:
+            ids = [i for i, in connection.execute(select(model.id).where(model.id > last_id)
+                                                  .order_by(model.id).limit(batch_size))]
+            if not ids:
+                break
+            counts[kind] += index_documents(connection, kind, ids)
+            last_id = ids[-1]
+    return counts
+
+
+#  Queries
+#  ----------------------------------------------------------------
+
+def fold(word):
+    # lower case without diacritics, like FTS5's remove_diacritics tokenizer
+    # and unaccent on Postgres
+    return ''.join(c for c in unicodedata.normalize('NFKD', word.lower()) if not unicodedata.combining(c))
+
+
+def query_tokens(terms):
+    return [fold(t) for t in TOKEN.findall(terms)]
+
+
+def is_prefix(tokens):
+    # the last token is matched as a prefix unless it is a single character
+    return len(tokens[-1]) >= MIN_PREFIX
+
+
+def match_query(connection, tokens):
+    # every token must match, the last one as a prefix of a word
+    if connection.dialect.name == 'sqlite':
+        return ' '.join('"{}"'.format(t) for t in tokens) + ('*' if is_prefix(tokens) else '')
+    return ' & '.join(tokens[:-1] + [tokens[-1] + (':*' if is_prefix(tokens) else '')])
+
+
+def highlight(value, tokens, window=None):
+    # `value` escaped, with the words matching the query wrapped in <mark>.
+    # with `window`, only that many words from just before the first match are kept.
+    parts = WORDS.split(value or '')
+    prefix = tokens[-1] if is_prefix(tokens) else None
+    marked = [i % 2 == 1 and (fold(p) in tokens or (prefix is not None and fold(p).startswith(prefix)))
+              for i, p in enumerate(parts)]
+    start, end = 0, len(parts)
+    if window and len(parts) > 2 * window:
+        first = marked.index(True) if True in marked else 1
+        start = max(0, first - 6)
+        end = min(len(parts), start + 2 * window)
+    html = ''.join('<mark>{}</mark>'.format(escape(p)) if m else str(escape(p))
+                   for p, m in zip(parts[start:end], marked[start:end]))
+    return Markup(('…' if start > 0 else '') + html.strip() + ('…' if end < len(parts) else ''))
+
+
+def search_documents(session, terms, kind=None, limit=20, offset=0, candidates=2000):
+    # ranked documents matching `terms`, best first, with highlighted titles
+    # and body fragments. one more row than `limit` is returned when a next
+    # page exists. only the first `candidates` matches (on Postgres, of the
+    # shows, and the best `candidates` venues and artists) are ranked, which
+    # keeps a term matching a large part of the catalog as cheap as a
+    # selective one.
+    tokens = query_tokens(terms)
+    if not tokens:
+        return []
+    connection = session.connection()
+    params = {'query': match_query(connection, tokens), 'kind': KINDS.index(kind) if kind else None,
+              'candidates': candidates, 'limit': limit + 1, 'offset': offset, 'show_weight': SHOW_WEIGHT}
+    # the kind's code is the document id modulo 4, see document_id
+    if connection.dialect.name == 'sqlite':
+        # bm25 weights are per column: kind, entity_id, title, body. lower is better.
+        statement = text(
+            'WITH candidates AS MATERIALIZED ('
+            'SELECT rowid, bm25("SearchDocument", 0.0, 0.0, 10.0, 1.0) * '
+            'CASE rowid % 4 WHEN 2 THEN :show_weight ELSE 1.0 END AS rank '
+            'FROM "SearchDocument" WHERE "SearchDocument" MATCH :query {} LIMIT :candidates), '
+            'page AS (SELECT rowid, rank FROM candidates ORDER BY rank, rowid LIMIT :limit OFFSET :offset) '
+            'SELECT d.kind, d.entity_id, d.title, d.body FROM page '
+            'JOIN "SearchDocument" d ON d.rowid = page.rowid ORDER BY page.rank, page.rowid'
+            .format('AND rowid % 4 = :kind' if kind else ''))
+    else:
+        # matches come back in no particular order, so venues and artists are
+        # picked apart from shows, best first, and a name matched by thousands
+        # of shows still ranks its venue or artist. each part is served by its
+        # partial index.
+        parts = []
+        if kind != 'show':
+            where = 'id % 4 <> 2'
+            if kind:
+                where += ' AND id % 4 = {:d}'.format(KINDS.index(kind))
+            parts.append(where + ' ORDER BY rank DESC, id')
+        if kind in (None, 'show'):
+            parts.append('id % 4 = 2')
+        statement = text(
+            'WITH candidates AS MATERIALIZED ({}) '
+            'SELECT d.kind, d.entity_id, d.title, d.body FROM candidates '
+            'JOIN "SearchDocument" d ON d.id = candidates.id '
+            'ORDER BY candidates.rank DESC, candidates.id LIMIT :limit OFFSET :offset'
+            .format(' UNION ALL '.join(
+                '(SELECT id, ts_rank_cd(search_vector, q) * '
+                'CASE id % 4 WHEN 2 THEN :show_weight ELSE 1.0 END AS rank '
+                'FROM "SearchDocument", to_tsquery(\'simple\', search_unaccent(:query)) q '
+                'WHERE search_vector @@ q AND {} LIMIT :candidates)'.format(part) for part in parts)))
+
+    return [{
+        'type': row.kind,
+        'id': row.entity_id,
+        'title': highlight(row.title, tokens),
+        'body': highlight(row.body, tokens, window=16),
+    } for row in connection.execute(statement, params)]
+
+
+#  Maintenance
+#  ----------------------------------------------------------------
+
+class SearchIndex(object):
+    # keeps the documents in step with ORM writes, in the same transaction
+
+    def __init__(self, app=None, db=None):
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SEARCH_INDEX_ON_FLUSH', True)
+        if not event.contains(db.session, 'after_flush', self._reindex_flushed):
+            event.listen(db.session, 'after_flush', self._reindex_flushed)
+        app.extensions['search_index'] = self
+
+    def _reindex_flushed(self, session, flush_context):
+        if not current_app.config['SEARCH_INDEX_ON_FLUSH']:
+            return
+        changed = {kind: set() for kind in KINDS}
+        removed = {kind: set() for kind in KINDS}
+        connection = session.connection()
+        for obj in list(session.new) + list(session.dirty):
+            kind = kind_of(obj)
+            if kind is None or obj.id is None:
+                continue
+            changed[kind].add(obj.id)
+            if kind != 'show' and obj not in session.new and any(
+                    getattr(inspect(obj).attrs, column).history.has_changes() for column in SHOW_COLUMNS[kind]):
+                fk = getattr(Show, kind + '_id')
+                changed['show'].update(i for i, in connection.execute(select(Show.id).where(fk == obj.id)))
+        for obj in session.deleted:
+            kind = kind_of(obj)
+            if kind is not None and obj.id is not None:
+                removed[kind].add(obj.id)
+
+        for kind in KINDS:
+            if removed[kind]:
+                remove_documents(connection, kind, sorted(removed[kind]))
+            if changed[kind] - removed[kind]:
+                index_documents(connection, kind, sorted(changed[kind] - removed[kind]))
+
+
+def kind_of(obj):
+    for kind, model in MODELS.items():
+        if isinstance(obj, model):
+            return kind
+    return None
+
+
+@search_cli.command('rebuild')
+def rebuild_command():
+    """Reindex every venue, artist and show."""
+    started = time.perf_counter()
+    counts = rebuild_documents(db.session.connection())
+    db.session.commit()
+    click.echo('{venue} venues, {artist} artists, {show} shows indexed'.format(**counts)
+               + ' in {:.1f}s'.format(time.perf_counter() - started))
@@ -0,0 +1,168 @@
+#----------------------------------------------------------------------------#
+# Synthetic dataset generator.
+#
+#   flask seed --venues 100000 --artists 100000 --shows 5000000
+#
+# Generates venues, artists and shows spread across real cities, states and
+# the form genre vocabulary, with shows from a year in the past to a year
+# ahead that never overlap at a venue or for an artist. Rows are inserted in
+# batches through importer.insert_rows (COPY on Postgres, executemany
+# elsewhere) and the show counters and search index are rebuilt at the end. Generated venues and artists get 'seed-' external ids, and a fixed
+# --random-seed reproduces the same dataset. Venues are placed by the offline
+# file geocoder (geo.py) whatever GEOCODER is set to.
+#----------------------------------------------------------------------------#
+
+import random
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from counters import check_counters
+from geo import encode, file_geocoder
+from importer import insert_rows, batches
+from models import db, Venue, Artist, Show, Genre, venue_genres, artist_genres
+from search import rebuild_documents
+
+CITIES = [
+    ('New York', 'NY'), ('Brooklyn', 'NY'), ('Buffalo', 'NY'), ('Los Angeles', 'CA'),
+    ('San Francisco', 'CA'), ('Oakland', 'CA'), ('San Diego', 'CA'), ('Chicago', 'IL'),
+    ('Houston', 'TX'), ('Austin', 'TX'), ('Dallas', 'TX'), ('San Antonio', 'TX'),
+    ('Phoenix', 'AZ'), ('Tucson', 'AZ'), ('Philadelphia', 'PA'), ('Pittsburgh', 'PA'),
+    ('Seattle', 'WA'), ('Portland', 'OR'), ('Denver', 'CO'), ('Boulder', 'CO'),
+    ('Nashville', 'TN'), ('Memphis', 'TN'), ('New Orleans', 'LA'), ('Atlanta', 'GA'),
+    ('Miami', 'FL'), ('Orlando', 'FL'), ('Boston', 'MA'), ('Detroit', 'MI'),
+    ('Minneapolis', 'MN'), ('Kansas City', 'MO'), ('St. Louis', 'MO'), ('Las Vegas', 'NV'),
+    ('Salt Lake City', 'UT'), ('Albuquerque', 'NM'), ('Baltimore', 'MD'), ('Washington', 'DC'),
+    ('Charlotte', 'NC'), ('Raleigh', 'NC'), ('Columbus', 'OH'), ('Cleveland', 'OH'),
+]
+
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+    'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+    'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+]
+
+VENUE_WORDS = (['The'], ['Blue', 'Red', 'Velvet', 'Golden', 'Electric', 'Rusty', 'Midnight', 'Musical',
+    'Silver', 'Crooked', 'Painted', 'Hidden'], ['Room', 'Hall', 'Lounge', 'Hop', 'Tavern', 'Theatre',
+    'Club', 'Garden', 'Cellar', 'Ballroom', 'Basement', 'Pavilion'])
+ARTIST_WORDS = (['The', 'DJ', 'Little', 'Big'], ['Wild', 'Quiet', 'Lonesome', 'Flying', 'Neon', 'Cosmic',
+    'Broken', 'Sweet', 'Howling', 'Lucky', 'Velvet', 'Iron'], ['Sax Band', 'Petals', 'Riders', 'Quartet',
+    'Collective', 'Ramblers', 'Machines', 'Sisters', 'Brothers', 'Orchestra', 'Trio', 'Kids'])
+# shows are generated in slots of this many hours
+SLOT_HOURS = 4
+STREETS = ['Main St', 'Broadway', 'Folsom St', 'Market St', 'Elm St', 'Congress Ave', '2nd Ave', 'Sunset Blvd']
+
+
+def entity_name(rng, words, n):
+    prefix, adjectives, nouns = words
+    return '{} {} {} {}'.format(rng.choice(prefix), rng.choice(adjectives), rng.choice(nouns), n)
+
+
+def generate_entities(rng, kind, count, geocoder=None):
+    words = VENUE_WORDS if kind == 'venue' else ARTIST_WORDS
+    for n in range(count):
+        # skew towards big cities like a real catalog
+        city, state = CITIES[min(int(rng.expovariate(1 / 8.0)), len(CITIES) - 1)]
+        row = {
+            'external_id': 'seed-{}-{}'.format(kind, n),
+            'name': entity_name(rng, words, n),
+            'city': city,
+            'state': state,
+            'phone': '{}-{}-{}'.format(rng.randint(200, 999), rng.randint(200, 999), rng.randint(1000, 9999)),
+            'image_link': 'https://picsum.photos/seed/{}{}/300/300'.format(kind, n),
+            'facebook_link': 'https://www.facebook.com/{}{}'.format(kind, n),
+            'web_link': 'https://example.com/{}/{}'.format(kind, n),
+            'seeking_description': 'Looking for {} acts.'.format(rng.choice(GENRES)),
+        }
+        if kind == 'venue':
+            row['address'] = '{} {}'.format(rng.randint(1, 9999), rng.choice(STREETS))
+            row['looking_for_talent'] = rng.random() < 0.3
+            # the position derives from the address, the random sequence is unchanged
+            row['latitude'], row['longitude'] = geocoder.geocode(row['address'], city, state)
+            row['geohash'] = encode(row['latitude'], row['longitude'])
+        else:
+            row['looking_for_venues'] = rng.random() < 0.3
+        yield row, rng.sample(GENRES, rng.randint(1, 3))
+
+
+def seed_entities(rng, kind, model, genres_table, count, genre_ids, batch_size, geocoder=None):
+    fk = kind + '_id'
+    ids = []
+    for batch in batches(generate_entities(rng, kind, count, geocoder), batch_size):
+        insert_rows(model.__table__, [row for row, _ in batch])
+        by_key = dict(db.session.query(model.external_id, model.id)
+                      .filter(model.external_id.in_([row['external_id'] for row, _ in batch])))
+        insert_rows(genres_table, [{fk: by_key[row['external_id']], 'genre_id': genre_ids[name]}
+                                   for row, names in batch for name in names])
+        db.session.commit()
+        ids.extend(by_key.values())
+    return ids
+
+
+def generate_shows(rng, venue_ids, artist_ids, count):
+    # shows start on one of the 4 hour slots of the two years around now and
+    # last 2 to 4 hours. the slots taken at each venue and by each artist are
+    # kept in bitmaps, so no two shows overlap.
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    first = now - timedelta(days=365)
+    slots = 2 * 365 * 24 // SLOT_HOURS
+    venues_booked = bytearray(len(venue_ids) * slots // 8 + 1)
+    artists_booked = bytearray(len(artist_ids) * slots // 8 + 1)
+    for _ in range(count):
+        for _ in range(100):
+            venue, artist, slot = rng.randrange(len(venue_ids)), rng.randrange(len(artist_ids)), rng.randrange(slots)
+            v, a = venue * slots + slot, artist * slots + slot
+            if not (venues_booked[v >> 3] >> (v & 7)) & 1 and not (artists_booked[a >> 3] >> (a & 7)) & 1:
+                break
+        else:
+            return
+        venues_booked[v >> 3] |= 1 << (v & 7)
+        artists_booked[a >> 3] |= 1 << (a & 7)
+        start_time = first + timedelta(hours=slot * SLOT_HOURS)
+        yield {
+            'venue_id': venue_ids[venue],
+            'artist_id': artist_ids[artist],
+            'start_time': start_time,
+            'end_time': start_time + timedelta(hours=rng.randint(2, SLOT_HOURS)),
+        }
+
+
+@click.command('seed')
+@click.option('--venues', default=1000, show_default=True)
+@click.option('--artists', default=1000, show_default=True)
+@click.option('--shows', default=20000, show_default=True)
+@click.option('--batch-size', default=10000, show_default=True)
+@click.option('--random-seed', default=42, show_default=True)
+@with_appcontext
+def seed_command(venues, artists, shows, batch_size, random_seed):
+    """Fill the database with a synthetic catalog."""
+    rng = random.Random(random_seed)
+    started = time.perf_counter()
+
+    Genre.from_names(GENRES)
+    db.session.commit()
+    genre_ids = {g.name: g.id for g in Genre.query}
+
+    venue_ids = seed_entities(rng, 'venue', Venue, venue_genres, venues, genre_ids, batch_size,
+                              file_geocoder(current_app.config))
+    click.echo('{} venues'.format(len(venue_ids)))
+    artist_ids = seed_entities(rng, 'artist', Artist, artist_genres, artists, genre_ids, batch_size)
+    click.echo('{} artists'.format(len(artist_ids)))
+
+    venue_ids = venue_ids or [v for v, in db.session.query(Venue.id)]
+    artist_ids = artist_ids or [a for a, in db.session.query(Artist.id)]
+    inserted = 0
+    if venue_ids and artist_ids:
+        for batch in batches(generate_shows(rng, venue_ids, artist_ids, shows), batch_size):
+            insert_rows(Show.__table__, batch)
+            db.session.commit()
+            inserted += len(batch)
+    click.echo('{} shows'.format(inserted))
+
+    check_counters(repair=True)
+    rebuild_documents(db.session.connection())
+    db.session.commit()
+    click.echo('done in {:.1f}s'.format(time.perf_counter() - started))
@@ -2,3 +2,58 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// suggestions for inputs with data-autocomplete="venue|artist", filled into
+// the input's <datalist> from /autocomplete. with data-autocomplete-value="id"
+// the option value is the id and the name is shown as its label.
+(function () {
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    var useId = input.getAttribute('data-autocomplete-value') === 'id';
+    var timer = null;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        var q = input.value.trim();
+        if (!q || (useId && /^\d+$/.test(q))) {
+          return;
+        }
+        var url = '/autocomplete?type=' + input.getAttribute('data-autocomplete') +
+          '&q=' + encodeURIComponent(q);
+        fetch(url).then(function (response) {
+          return response.json();
+        }).then(function (data) {
+          list.innerHTML = '';
+          data.results.forEach(function (result) {
+            var option = document.createElement('option');
+            option.value = useId ? result.id : result.name;
+            if (useId) {
+              option.label = result.name;
+            }
+            list.appendChild(option);
+          });
+        });
+      }, 100);
+    });
+  });
+})();
+
+// buttons with data-geolocate fill their form's lat and lng inputs with the
+// browser's position and submit it
+(function () {
+  var buttons = document.querySelectorAll('button[data-geolocate]');
+  Array.prototype.forEach.call(buttons, function (button) {
+    if (!navigator.geolocation) {
+      button.disabled = true;
+      return;
+    }
+    button.addEventListener('click', function () {
+      navigator.geolocation.getCurrentPosition(function (position) {
+        button.form.elements.lat.value = position.coords.latitude.toFixed(5);
+        button.form.elements.lng.value = position.coords.longitude.toFixed(5);
+        button.form.submit();
+      });
+    });
+  });
+})();
@@ -0,0 +1,100 @@
+#----------------------------------------------------------------------------#
+# Test fixtures.
+#
+#   python -m pytest tests
+#
+# Each test gets an app on its own SQLite file, its schema made with
+# create_all, and the settings of config.py otherwise. Pass settings to
+# make_app for anything else, create_schema=False for another app (worker)
+# on an existing database.
+#----------------------------------------------------------------------------#
+
+import os
+import sys
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from app import create_app
+from counters import record_new_shows
+from models import db, Artist, Genre, Show, Venue
+
+
+def app_config(database_uri, **settings):
+    # the settings of config.py, with a database and test defaults
+    values = {name: getattr(config, name) for name in dir(config) if name.isupper()}
+    values.update(
+        TESTING=True,
+        SECRET_KEY='test',
+        SQLALCHEMY_DATABASE_URI=database_uri,
+        SQLALCHEMY_REPLICA_URIS=[],
+        WTF_CSRF_ENABLED=False,
+        CACHE_BACKEND='null',
+        TEMPLATE_BYTECODE_CACHE=False,
+    )
+    values.update(settings)
+    return type('TestConfig', (object,), values)
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    apps = []
+
+    def make_app(create_schema=True, **settings):
+        database_uri = settings.pop('SQLALCHEMY_DATABASE_URI', 'sqlite:///{}'.format(tmp_path / 'fyyur.db'))
+        app = create_app(app_config(database_uri, **settings))
+        if create_schema:
+            with app.app_context():
+                db.create_all()
+        apps.append(app)
+        return app
+
+    yield make_app
+    for app in apps:
+        with app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def catalog(app):
+    # two venues and two artists, each artist with a past and an upcoming
+    # show at each venue, counted like the create handlers count them
+    now = datetime.now().replace(microsecond=0)
+    with app.app_context():
+        venues = [Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                        genres=Genre.from_names(['Jazz', 'Reggae']), looking_for_talent=True),
+                  Venue(name='Park Square Live Music & Coffee', city='San Francisco', state='CA',
+                        address='34 Whiskey Moore Ave', genres=Genre.from_names(['Folk', 'Jazz']))]
+        artists = [Artist(name='Guns N Petals', city='San Francisco', state='CA',
+                          genres=Genre.from_names(['Rock n Roll']), looking_for_venues=True),
+                   Artist(name='The Wild Sax Band', city='San Francisco', state='CA',
+                          genres=Genre.from_names(['Jazz', 'Classical']))]
+        db.session.add_all(venues + artists)
+        db.session.flush()
+        shows = []
+        for i, (venue, artist) in enumerate((v, a) for v in venues for a in artists):
+            for days in (-10 - i, 10 + i):
+                start_time = now + timedelta(days=days)
+                shows.append(Show(venue_id=venue.id, artist_id=artist.id, start_time=start_time,
+                                  end_time=start_time + timedelta(hours=2)))
+        db.session.add_all(shows)
+        record_new_shows([{'venue_id': s.venue_id, 'artist_id': s.artist_id, 'start_time': s.start_time}
+                          for s in shows])
+        db.session.commit()
+        return SimpleNamespace(venue_ids=[v.id for v in venues], artist_ids=[a.id for a in artists],
+                               show_ids=[s.id for s in shows])
@@ -0,0 +1,86 @@
+import asyncio
+
+import httpx
+import pytest
+
+from asgi import AsyncReads
+from models import db, Venue
+
+VENUE_FORM = dict(name='The Dueling Pianos Bar', city='New York', state='NY', address='335 Delancey Street',
+                  phone='914-003-1132', image_link='', facebook_link='', website_link='',
+                  seeking_description='', genres=['Classical'])
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(CACHE_BACKEND='memory')
+
+
+@pytest.fixture
+def serve(app):
+    # runs `check(client)` with an httpx client on the ASGI app, over
+    # aiosqlite on the test database
+    asgi = AsyncReads(app)
+
+    def serve(check):
+        async def run():
+            transport = httpx.ASGITransport(app=asgi)
+            try:
+                async with httpx.AsyncClient(transport=transport, base_url='http://localhost') as client:
+                    return await check(client)
+            finally:
+                for engine in asgi.engines.values():
+                    await engine.dispose()
+        return asyncio.run(run())
+
+    yield serve
+    asgi.executor.shutdown()
+
+
+def test_cached_read_is_not_modified(serve, catalog):
+    path = '/venues/{}'.format(catalog.venue_ids[0])
+
+    async def check(client):
+        first = await client.get(path)
+        assert first.status_code == 200
+        assert first.headers['X-Cache'] == 'MISS'
+        assert 'The Musical Hop' in first.text
+
+        again = await client.get(path, headers={'If-None-Match': first.headers['ETag']})
+        assert again.status_code == 304
+        assert again.content == b''
+    serve(check)
+
+
+def test_feed_is_streamed_intact(app, serve, catalog):
+    path = '/venues/{}/shows.ics'.format(catalog.venue_ids[0])
+    expected = app.test_client().get(path)
+
+    async def check(client):
+        return await client.get(path)
+    response = serve(check)
+    assert response.status_code == 200
+    assert response.headers['Content-Type'] == expected.headers['Content-Type']
+    assert response.content == expected.get_data()
+    assert response.text.startswith('BEGIN:VCALENDAR') and response.text.endswith('END:VCALENDAR\r\n')
+
+
+def test_post_falls_through_to_wsgi(app, serve):
+    async def check(client):
+        return await client.post('/venues/create', data=VENUE_FORM)
+    response = serve(check)
+    assert response.status_code == 200
+    assert 'The Dueling Pianos Bar was successfully listed!' in response.text
+    with app.app_context():
+        assert [v.name for v in Venue.query] == ['The Dueling Pianos Bar']
+
+
+def test_missing_routes_return_the_error_page(serve, catalog):
+    async def check(client):
+        # an unknown path goes through the WSGI app, a missing venue through
+        # the async view
+        return await client.get('/no/such/page'), await client.get('/venues/{}'.format(max(catalog.venue_ids) + 1))
+    for response in serve(check):
+        assert response.status_code == 404
+        assert 'text/html' in response.headers['Content-Type']
+        assert "There's nothing here!" in response.text
@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import pytest
+
+import assets
+from assets import BUNDLES, build_assets
+
+
+@pytest.fixture(scope='module')
+def dist(tmp_path_factory):
+    # the static files copied to a tmp dir and built there, once: brotli at
+    # its best quality is slow
+    static_folder = str(tmp_path_factory.mktemp('assets') / 'static')
+    shutil.copytree(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static'),
+                    static_folder, ignore=shutil.ignore_patterns(assets.DIST))
+    manifest, _ = build_assets(static_folder)
+    return static_folder, manifest
+
+
+@pytest.fixture
+def built(app, dist):
+    static_folder, manifest = dist
+    app.static_folder = static_folder
+    app.extensions['assets'].load(static_folder)
+    return manifest
+
+
+def read(app, path):
+    with open(os.path.join(app.static_folder, *path.split('/')), 'rb') as f:
+        return f.read()
+
+
+def test_manifest_maps_names_to_hashed_files(app, built):
+    assert set(BUNDLES) <= set(built)
+    assert 'img/front-splash.jpg' in built
+    for name, path in built.items():
+        stem, ext = os.path.splitext(name)
+        match = re.fullmatch(re.escape('dist/' + stem) + r'\.([0-9a-f]{12})' + re.escape(ext), path)
+        assert match and match.group(1) == hashlib.sha256(read(app, path)).hexdigest()[:12]
+    css = built['css/site.css']
+    assert gzip.decompress(read(app, css + '.gz')) == read(app, css)
+    # images do not compress
+    assert not os.path.exists(os.path.join(app.static_folder, *built['img/front-splash.jpg'].split('/')) + '.gz')
+
+
+def test_pages_link_the_hashed_bundles(app, client, built):
+    page = client.get('/').get_data(as_text=True)
+    for bundle in BUNDLES:
+        assert '/static/' + built[bundle] in page
+    assert '/static/css/main.css' not in page
+
+
+@pytest.mark.parametrize('accept, encoding', [('gzip, deflate, br', 'br'), ('gzip, deflate', 'gzip'), ('', None)])
+def test_hashed_asset_is_sent_precompressed(app, client, built, accept, encoding):
+    if encoding == 'br' and assets.brotli is None:
+        pytest.skip('brotli is not installed')
+    path = built['css/site.css']
+    response = client.get('/static/' + path, headers={'Accept-Encoding': accept})
+    assert response.status_code == 200
+    assert response.content_encoding == encoding
+    assert response.mimetype == 'text/css'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.cache_control.immutable and response.cache_control.max_age == app.config['ASSETS_MAX_AGE']
+    body = response.get_data()
+    if encoding == 'br':
+        body = assets.brotli.decompress(body)
+    elif encoding == 'gzip':
+        body = gzip.decompress(body)
+    assert body == read(app, path)
@@ -0,0 +1,96 @@
+import time
+
+import pytest
+
+from autocomplete import PrefixIndex
+from models import db, Venue
+
+
+@pytest.fixture
+def index():
+    return PrefixIndex.build([
+        ('venue', 1, 'The Musical Hop'),
+        ('venue', 2, 'Park Square Live Music & Coffee'),
+        ('venue', 3, 'Café Ñandú'),
+        ('artist', 1, 'Guns N Petals'),
+        ('artist', 2, 'Musical Chairs'),
+    ])
+
+
+def names(found):
+    return [name for _, _, name in found]
+
+
+def test_lookup_matches_word_prefixes(index):
+    assert set(names(index.lookup('mus'))) == {'Musical Chairs', 'Park Square Live Music & Coffee', 'The Musical Hop'}
+    # whole-name matches come first
+    assert names(index.lookup('musical'))[0] == 'Musical Chairs'
+    assert names(index.lookup('musical hop')) == ['The Musical Hop']
+    assert index.lookup('hop musical') == []
+    assert index.lookup('  ') == []
+
+
+def test_lookup_folds_case_and_diacritics(index):
+    for prefix in ('cafe', 'CAFÉ', 'nandu', 'Ñan', 'café ñ'):
+        assert index.lookup(prefix) == [('venue', 3, 'Café Ñandú')]
+
+
+def test_lookup_by_kind_and_limit(index):
+    assert index.lookup('mus', kind='artist') == [('artist', 2, 'Musical Chairs')]
+    assert {entity_id for _, entity_id, _ in index.lookup('mus', kind='venue')} == {1, 2}
+    assert len(index.lookup('mus', limit=2)) == 2
+    assert len(index.lookup('mus', limit=1)) == 1
+
+
+def test_rename_and_remove(index):
+    index.add('venue', 1, 'The Velvet Hall')
+    assert 'The Musical Hop' not in names(index.lookup('mus'))
+    assert index.lookup('velv') == [('venue', 1, 'The Velvet Hall')]
+    assert len(index) == 5
+
+    index.remove('venue', 1)
+    assert index.lookup('velv') == [] and index.lookup('the') == []
+    assert len(index) == 4
+    # removing what is not there is a no-op
+    index.remove('venue', 1)
+    index.remove('venue', 99)
+    assert len(index) == 4
+
+
+@pytest.fixture
+def autocomplete(app, client, catalog):
+    # the first request builds the index in the background, wait for it
+    client.get('/autocomplete/stats')
+    state = app.extensions['autocomplete']
+    deadline = time.time() + 10
+    while state.building or state.built_at is None:
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+    def autocomplete(q, **args):
+        return client.get('/autocomplete', query_string=dict(args, q=q)).get_json()['results']
+    return autocomplete
+
+
+def test_route_follows_renames_and_deletes(app, client, catalog, autocomplete):
+    venue_id = catalog.venue_ids[0]
+    assert autocomplete('musical') == [{'type': 'venue', 'id': venue_id, 'name': 'The Musical Hop'}]
+
+    with app.app_context():
+        db.session.get(Venue, venue_id).name = 'The Velvet Hall'
+        db.session.commit()
+    assert autocomplete('musical') == []
+    assert autocomplete('velvet') == [{'type': 'venue', 'id': venue_id, 'name': 'The Velvet Hall'}]
+
+    assert client.delete('/venues/{}'.format(venue_id)).status_code == 200
+    assert autocomplete('velvet') == []
+
+
+def test_route_kind_and_limit(catalog, autocomplete):
+    assert {r['type'] for r in autocomplete('the')} == {'venue', 'artist'}
+    assert autocomplete('the', type='artist') == [{'type': 'artist', 'id': catalog.artist_ids[1], 'name': 'The Wild Sax Band'}]
+    assert len(autocomplete('the', limit=1)) == 1
+    # out of range limits are clamped to 1..50
+    assert len(autocomplete('the', limit=0)) == 1
+    assert len(autocomplete('the', limit=500)) == 2
+    assert autocomplete('GÜNS') == [{'type': 'artist', 'id': catalog.artist_ids[0], 'name': 'Guns N Petals'}]
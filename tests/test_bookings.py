@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import text
+
+from bookings import SQLITE_DDL, find_conflicts
+from models import db, Show
+
+
+@pytest.fixture
+def booked(app, catalog):
+    # the first venue's upcoming show with the first artist, as (start, end)
+    with app.app_context():
+        show = db.session.get(Show, catalog.show_ids[1])
+        assert (show.venue_id, show.artist_id) == (catalog.venue_ids[0], catalog.artist_ids[0])
+        return show.start_time, show.end_time
+
+
+def book(client, venue_id, artist_id, start_time, end_time):
+    return client.post('/shows/create', data={
+        'venue_id': venue_id, 'artist_id': artist_id,
+        'start_time': start_time.isoformat(' '), 'end_time': end_time.isoformat(' ')}).get_data(as_text=True)
+
+
+def count_shows(app):
+    with app.app_context():
+        return Show.query.count()
+
+
+def test_overlap_at_the_venue_is_rejected(app, client, catalog, booked):
+    start, end = booked
+    page = book(client, catalog.venue_ids[0], catalog.artist_ids[1], start + timedelta(hours=1), end + timedelta(hours=1))
+    assert 'The venue is already booked at that time. Show could not be listed.' in page
+    assert count_shows(app) == 8
+
+
+def test_overlap_for_the_artist_is_rejected(app, client, catalog, booked):
+    start, end = booked
+    page = book(client, catalog.venue_ids[1], catalog.artist_ids[0], start - timedelta(hours=1), start + timedelta(hours=1))
+    assert 'The artist is already booked at that time. Show could not be listed.' in page
+    assert count_shows(app) == 8
+
+
+def test_back_to_back_shows_are_accepted(app, client, catalog, booked):
+    start, end = booked
+    # end_time is excluded: a show may start when the last one ends
+    page = book(client, catalog.venue_ids[0], catalog.artist_ids[0], end, end + timedelta(hours=2))
+    assert 'Show was successfully listed!' in page
+    page = book(client, catalog.venue_ids[0], catalog.artist_ids[1], start - timedelta(hours=2), start)
+    assert 'Show was successfully listed!' in page
+    assert count_shows(app) == 10
+
+
+def test_find_conflicts_lists_earlier_overlaps(app, catalog, booked):
+    start, end = booked
+    with app.app_context():
+        assert list(find_conflicts()) == []
+        # data loaded before the triggers existed
+        for statement in SQLITE_DDL:
+            db.session.execute(text('DROP TRIGGER "{}"'.format(statement.split('"')[1])))
+        overlap = Show(venue_id=catalog.venue_ids[0], artist_id=catalog.artist_ids[0],
+                       start_time=start + timedelta(hours=1), end_time=end + timedelta(hours=1))
+        db.session.add(overlap)
+        db.session.commit()
+        conflicts = list(find_conflicts(batch_size=3))
+        later = (overlap.id, overlap.start_time, overlap.end_time)
+    earlier = (catalog.show_ids[1], start, end)
+    assert conflicts == [('venue', catalog.venue_ids[0], earlier, later),
+                         ('artist', catalog.artist_ids[0], earlier, later)]
+
+    result = app.test_cli_runner().invoke(args=['shows', 'conflicts'])
+    assert result.exit_code == 1
+    assert 'venue {}: show {}'.format(catalog.venue_ids[0], catalog.show_ids[1]) in result.output
+    assert '2 overlapping shows' in result.output
@@ -0,0 +1,130 @@
+from datetime import datetime, timedelta
+
+import fakeredis
+import pytest
+
+from cache import RedisCache
+from counters import record_new_show
+from models import db, Artist, Show, Venue
+
+
+@pytest.fixture
+def redis_server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def app(make_app, monkeypatch, redis_server):
+    # CACHE_BACKEND=redis against an in-process fakeredis server
+    monkeypatch.setattr('cache.redis.Redis.from_url', lambda url: fakeredis.FakeRedis(server=redis_server))
+    return make_app(CACHE_BACKEND='redis')
+
+
+@pytest.fixture
+def other_worker(app, make_app):
+    # another worker of the deployment: the same database and Redis server
+    return lambda: make_app(create_schema=False, CACHE_BACKEND='redis')
+
+
+def test_redis_cache_get_set():
+    backend = RedisCache(fakeredis.FakeRedis())
+    assert backend.get('page') is None
+    backend.set('page', (b'<html>', 'text/html'), 60)
+    assert backend.get('page') == (b'<html>', 'text/html')
+    assert len(backend) == 1
+
+    backend.clear()
+    assert backend.get('page') is None
+    assert len(backend) == 0
+
+
+def test_redis_cache_tag_versions():
+    backend = RedisCache(fakeredis.FakeRedis())
+    assert backend.tag_versions([]) == []
+    assert backend.tag_versions(['venues', 'venue:1']) == [0, 0]
+    backend.bump(['venue:1'])
+    backend.bump(['venues', 'venue:1'])
+    assert backend.tag_versions(['venues', 'venue:1', 'venue:2']) == [1, 2, 0]
+
+
+def test_pages_are_shared_and_invalidated_across_workers(app, other_worker, catalog):
+    first = app
+    path = '/venues/{}'.format(catalog.venue_ids[0])
+    assert first.test_client().get(path).headers['X-Cache'] == 'MISS'
+
+    second = other_worker()
+    assert second.test_client().get(path).headers['X-Cache'] == 'HIT'
+
+    with first.app_context():
+        db.session.get(Venue, catalog.venue_ids[0]).phone = '555-555-5555'
+        db.session.commit()
+    response = second.test_client().get(path)
+    assert response.headers['X-Cache'] == 'MISS'
+    assert '555-555-5555' in response.get_data(as_text=True)
+
+
+def test_feed_is_not_modified_until_its_shows_change(client, catalog):
+    path = '/venues/{}/shows.ics'.format(catalog.venue_ids[0])
+    response = client.get(path)
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.get_data() == b''
+
+    with client.application.app_context():
+        start = datetime.now().replace(microsecond=0) + timedelta(days=30)
+        show = Show(venue_id=catalog.venue_ids[0], artist_id=catalog.artist_ids[0],
+                    start_time=start, end_time=start + timedelta(hours=2))
+        db.session.add(show)
+        record_new_show(show)
+        db.session.commit()
+    response = client.get(path, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_a_later_app_keeps_its_own_cache(app, make_app, catalog):
+    # each app has its own backend in app.extensions, a second create_app
+    # does not rebind the first
+    path = '/venues/{}'.format(catalog.venue_ids[0])
+    later = make_app(create_schema=False, CACHE_BACKEND='null')
+    assert later.extensions['cache'] is not app.extensions['cache']
+    assert app.test_client().get(path).headers['X-Cache'] == 'MISS'
+    assert app.test_client().get(path).headers['X-Cache'] == 'HIT'
+    assert later.test_client().get(path).headers['X-Cache'] == 'MISS'
+    assert later.test_client().get(path).headers['X-Cache'] == 'MISS'
+
+
+@pytest.fixture
+def memory_app(make_app):
+    return make_app(create_schema=False, CACHE_BACKEND='memory')
+
+
+def test_fragments_are_reused_until_their_rows_change(app, memory_app, catalog):
+    client = memory_app.test_client()
+    state = memory_app.extensions['cache']
+    first = client.get('/shows')
+    assert first.headers['X-Cache'] == 'MISS'
+    tiles = state.fragments.stats()
+    assert tiles['entries'] > 0 and tiles['hits'] == 0
+
+    # the page is invalidated, its tiles are not
+    with memory_app.app_context():
+        state.invalidate('shows')
+    again = client.get('/shows')
+    assert again.headers['X-Cache'] == 'MISS'
+    assert again.get_data() == first.get_data()
+    assert state.fragments.stats()['hits'] == tiles['misses']
+    assert state.fragments.stats()['misses'] == tiles['misses']
+
+    # a renamed artist is a new version of its shows' tiles
+    with memory_app.app_context():
+        artist = db.session.get(Artist, catalog.artist_ids[0])
+        artist.name = 'Guns N Roses'
+        db.session.commit()
+    page = client.get('/shows').get_data(as_text=True)
+    assert 'Guns N Roses' in page and 'Guns N Petals' not in page
+    # only that artist's tiles are rendered again
+    assert state.fragments.stats()['misses'] == tiles['misses'] + page.count('Guns N Roses')
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from counters import check_counters, counter_state, roll_forward, true_counts
+from models import db, ShowCounterState
+
+
+def test_create_all_inserts_the_state_row(app):
+    with app.app_context():
+        assert db.session.get(ShowCounterState, 1) is not None
+
+
+def test_first_writers_race_for_the_state_row(app):
+    # another writer adds the missing row between our read and our insert
+    won_at = datetime(2020, 1, 1)
+    with app.app_context():
+        db.session.query(ShowCounterState).delete()
+        db.session.commit()
+
+        def other_writer(mapper, connection, target):
+            with db.engine.begin() as other:
+                other.execute(ShowCounterState.__table__.insert().values(id=1, rolled_forward_at=won_at))
+        event.listen(ShowCounterState, 'before_insert', other_writer, once=True)
+
+        assert counter_state(share=True).rolled_forward_at == won_at
+        db.session.commit()
+        assert db.session.query(ShowCounterState).count() == 1
+
+
+def test_roll_forward_moves_started_shows(app, catalog):
+    with app.app_context():
+        boundary = counter_state().rolled_forward_at
+        # the catalog's earliest upcoming shows start in 10 and 11 days, each
+        # moved for its venue and its artist
+        assert roll_forward(boundary + timedelta(days=11, hours=1)) == 4
+        assert check_counters() == []
+        assert true_counts('venue_id', counter_state().rolled_forward_at) == {
+            catalog.venue_ids[0]: (0, 4), catalog.venue_ids[1]: (2, 2)}
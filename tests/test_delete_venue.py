@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import text
+
+from counters import check_counters
+from models import db, Artist, Show, Venue
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(CACHE_BACKEND='memory')
+
+
+def search_documents(app):
+    with app.app_context():
+        return db.session.execute(text('SELECT count(*) FROM "SearchDocument"')).scalar()
+
+
+def test_delete_venue_removes_its_shows(app, client, catalog):
+    venue_id, other_venue_id = catalog.venue_ids
+    artist_id = catalog.artist_ids[0]
+    documents = search_documents(app)
+    client.get('/artists/{}'.format(artist_id))
+    assert client.get('/artists/{}'.format(artist_id)).headers['X-Cache'] == 'HIT'
+
+    response = client.delete('/venues/{}'.format(venue_id))
+    assert response.status_code == 200
+
+    with app.app_context():
+        assert db.session.get(Venue, venue_id) is None
+        assert {s.venue_id for s in Show.query} == {other_venue_id}
+        assert check_counters() == []
+        artist = db.session.get(Artist, artist_id)
+        assert (artist.upcoming_shows_count, artist.past_shows_count) == (1, 1)
+    # the venue and its four shows
+    assert search_documents(app) == documents - 5
+
+    response = client.get('/artists/{}'.format(artist_id))
+    assert response.headers['X-Cache'] == 'MISS'
+    assert 'The Musical Hop' not in response.get_data(as_text=True)
@@ -0,0 +1,132 @@
+import re
+
+from sqlalchemy import event
+
+from models import db, Genre, Venue, Artist
+
+VENUE_FORM = dict(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                  phone='123-123-1234', image_link='', facebook_link='', website_link='',
+                  seeking_description='', genres=['Jazz', 'Reggae'])
+
+
+def add_venue(app):
+    with app.app_context():
+        venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                      phone='123-123-1234', image_link='', facebook_link='', web_link='',
+                      seeking_description='', genres=Genre.from_names(['Jazz', 'Reggae']))
+        db.session.add(venue)
+        db.session.commit()
+        return venue.id
+
+
+def edit_form_token(client, path):
+    page = client.get(path).get_data(as_text=True)
+    return re.search(r'name="version" type="hidden" value="([^"]*)"', page).group(1)
+
+
+def flashed(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.pop('_flashes', [])]
+
+
+def recorded_writes(app):
+    writes = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not statement.lstrip().upper().startswith(('SELECT', 'PRAGMA')):
+            writes.append(statement)
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+    return writes
+
+
+def venue(app, venue_id):
+    with app.app_context():
+        v = db.session.get(Venue, venue_id)
+        return v.name, v.phone, [g.name for g in v.genres], v.version
+
+
+def test_unchanged_submission_writes_nothing(app, client):
+    venue_id = add_venue(app)
+    token = edit_form_token(client, '/venues/{}/edit'.format(venue_id))
+    writes = recorded_writes(app)
+
+    response = client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, version=token))
+    assert response.status_code == 302
+    assert writes == []
+    assert flashed(client) == ['Venue The Musical Hop was not changed.']
+
+
+def test_only_changed_columns_are_written(app, client):
+    venue_id = add_venue(app)
+    token = edit_form_token(client, '/venues/{}/edit'.format(venue_id))
+    writes = recorded_writes(app)
+
+    client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, phone='555-555-5555', version=token))
+    updates = [w for w in writes if w.startswith('UPDATE "Venue"')]
+    assert len(updates) == 1
+    assert updates[0].startswith('UPDATE "Venue" SET phone=?, updated_at=?, version=?')
+    assert updates[0].endswith('WHERE "Venue".id = ? AND "Venue".version = ?')
+    assert venue(app, venue_id) == ('The Musical Hop', '555-555-5555', ['Jazz', 'Reggae'], 2)
+
+
+def test_genres_are_edited(app, client):
+    venue_id = add_venue(app)
+    token = edit_form_token(client, '/venues/{}/edit'.format(venue_id))
+    client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, genres=['Jazz', 'Folk'], version=token))
+    assert venue(app, venue_id) == ('The Musical Hop', '123-123-1234', ['Folk', 'Jazz'], 2)
+
+
+def test_conflicting_edit_is_not_written(app, client):
+    venue_id = add_venue(app)
+    token = edit_form_token(client, '/venues/{}/edit'.format(venue_id))
+    client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, phone='555-555-5555', version=token))
+    flashed(client)
+
+    response = client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, name='Renamed', version=token))
+    assert response.location.endswith('/venues/{}/edit'.format(venue_id))
+    assert 'changed by someone else' in flashed(client)[0]
+    assert venue(app, venue_id) == ('The Musical Hop', '555-555-5555', ['Jazz', 'Reggae'], 2)
+
+
+def test_forged_token_is_rejected(app, client):
+    venue_id = add_venue(app)
+    token = edit_form_token(client, '/venues/{}/edit'.format(venue_id))
+    payload, signature = token.rsplit('.', 1)
+    forged = payload + '.' + ('A' if signature[0] != 'A' else 'B') + signature[1:]
+    writes = recorded_writes(app)
+
+    client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, name='Forged', version=forged))
+    assert writes == []
+    assert flashed(client) == ['An error occured. Venue Forged could not be updated.']
+    assert venue(app, venue_id)[0] == 'The Musical Hop'
+
+
+def test_token_of_another_entity_is_rejected(app, client):
+    venue_id = add_venue(app)
+    other_id = add_venue(app)
+    token = edit_form_token(client, '/venues/{}/edit'.format(other_id))
+    client.post('/venues/{}/edit'.format(venue_id), data=dict(VENUE_FORM, name='Other', version=token))
+    assert venue(app, venue_id)[0] == 'The Musical Hop'
+    assert venue(app, other_id)[0] == 'The Musical Hop'
+
+
+def test_artist_edit(app, client):
+    with app.app_context():
+        artist = Artist(name='Guns N Petals', city='San Francisco', state='CA', phone='326-123-5000',
+                        genres=Genre.from_names(['Rock n Roll']))
+        db.session.add(artist)
+        db.session.commit()
+        artist_id = artist.id
+    form = dict(name='Guns N Petals', city='San Francisco', state='CA', phone='326-123-5000', image_link='',
+                facebook_link='', website_link='', seeking_description='', genres=['Rock n Roll'])
+    token = edit_form_token(client, '/artists/{}/edit'.format(artist_id))
+    client.post('/artists/{}/edit'.format(artist_id), data=dict(form, seeking_venue='y', version=token))
+    with app.app_context():
+        artist = db.session.get(Artist, artist_id)
+        assert (artist.looking_for_venues, artist.version) == (True, 2)
+
+
+def test_missing_entity_edit_form_is_not_found(client):
+    assert client.get('/venues/999/edit').status_code == 404
+    assert client.get('/artists/999/edit').status_code == 404
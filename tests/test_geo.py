@@ -0,0 +1,83 @@
+import math
+
+import pytest
+
+from geo import cover, destination, encode
+from models import db, Venue
+
+CENTER = (37.7749, -122.4194)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(GEO_MAX_RADIUS_KM=50.0, GEO_RESULTS_LIMIT=3)
+
+
+@pytest.fixture
+def place(app):
+    # adds venues at the given positions, returns their ids in order
+    def place(*positions):
+        with app.app_context():
+            venues = [Venue(name='Venue {}'.format(i), city='San Francisco', state='CA', address='{} Main Street'.format(i),
+                            latitude=lat, longitude=lng) for i, (lat, lng) in enumerate(positions)]
+            db.session.add_all(venues)
+            db.session.commit()
+            return [v.id for v in venues]
+    return place
+
+
+def around(center, *distances):
+    # points due east of `center`, `distances` km away
+    return [destination(center[0], center[1], math.pi / 2, d) for d in distances]
+
+
+def near(client, **args):
+    response = client.get('/venues/near.json', query_string=args)
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_radius_search_is_nearest_first(client, place):
+    far, nearest, middle, outside = place(*around(CENTER, 8, 0.5, 3, 12))
+    found = near(client, lat=CENTER[0], lng=CENTER[1], radius=10)
+    assert [v['id'] for v in found['data']] == [nearest, middle, far]
+    assert [v['distance'] for v in found['data']] == pytest.approx([0.5, 3, 8], abs=0.01)
+    assert found['has_more'] is False
+
+
+def test_search_crosses_the_antimeridian(client, place):
+    center = (10.0, 179.98)
+    west, east, away = place((10.0, 179.95), (10.0, -179.95), (10.0, -179.5))
+    assert encode(10.0, 179.95)[0] != encode(10.0, -179.95)[0]
+
+    found = near(client, lat=center[0], lng=center[1], radius=10)
+    assert [v['id'] for v in found['data']] == [west, east]
+    found = near(client, bbox='9.9,179.9,10.1,-179.9')
+    assert {v['id'] for v in found['data']} == {west, east}
+    # a box crossing the antimeridian is covered on both sides of it
+    assert len({low[0] for low, _ in cover(9.9, 179.9, 10.1, -179.9)}) == 2
+
+
+def test_radius_is_clamped_to_the_maximum(client, place):
+    inside, outside = place(*around(CENTER, 40, 60))
+    found = near(client, lat=CENTER[0], lng=CENTER[1], radius=1000)
+    assert found['radius'] == 50.0
+    assert [v['id'] for v in found['data']] == [inside]
+    # a box is rejected rather than cut down
+    assert client.get('/venues/near.json?bbox=30,-130,45,-115').status_code == 400
+
+
+def test_page_is_limited_with_has_more(client, place):
+    ids = place(*around(CENTER, 1, 2, 3, 4, 5))
+    found = near(client, lat=CENTER[0], lng=CENTER[1], radius=10)
+    assert [v['id'] for v in found['data']] == ids[:3]
+    assert found['has_more'] is True
+
+    found = near(client, lat=CENTER[0], lng=CENTER[1], radius=3.5)
+    assert [v['id'] for v in found['data']] == ids[:3]
+    assert found['has_more'] is False
+
+
+@pytest.mark.parametrize('args', ['lat=91&lng=0', 'lat=0&lng=181', 'lat=0&lng=0&radius=0', 'lat=x&lng=0', 'lat=0'])
+def test_invalid_locations_are_rejected(client, args):
+    assert client.get('/venues/near.json?' + args).status_code == 400
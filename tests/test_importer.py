@@ -0,0 +1,99 @@
+import io
+import json
+
+import pytest
+
+from counters import check_counters
+from importer import Importer, import_file
+from models import db, Artist, Show, Venue
+
+VENUE_HEADER = 'external_id,name,city,state,address,phone,genres,facebook_link\n'
+VENUE_ROW = '{},{},San Francisco,CA,1015 Folsom Street,123-123-1234,Jazz;Reggae,https://www.facebook.com/{}\n'
+
+ARTIST_ROWS = [
+    {'external_id': 'gnp', 'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA',
+     'genres': ['Rock n Roll'], 'facebook_link': 'https://www.facebook.com/GunsNPetals', 'seeking_venue': True},
+    {'external_id': 'sax', 'name': 'The Wild Sax Band', 'city': 'San Francisco', 'state': 'CA',
+     'genres': ['Jazz', 'Classical'], 'facebook_link': 'https://www.facebook.com/TheWildSaxBand'},
+]
+
+
+def write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding='utf-8')
+    return str(path)
+
+
+def run_import(app, kind, path, batch_size=1000):
+    rejects = io.StringIO()
+    with app.app_context():
+        importer, _ = import_file(kind, path, batch_size=batch_size, rejects=rejects)
+    return importer, [json.loads(line) for line in rejects.getvalue().splitlines()]
+
+
+@pytest.fixture
+def imported(app, tmp_path):
+    run_import(app, 'venues', write(tmp_path, 'venues.csv', VENUE_HEADER
+        + VENUE_ROW.format('hop', 'The Musical Hop', 'TheMusicalHop')
+        + VENUE_ROW.format('park', 'Park Square Live Music', 'ParkSquare')))
+    run_import(app, 'artists', write(tmp_path, 'artists.ndjson', ''.join(json.dumps(r) + '\n' for r in ARTIST_ROWS)))
+
+
+def test_importer_needs_a_loader():
+    with pytest.raises(TypeError):
+        Importer()
+
+
+def test_invalid_rows_are_rejected(app, tmp_path):
+    path = write(tmp_path, 'venues.csv', VENUE_HEADER
+        + VENUE_ROW.format('hop', 'The Musical Hop', 'TheMusicalHop')
+        + VENUE_ROW.format('nameless', '', 'Nameless')
+        + 'lost,Lost Venue,San Francisco,ZZ,1 Main Street,,Jazz,https://www.facebook.com/lost\n')
+
+    importer, rejects = run_import(app, 'venues', path)
+    assert (importer.inserted, importer.rejected) == (1, 2)
+    assert [(r['record'], sorted(r['errors'])) for r in rejects] == [(2, ['name']), (3, ['state'])]
+    with app.app_context():
+        venue = Venue.query.one()
+        assert (venue.external_id, [g.name for g in venue.genres]) == ('hop', ['Jazz', 'Reggae'])
+
+
+def test_external_ids_are_imported_once(app, tmp_path):
+    path = write(tmp_path, 'venues.csv', VENUE_HEADER
+        + VENUE_ROW.format('hop', 'The Musical Hop', 'TheMusicalHop')
+        + VENUE_ROW.format('hop', 'The Musical Hop again', 'TheMusicalHop'))
+    importer, rejects = run_import(app, 'venues', path)
+    assert (importer.inserted, importer.rejected) == (1, 1)
+    assert rejects[0]['errors'] == {'external_id': ['Already imported.']}
+
+    # a second run of the same file, in batches of one
+    importer, rejects = run_import(app, 'venues', path, batch_size=1)
+    assert (importer.inserted, importer.rejected) == (0, 2)
+    with app.app_context():
+        assert Venue.query.count() == 1
+
+
+def test_shows_resolve_references_and_reject_conflicts(app, tmp_path, imported):
+    path = write(tmp_path, 'shows.csv', '\n'.join([
+        'venue_external_id,artist_external_id,venue_id,artist_id,start_time,end_time',
+        'hop,gnp,,,2035-05-21 21:30:00,2035-05-21 23:30:00',
+        'park,sax,,,2035-05-21 22:00:00,',
+        # the artist is already playing the hop then
+        'park,gnp,,,2035-05-21 22:00:00,2035-05-21 23:00:00',
+        'nowhere,sax,,,2035-06-01 20:00:00,',
+        'hop,,,99999,2035-06-01 20:00:00,',
+        'hop,sax,,,2019-01-01 20:00:00,2019-01-01 22:00:00',
+    ]) + '\n')
+
+    importer, rejects = run_import(app, 'shows', path)
+    assert (importer.inserted, importer.rejected) == (3, 3)
+    assert [(r['record'], r['errors']) for r in rejects] == [
+        (4, {'venue': ['Unknown venue.']}),
+        (5, {'artist': ['Unknown artist.']}),
+        (3, {'artist': ['The artist is already booked at that time.']}),
+    ]
+    with app.app_context():
+        assert Show.query.count() == 3
+        assert check_counters() == []
+        sax = Artist.query.filter_by(external_id='sax').one()
+        assert (sax.upcoming_shows_count, sax.past_shows_count) == (1, 1)
@@ -0,0 +1,94 @@
+import json
+import logging
+
+import pytest
+from flask import url_for
+from sqlalchemy import select
+
+from instrumentation import QueryBudgetExceeded, query_budget
+from models import db, Venue
+
+# query strings taking each route down its other paths
+VARIANTS = {
+    'main.venues': ['?genre=Jazz'],
+    'main.artists': ['?genre=Jazz'],
+    'main.show_venue': ['?from=2020-01-01&to=2040-01-01'],
+    'main.show_artist': ['?from=2020-01-01&to=2040-01-01'],
+    'main.shows': ['?city=San+Francisco&state=CA', '?limit=1'],
+    'main.shows_json': ['?limit=1', '?city=San+Francisco'],
+    'main.city_feed': ['?city=San+Francisco&state=CA'],
+    'main.search': ['?q=jazz', '?q=the&type=venue'],
+    'main.search_json': ['?q=sax', '?q=musical&type=show'],
+    'main.autocomplete_names': ['?q=the', '?q=gun&type=artist'],
+    'main.search_venues_near': ['?lat=37.77&lng=-122.41', '?bbox=37,-123,38,-122'],
+    'main.search_venues_near_json': ['?lat=37.77&lng=-122.41&radius=5'],
+}
+
+
+@pytest.fixture
+def app(make_app):
+    # views without a query_budget stay unchecked (SQL_QUERY_BUDGET is None)
+    return make_app(SQL_STRICT=True)
+
+
+def get(client, path):
+    response = client.get(path)
+    response.get_data()
+    # streamed responses (the .ics feeds) are checked when closed
+    response.close()
+    return response
+
+
+def test_get_routes_stay_within_their_query_budgets(app, catalog):
+    client = app.test_client()
+    args = {'venue_id': catalog.venue_ids[0], 'artist_id': catalog.artist_ids[0]}
+    requested = set()
+    with app.test_request_context():
+        paths = [(rule.endpoint, url_for(rule.endpoint, **{a: args[a] for a in rule.arguments}))
+                 for rule in app.url_map.iter_rules()
+                 if 'GET' in rule.methods and rule.endpoint != 'static']
+    for endpoint, path in paths:
+        for query in [''] + VARIANTS.get(endpoint, []):
+            response = get(client, path + query)
+            assert response.status_code == 200, path + query
+            requested.add(endpoint)
+    assert set(VARIANTS) <= requested
+
+
+def test_over_budget_route_fails(app):
+    @query_budget(1)
+    def two_queries():
+        db.session.execute(select(Venue.id)).all()
+        db.session.execute(select(Venue.name)).all()
+        return 'ok'
+    app.add_url_rule('/two-queries', 'two_queries', two_queries)
+
+    with pytest.raises(QueryBudgetExceeded, match='two_queries ran 2 queries, budget is 1'):
+        app.test_client().get('/two-queries')
+
+
+def test_repeated_statement_is_flagged(app, catalog, caplog):
+    def one_by_one():
+        for venue_id in range(app.config['SQL_REPEAT_THRESHOLD']):
+            db.session.execute(select(Venue.name).where(Venue.id == venue_id)).all()
+        return 'ok'
+    app.add_url_rule('/one-by-one', 'one_by_one', one_by_one)
+
+    with caplog.at_level(logging.INFO, logger='fyyur.sql'):
+        response = app.test_client().get('/one-by-one')
+        app.test_client().get('/venues')
+    assert response.headers['X-DB-Queries'] == str(app.config['SQL_REPEAT_THRESHOLD'])
+    repeated = [json.loads(r.message) for r in caplog.records if r.name == 'fyyur.sql.repeated']
+    assert [(r['route'], r['count']) for r in repeated] == [('one_by_one', app.config['SQL_REPEAT_THRESHOLD'])]
+    assert 'WHERE "Venue".id = ?' in repeated[0]['statement']
+
+
+def test_streamed_feed_queries_are_counted(app, catalog, caplog):
+    client = app.test_client()
+    with caplog.at_level(logging.INFO, logger='fyyur.sql'):
+        response = get(client, '/venues/{}/shows.ics'.format(catalog.venue_ids[0]))
+    logged = [json.loads(r.message) for r in caplog.records if r.name == 'fyyur.sql']
+    assert [r['route'] for r in logged] == ['main.venue_feed']
+    # the headers go out before the feed query runs, the log line counts it
+    assert logged[0]['queries'] == int(response.headers['X-DB-Queries']) + 1
+    assert 'BEGIN:VEVENT' in response.get_data(as_text=True)
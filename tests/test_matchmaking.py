@@ -0,0 +1,72 @@
+import pytest
+
+from matchmaking import WEIGHTS, MatchIndex, MatchmakingState, Profile
+from models import db
+
+
+def venue(city='San Francisco', state='CA', genres=('Jazz',), seeking=True):
+    return Profile('Venue', city, state, seeking, genres)
+
+
+def artist(city='San Francisco', state='CA', genres=('Jazz',), seeking=True):
+    return Profile('Artist', city, state, seeking, genres)
+
+
+@pytest.fixture
+def index():
+    # venue 1 hosts artist 10's jazz; artist 11 plays rock across the bay
+    return MatchIndex.build([
+        ('venue', 1, venue(genres=('Jazz', 'Blues'))),
+        ('venue', 2, venue(city='Oakland', genres=('Jazz',))),
+        ('venue', 3, venue(city='New York', state='NY', genres=('Jazz',))),
+        ('venue', 4, venue(genres=('Jazz',), seeking=False)),
+        ('venue', 5, venue(city='Boston', state='MA', genres=('Rock',))),
+        ('artist', 10, artist(genres=('Jazz',))),
+        ('artist', 11, artist(city='Oakland', genres=('Rock',))),
+    ], [(10, 1, 3), (11, 1, 1), (11, 2, 2)])
+
+
+def test_matches_rank_genres_place_and_history(index):
+    found = index.matches('artist', 10, artist(genres=('Jazz',)))
+    # venue 4 is not seeking, venue 5 shares neither a genre nor the city
+    assert [venue_id for _, venue_id, _, _, _ in found] == [1, 2, 3]
+    score, _, _, shared, together = found[0]
+    assert shared == {'Jazz'} and together == 3
+    assert found[1][0] == pytest.approx(WEIGHTS['genres'] + WEIGHTS['same_state'])
+    assert found[2][0] == pytest.approx(WEIGHTS['genres'])
+
+
+def test_matches_are_limited_to_the_best(index):
+    assert [m[1] for m in index.matches('artist', 10, artist(), limit=2)] == [1, 2]
+    # artist 11 shares neither a genre nor the city, whatever it played there
+    assert [m[1] for m in index.matches('venue', 1, venue(genres=('Jazz', 'Blues')))] == [10]
+
+
+def test_removed_venue_leaves_the_artists_history(index):
+    assert index.played_places[11][('San Francisco', 'CA')] == 1
+    index.add('venue', 1, None)
+
+    assert 1 not in index.profiles['venue']
+    assert not [pair for pair in index.played if pair[1] == 1]
+    assert 1 not in index.hosted and 1 not in index.hosted_genres
+    assert index.played_places[11][('San Francisco', 'CA')] == 0
+    assert index.played_places[11][('Oakland', 'CA')] == 2
+    assert [m[1] for m in index.matches('artist', 10, artist())] == [2, 3]
+
+
+def test_removed_artist_leaves_the_venues_history(index):
+    index.add('artist', 11, None)
+    assert index.played == {(10, 1): 3}
+    assert index.hosted[1] == 3 and index.hosted[2] == 0
+    assert index.hosted_genres[1]['Rock'] == 0
+    assert 11 not in index.played_places
+
+
+def test_apply_skips_the_shows_of_removed_entities(app, index):
+    state = MatchmakingState(app, db)
+    state.index = index
+    # a venue deleted with one of its shows, in one transaction
+    state.apply([('venue', 2, None)], {(11, 2): -1})
+    assert (11, 2) not in index.played
+    assert 2 not in index.hosted and 2 not in index.hosted_genres
+    assert index.played_places[11][('Oakland', 'CA')] == 0
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+from flask_migrate import upgrade
+from sqlalchemy import text
+
+from models import db, Artist, Genre, Venue
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+BASELINE = 'ed5ab10da399'
+
+
+@pytest.fixture
+def app(make_app):
+    # an empty database, its schema made by the migrations
+    return make_app(create_schema=False)
+
+
+def test_upgrade_backfills_genre_strings(app):
+    with app.app_context():
+        upgrade(MIGRATIONS, BASELINE)
+        db.session.execute(text(
+            'INSERT INTO "Venue" (id, name, city, state, address, genres) VALUES '
+            "(1, 'The Musical Hop', 'San Francisco', 'CA', '1015 Folsom Street', '{Jazz,Reggae,\"Rock n Roll\"}'), "
+            "(2, 'Park Square', 'San Francisco', 'CA', '34 Whiskey Moore Ave', '{}'), "
+            "(3, 'Empty', 'San Francisco', 'CA', '1 Main Street', NULL)"))
+        db.session.execute(text(
+            'INSERT INTO "Artist" (id, name, city, state, genres) VALUES '
+            "(1, 'Guns N Petals', 'San Francisco', 'CA', '{\"Rock n Roll\",\"Sea Shanty\",Jazz,Jazz}')"))
+        db.session.execute(text(
+            'INSERT INTO "Show" (id, artist_id, venue_id, start_time) VALUES (1, 1, 1, \'2035-04-01 20:00:00\')'))
+        db.session.commit()
+
+        upgrade(MIGRATIONS)
+        genres = lambda entity: sorted(g.name for g in entity.genres)
+        assert genres(db.session.get(Venue, 1)) == ['Jazz', 'Reggae', 'Rock n Roll']
+        assert genres(db.session.get(Venue, 2)) == []
+        assert genres(db.session.get(Venue, 3)) == []
+        # names outside the form's vocabulary are kept, duplicates linked once
+        assert genres(db.session.get(Artist, 1)) == ['Jazz', 'Rock n Roll', 'Sea Shanty']
+        assert Genre.query.filter_by(name='Sea Shanty').count() == 1
+        # and the later migrations carried the rows along
+        assert (db.session.get(Venue, 1).upcoming_shows_count, db.session.get(Artist, 1).upcoming_shows_count) == (1, 1)
@@ -0,0 +1,19 @@
+import pytest
+
+
+@pytest.mark.parametrize('path', ['/venues/99999', '/artists/99999'])
+def test_missing_page_is_not_found(client, catalog, path):
+    assert client.get(path).status_code == 404
+
+
+@pytest.mark.parametrize('path', ['/venues/99999', '/artists/99999'])
+def test_missing_page_with_flashed_messages_is_not_found(client, catalog, path):
+    # flashed messages skip the validator, the page itself finds nothing
+    with client.session_transaction() as session:
+        session['_flashes'] = [('message', 'Venue was deleted successfully')]
+    assert client.get(path).status_code == 404
+
+
+def test_pages_are_found(client, catalog):
+    assert client.get('/venues/{}'.format(catalog.venue_ids[0])).status_code == 200
+    assert client.get('/artists/{}'.format(catalog.artist_ids[0])).status_code == 200
@@ -0,0 +1,76 @@
+import shutil
+
+import pytest
+
+from app import create_app
+from conftest import app_config
+
+VENUE_FORM = dict(name='The Dueling Pianos Bar', city='New York', state='NY', address='335 Delancey Street',
+                  phone='914-003-1132', image_link='', facebook_link='', website_link='',
+                  seeking_description='', genres=['Classical'])
+
+
+@pytest.fixture
+def replicated(tmp_path, make_app):
+    # a primary SQLite file and a copy of it as the replica, which then lags:
+    # it never sees the writes made on the primary
+    def make_worker(create_schema=False):
+        app = make_app(create_schema, SQLALCHEMY_DATABASE_URI='sqlite:///{}'.format(tmp_path / 'primary.db'),
+                       SQLALCHEMY_REPLICA_URIS=['sqlite:///{}'.format(tmp_path / 'replica.db')],
+                       REPLICA_STICKY_SECONDS=60)
+        replicas = app.extensions['replicas']
+        replicas.check()
+        replicas.next_check = float('inf')
+        return app
+
+    app = make_worker(create_schema=True)
+    shutil.copy(tmp_path / 'primary.db', tmp_path / 'replica.db')
+    app.extensions['replicas'].check()
+    return make_worker, app
+
+
+def session_cookie(client):
+    return next(c.value for c in client.cookie_jar if c.name == 'session')
+
+
+def test_reads_go_to_the_replica(replicated):
+    _, app = replicated
+    writer, reader = app.test_client(), app.test_client()
+    writer.post('/venues/create', data=VENUE_FORM)
+
+    reads = app.extensions['replicas'].reads['replica1']
+    assert 'The Dueling Pianos Bar' not in reader.get('/venues').get_data(as_text=True)
+    assert app.extensions['replicas'].reads['replica1'] == reads + 1
+
+
+def test_writer_reads_from_the_primary(replicated):
+    _, app = replicated
+    writer = app.test_client()
+    writer.post('/venues/create', data=VENUE_FORM)
+
+    reads = app.extensions['replicas'].reads['replica1']
+    assert 'The Dueling Pianos Bar' in writer.get('/venues').get_data(as_text=True)
+    assert app.extensions['replicas'].reads['replica1'] == reads
+
+
+def test_writer_reads_from_the_primary_on_another_worker(replicated):
+    # the read-your-writes deadline is in the signed session cookie, which
+    # the other workers accept as they share SECRET_KEY
+    make_worker, app = replicated
+    writer = app.test_client()
+    writer.post('/venues/create', data=VENUE_FORM)
+
+    other = make_worker().test_client()
+    other.set_cookie('localhost', 'session', session_cookie(writer))
+    assert 'The Dueling Pianos Bar' in other.get('/venues').get_data(as_text=True)
+
+
+def test_secret_key_is_required_outside_debug(tmp_path):
+    config = app_config('sqlite:///{}'.format(tmp_path / 'fyyur.db'), SECRET_KEY=None, DEBUG=False)
+    with pytest.raises(RuntimeError, match='SECRET_KEY'):
+        create_app(config)
+
+
+def test_debug_falls_back_to_a_key_of_its_own(tmp_path):
+    config = app_config('sqlite:///{}'.format(tmp_path / 'fyyur.db'), SECRET_KEY=None, DEBUG=True)
+    assert create_app(config).secret_key
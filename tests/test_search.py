@@ -0,0 +1,30 @@
+from models import db, Venue
+
+
+def found(client, terms, kind=None):
+    args = {'q': terms, 'type': kind} if kind else {'q': terms}
+    return {(r['type'], r['id']) for r in client.get('/search.json', query_string=args).get_json()['results']}
+
+
+def test_venue_city_edit_reindexes_its_shows(app, client, catalog):
+    venue_id, other_venue_id = catalog.venue_ids
+    venue_shows = {('show', i) for i in catalog.show_ids[:4]}
+    other_shows = {('show', i) for i in catalog.show_ids[4:]}
+    assert found(client, 'francisco', 'show') == venue_shows | other_shows
+
+    with app.app_context():
+        db.session.get(Venue, venue_id).city = 'Oakland'
+        db.session.commit()
+
+    assert found(client, 'oakland') == {('venue', venue_id)} | venue_shows
+    assert found(client, 'francisco', 'show') == other_shows
+
+
+def test_diacritics_are_ignored(app, client):
+    with app.app_context():
+        venue = Venue(name='Café Zürich', city='San Francisco', state='CA', address='1 Market Street')
+        db.session.add(venue)
+        db.session.commit()
+        venue_id = venue.id
+    for terms in ('cafe', 'café', 'CAFÉ', 'zur', 'zür'):
+        assert found(client, terms) == {('venue', venue_id)}
@@ -0,0 +1,68 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from app import decode_show_cursor, encode_show_cursor
+from models import db, Artist, Show, Venue
+
+START = datetime(2030, 6, 1, 20, 0)
+
+
+@pytest.fixture
+def shows(app):
+    # five shows starting at the same time, at five venues with five
+    # artists, and two the day after. returns their ids in page order
+    with app.app_context():
+        venues = [Venue(name='Venue {}'.format(i), city='San Francisco', state='CA', address='{} Main Street'.format(i))
+                  for i in range(5)]
+        artists = [Artist(name='Artist {}'.format(i), city='San Francisco', state='CA') for i in range(5)]
+        db.session.add_all(venues + artists)
+        db.session.flush()
+        shows = [Show(venue_id=venue.id, artist_id=artist.id, start_time=START, end_time=START + timedelta(hours=2))
+                 for venue, artist in zip(venues, artists)]
+        later = START + timedelta(days=1)
+        shows += [Show(venue_id=venues[i].id, artist_id=artists[i].id, start_time=later, end_time=later + timedelta(hours=2))
+                  for i in (1, 0)]
+        db.session.add_all(shows)
+        db.session.commit()
+        return [s.id for s in sorted(shows, key=lambda s: (s.start_time, s.id))]
+
+
+def pages(client, limit):
+    # every /shows.json page, following next_cursor
+    found, after = [], None
+    while True:
+        args = {'limit': limit, 'after': after} if after else {'limit': limit}
+        page = client.get('/shows.json', query_string=args).get_json()
+        found.append([show['id'] for show in page['shows']])
+        after = page['next_cursor']
+        if after is None:
+            return found
+
+
+def test_pages_break_ties_on_the_id(client, shows):
+    found = pages(client, 2)
+    assert [len(page) for page in found] == [2, 2, 2, 1]
+    assert sum(found, []) == shows
+
+
+def test_last_full_page_has_no_cursor(client, shows):
+    assert pages(client, 7) == [shows]
+    assert [len(page) for page in pages(client, 5)] == [5, 2]
+
+
+def test_cursor_round_trip():
+    show = SimpleNamespace(start_time=START, id=42)
+    assert decode_show_cursor(encode_show_cursor(show)) == (START, 42)
+
+
+@pytest.mark.parametrize('cursor', [
+    'garbage', '_', '2030-13-01T20:00:00_1', '2030-06-01T20:00:00_x', '2030-06-01T20:00:00_-1',
+    '2030-06-01T20:00:00_99999999999999999999', '2030-06-01T20:00:00+02:00_1'])
+def test_invalid_cursors_are_rejected(client, cursor):
+    with pytest.raises(BadRequest):
+        decode_show_cursor(cursor)
+    assert client.get('/shows', query_string={'after': cursor}).status_code == 400
+    assert client.get('/shows.json', query_string={'after': cursor}).status_code == 400
@@ -0,0 +1,45 @@
+from models import db, Genre, Venue
+
+CITIES = [('San Francisco', 'CA'), ('New York', 'NY'), ('Austin', 'TX'), ('Seattle', 'WA')]
+
+
+def add_venues(app, start, n):
+    with app.app_context():
+        jazz, rock = Genre.from_names(['Jazz', 'Rock n Roll'])
+        db.session.add_all([
+            Venue(name='Venue {}'.format(i), city=CITIES[i % len(CITIES)][0], state=CITIES[i % len(CITIES)][1],
+                  genres=[jazz] if i % 2 else [rock], upcoming_shows_count=i % 3)
+            for i in range(start, start + n)])
+        db.session.commit()
+
+
+def directory_queries(client, path):
+    response = client.get(path)
+    assert response.status_code == 200
+    return int(response.headers['X-DB-Queries']), response.get_data(as_text=True)
+
+
+def test_directory_query_count_does_not_grow_with_venues(app, client):
+    add_venues(app, 0, 20)
+    client.get('/venues')
+    queries, page = directory_queries(client, '/venues')
+    assert queries <= 2
+    assert page.count('Venue ') >= 20
+
+    add_venues(app, 20, 20)
+    more_queries, page = directory_queries(client, '/venues')
+    assert more_queries == queries
+    assert all('Venue {}<'.format(i) in page for i in range(40))
+    for city, state in CITIES:
+        assert '{}, {}'.format(city, state) in page
+
+
+def test_genre_directory_query_count_does_not_grow_with_venues(app, client):
+    add_venues(app, 0, 20)
+    client.get('/venues?genre=Jazz')
+    queries, page = directory_queries(client, '/venues?genre=Jazz')
+
+    add_venues(app, 20, 20)
+    more_queries, page = directory_queries(client, '/venues?genre=Jazz')
+    assert more_queries == queries
+    assert 'Venue 39<' in page and 'Venue 38<' not in page